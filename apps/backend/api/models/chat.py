@@ -0,0 +1,38 @@
+"""
+Chat API models.
+
+Pydantic models for chatbot requests and responses.
+"""
+
+from pydantic import AliasChoices, BaseModel, Field
+from typing import List, Literal, Optional
+
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
+
+class ChatRequest(BaseModel):
+    message: str
+    # Optional client-generated ID that makes the conversation multi-turn
+    session_id: Optional[str] = Field(
+        None, pattern=SESSION_ID_PATTERN, validation_alias=AliasChoices("session_id", "sessionId")
+    )
+
+class ChatResponse(BaseModel):
+    response: str
+    sources: List[str] = []
+
+class ChatHistoryMessage(BaseModel):
+    id: str
+    content: str
+    sender: Literal["user", "ai"]
+    timestamp: str
+
+class IngestResponse(BaseModel):
+    message: str
+    documents_processed: int
+
+class StatusResponse(BaseModel):
+    status: str
+    backend: bool
+    database: bool
+    documents: int
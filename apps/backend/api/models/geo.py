@@ -0,0 +1,22 @@
+"""
+Geo API models.
+
+Pydantic models for batch geolocation requests and responses.
+"""
+
+from pydantic import BaseModel, Field
+from typing import Annotated, Any, Dict, List
+
+from backend.api.services.geo_service import GEO_CONFIG
+
+
+class GeoBatchRequest(BaseModel):
+    # Oversized batches are rejected during validation, before any IP is processed
+    ips: List[Annotated[str, Field(max_length=64)]] = Field(..., max_length=GEO_CONFIG["bulk_max_ips"])
+
+class GeoBatchResponse(BaseModel):
+    # Per-IP ipstack-shaped location, or {"error": ...} for IPs that could not be located
+    results: Dict[str, Dict[str, Any]]
+    unique_ips: int
+    cache_hits: int
+    upstream_requests: int
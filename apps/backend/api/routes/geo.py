@@ -2,15 +2,26 @@
 Geo location API routes.
 
 This module provides endpoints for retrieving visitor location information
-using the ipstack API.
+using the ipstack API or an offline IP-range database.
 """
 
-from fastapi import APIRouter, HTTPException
-from typing import Dict, Any, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from typing import Dict, Any, List, Optional
+import asyncio
 import httpx
 import os
+import secrets
 from dotenv import load_dotenv
 
+from backend.api.services.geo_service import (
+    geo_cache, get_client_ip, is_public_ip, normalize_ip, ipstack_breaker, ipstack_bulk_breaker, GEO_CONFIG
+)
+from backend.api.services.http_clients import create_http_client, get_ipstack_client
+from backend.api.services.geo_database import geo_database, GEO_DATABASE_CONFIG
+from backend.api.services.chatbot_service import rate_limiter
+from backend.api.utils.circuit_breaker import CircuitBreaker
+from backend.api.models.geo import GeoBatchRequest, GeoBatchResponse
+
 load_dotenv()
 
 router = APIRouter(prefix="/api", tags=["Geo"])
@@ -18,19 +29,194 @@ router = APIRouter(prefix="/api", tags=["Geo"])
 IPSTACK_KEY = os.getenv("IPSTACK_KEY")
 ENABLE_GEOLOCATION = os.getenv("ENABLE_GEOLOCATION", "true").lower() == "true"
 
+# Background refreshes of stale lookups, by IP
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+
+
+class IpstackRejected(HTTPException):
+    """ipstack answered but refused the lookup (invalid key, plan limit, quota) rather than failing"""
+
+
+async def fetch_location(client: httpx.AsyncClient, lookup: str) -> Dict[str, Any]:
+    """
+    Look up an IP with ipstack. `check` makes ipstack geolocate the address
+    the request comes from (this server), used for non-public client IPs.
+    """
+    try:
+        url = f"https://api.ipstack.com/{lookup}?access_key={IPSTACK_KEY}"
+        
+        # Shared client from the app lifespan: reuses warm keep-alive connections
+        response = await client.get(url)
+        
+        if not response.is_success:
+            error = HTTPException if response.is_server_error else IpstackRejected
+            raise error(
+                status_code=502,
+                detail="ipstack API returned an error"
+            )
+        
+        body = response.json()
+        
+        # ipstack reports errors (invalid key, quota) with a 200 status
+        if isinstance(body, dict) and body.get("success") is False:
+            raise IpstackRejected(
+                status_code=502,
+                detail="ipstack API returned an error"
+            )
+        
+        # Return the full response from ipstack
+        return body
+            
+    except httpx.TimeoutException:
+        raise HTTPException(
+            status_code=504,
+            detail="ipstack API request timeout"
+        )
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Failed to reach ipstack API: {str(e)}"
+        )
+    except HTTPException:
+        # Re-raise HTTPExceptions (they should propagate)
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Server error: {str(e)}"
+        )
+
+
+async def fetch_location_guarded(
+    client: httpx.AsyncClient,
+    lookup: str,
+    breaker: Optional[CircuitBreaker] = None,
+    count_rejections: bool = True,
+) -> Dict[str, Any]:
+    """
+    Look up an IP with ipstack through a circuit breaker (the visitor lookup
+    breaker by default), failing fast while it is open. With
+    `count_rejections=False` only transport errors, timeouts and 5xx responses
+    count as failures; a refused lookup shows ipstack is up.
+    """
+    breaker = breaker or ipstack_breaker
+    if not breaker.allow():
+        raise HTTPException(
+            status_code=503,
+            detail="ipstack API temporarily unavailable"
+        )
+    try:
+        body = await fetch_location(client, lookup)
+    except IpstackRejected:
+        if count_rejections:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        # Cancelled (client disconnect, timeout, shutdown): no verdict on ipstack
+        breaker.release_probe()
+        raise
+    breaker.record_success()
+    return body
+
+
+async def fetch_locations_bulk(client: httpx.AsyncClient, ips: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Look up several IPs in one ipstack bulk request, keyed by IP"""
+    body = await fetch_location_guarded(client, ",".join(ips), breaker=ipstack_bulk_breaker, count_rejections=False)
+    entries = body if isinstance(body, list) else [body]
+    locations = {}
+    for entry in entries:
+        ip = normalize_ip(str(entry.get("ip", ""))) if isinstance(entry, dict) else None
+        if ip is not None:
+            locations[ip] = entry
+    return locations
+
+
+async def refresh_location(app: Any, lookup: str):
+    """Refresh a stale cached lookup in the background"""
+    try:
+        clients = getattr(app.state, "http_clients", None)
+        if clients is not None:
+            body = await fetch_location_guarded(clients["ipstack"], lookup)
+        else:
+            async with create_http_client("ipstack") as client:
+                body = await fetch_location_guarded(client, lookup)
+        geo_cache.put(lookup, body)
+        geo_cache.record_refresh(success=True)
+    except Exception as e:
+        # Keep serving the stale lookup; the breaker has recorded the failure
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        print(f"[Main] Background refresh of {lookup} failed: {detail}", flush=True)
+        geo_cache.record_refresh(success=False)
+    finally:
+        _refresh_tasks.pop(lookup, None)
+
+
+def schedule_refresh(app: Any, lookup: str):
+    """Start a background refresh of a lookup unless one is already running"""
+    if lookup in _refresh_tasks:
+        return
+    task = asyncio.create_task(refresh_location(app, lookup))
+    _refresh_tasks[lookup] = task
+    task.add_done_callback(lambda done: _forget_refresh(lookup, done))
+
+
+def _forget_refresh(lookup: str, task: asyncio.Task):
+    """Drop a finished refresh, including one cancelled before it started running"""
+    if _refresh_tasks.get(lookup) is task:
+        del _refresh_tasks[lookup]
+
+
+async def lookup_ipstack(http_client: httpx.AsyncClient, lookup: str, app: Any) -> Dict[str, Any]:
+    """
+    Look up an IP with ipstack through the per-IP cache. Stale lookups are
+    returned immediately and refreshed in the background.
+    """
+    cached = geo_cache.get(lookup)
+    if cached is not None:
+        if cached.body is None:
+            raise HTTPException(status_code=cached.status_code, detail=cached.detail)
+        if cached.is_stale:
+            schedule_refresh(app, lookup)
+        return cached.body
+    
+    try:
+        body = await fetch_location_guarded(http_client, lookup)
+    except HTTPException as e:
+        if e.status_code in (502, 504):
+            geo_cache.put_error(lookup, e.status_code, e.detail)
+        raise
+    
+    geo_cache.put(lookup, body)
+    return body
+
 
 @router.get("/geo")
-async def get_visitor_location() -> Dict[str, Any]:
+async def get_visitor_location(
+    request: Request,
+    http_client: httpx.AsyncClient = Depends(get_ipstack_client),
+) -> Dict[str, Any]:
     """
-    Get visitor location information using ipstack API.
+    Get visitor location information.
     
-    The ipstack API automatically detects the requester's IP when using /check endpoint.
+    The visitor's IP is taken from the connection, or from X-Forwarded-For
+    when the connection comes from a trusted proxy (TRUSTED_PROXIES). With
+    GEO_BACKEND=local it is looked up in the offline IP-range database, with
+    ipstack as optional fallback; otherwise ipstack is queried. ipstack
+    lookups are cached per IP, failures briefly; expired lookups are served
+    stale while refreshed in the background, and a circuit breaker fails
+    fast while ipstack is down.
     
     Returns:
-        Full response from ipstack API containing location, timezone, currency, connection, and security information
+        Location with at least city, country_name, latitude and longitude
+        (the full ipstack response when answered by ipstack)
         
     Raises:
-        HTTPException: If ipstack API call fails or API key is missing
+        HTTPException: If the location is unknown, the ipstack API call fails or the API key is missing
     """
     # Check if geolocation feature is enabled
     if not ENABLE_GEOLOCATION:
@@ -39,47 +225,155 @@ async def get_visitor_location() -> Dict[str, Any]:
             detail="Geolocation feature is disabled"
         )
     
+    client_ip = get_client_ip(request)
+    
+    # Offline lookup: no network call on the page-load path
+    if GEO_DATABASE_CONFIG["backend"] == "local":
+        location = geo_database.lookup(client_ip) if is_public_ip(client_ip) else None
+        if location is not None:
+            return location
+        if not (GEO_DATABASE_CONFIG["ipstack_fallback"] and IPSTACK_KEY):
+            raise HTTPException(
+                status_code=404,
+                detail="Location not found for this IP"
+            )
+    
     if not IPSTACK_KEY:
         raise HTTPException(
             status_code=500,
             detail="IPSTACK_KEY not configured"
         )
     
-    try:
-        # ipstack automatically detects the requester's IP when using /check
-        # Get full response without field restrictions
-        url = f"https://api.ipstack.com/check?access_key={IPSTACK_KEY}"
+    # Private and loopback addresses (local development) use ipstack's own detection
+    lookup = client_ip if is_public_ip(client_ip) else "check"
+    return await lookup_ipstack(http_client, lookup, request.app)
+
+
+@router.post("/geo/batch", response_model=GeoBatchResponse)
+async def get_locations_batch(
+    batch: GeoBatchRequest,
+    request: Request,
+    http_client: httpx.AsyncClient = Depends(get_ipstack_client),
+    x_api_key: Optional[str] = Header(None),
+) -> GeoBatchResponse:
+    """
+    Geolocate a list of IPs, for analytics backfills.
+    
+    Callers must send the GEO_BATCH_API_KEY in the X-API-Key header (the
+    endpoint is disabled while no key is configured) and are limited to
+    GEO_BATCH_RATE_LIMIT batches per GEO_BATCH_RATE_WINDOW_MINUTES per IP.
+    IPs are deduplicated and answered from the offline database (GEO_BACKEND=local)
+    or the per-IP cache where possible; the rest are sent to ipstack in bulk
+    requests of GEO_BULK_CHUNK_SIZE IPs, at most GEO_BULK_CONCURRENCY at a time.
+    Batches of more than GEO_BULK_MAX_IPS IPs are rejected during validation.
+    
+    Returns:
+        GeoBatchResponse mapping each IP to its location or to {"error": ...}
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url)
-            
-            if not response.is_success:
-                raise HTTPException(
-                    status_code=502,
-                    detail="ipstack API returned an error"
-                )
-            
-            body = response.json()
-            
-            # Return the full response from ipstack
-            return body
-            
-    except httpx.TimeoutException:
+    Raises:
+        HTTPException: If geolocation or batch lookups are disabled, the API key is wrong or the rate limit is exceeded
+    """
+    if not ENABLE_GEOLOCATION:
         raise HTTPException(
-            status_code=504,
-            detail="ipstack API request timeout"
+            status_code=503,
+            detail="Geolocation feature is disabled"
         )
-    except httpx.RequestError as e:
+    
+    api_key = GEO_CONFIG["batch_api_key"]
+    if not api_key:
         raise HTTPException(
-            status_code=502,
-            detail=f"Failed to reach ipstack API: {str(e)}"
+            status_code=503,
+            detail="Batch geolocation is disabled (GEO_BATCH_API_KEY not configured)"
         )
-    except HTTPException:
-        # Re-raise HTTPExceptions (they should propagate)
-        raise
-    except Exception as e:
+    if not secrets.compare_digest((x_api_key or "").encode(), api_key.encode()):
         raise HTTPException(
-            status_code=500,
-            detail=f"Server error: {str(e)}"
+            status_code=401,
+            detail="Invalid or missing API key"
         )
+    
+    # Separate identifier, so exceeding the batch limit does not block the IP from chatting
+    allowed, message = await rate_limiter.acheck_rate_limit(
+        f"geo-batch:{get_client_ip(request)}",
+        max_requests=GEO_CONFIG["batch_rate_limit"],
+        window_minutes=GEO_CONFIG["batch_rate_window_minutes"],
+    )
+    if not allowed:
+        raise HTTPException(status_code=429, detail=message)
+    
+    unique = list(dict.fromkeys(normalize_ip(ip) or ip for ip in batch.ips))
+    
+    results: Dict[str, Dict[str, Any]] = {}
+    misses: List[str] = []
+    cache_hits = 0
+    use_local = GEO_DATABASE_CONFIG["backend"] == "local"
+    for ip in unique:
+        if normalize_ip(ip) is None:
+            results[ip] = {"error": "Invalid IP address"}
+            continue
+        if not is_public_ip(ip):
+            results[ip] = {"error": "Not a public IP address"}
+            continue
+        if use_local:
+            location = geo_database.lookup(ip)
+            if location is not None:
+                results[ip] = location
+                cache_hits += 1
+                continue
+            if not GEO_DATABASE_CONFIG["ipstack_fallback"]:
+                results[ip] = {"error": "Location not found for this IP"}
+                continue
+        cached = geo_cache.get(ip)
+        if cached is not None:
+            results[ip] = cached.body if cached.body is not None else {"error": cached.detail}
+            cache_hits += 1
+            continue
+        misses.append(ip)
+    
+    chunk_size = max(1, GEO_CONFIG["bulk_chunk_size"])
+    chunks = [misses[i:i + chunk_size] for i in range(0, len(misses), chunk_size)] if IPSTACK_KEY else []
+    semaphore = asyncio.Semaphore(max(1, GEO_CONFIG["bulk_concurrency"]))
+    
+    async def fetch_chunk(chunk: List[str]):
+        async with semaphore:
+            try:
+                locations = await fetch_locations_bulk(http_client, chunk)
+            except HTTPException as e:
+                for ip in chunk:
+                    results[ip] = {"error": e.detail}
+                    if e.status_code in (502, 504):
+                        geo_cache.put_error(ip, e.status_code, e.detail)
+                return
+        for ip in chunk:
+            location = locations.get(ip)
+            if location is None:
+                results[ip] = {"error": "ipstack API returned no result for this IP"}
+                continue
+            geo_cache.put(ip, location)
+            results[ip] = location
+    
+    if misses and not IPSTACK_KEY:
+        for ip in misses:
+            results[ip] = {"error": "IPSTACK_KEY not configured"}
+    await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks))
+    
+    return GeoBatchResponse(
+        results={ip: results[ip] for ip in unique},
+        unique_ips=len(unique),
+        cache_hits=cache_hits,
+        upstream_requests=len(chunks),
+    )
+
 
+@router.get("/geo/stats")
+async def geo_stats() -> Dict[str, Any]:
+    """Return geolocation cache, circuit breaker and offline database counters"""
+    return {
+        "cache": geo_cache.get_stats(),
+        "circuit_breaker": ipstack_breaker.get_stats(),
+        "bulk_circuit_breaker": ipstack_bulk_breaker.get_stats(),
+        "refreshes_in_flight": len(_refresh_tasks),
+        "database": {
+            "backend": GEO_DATABASE_CONFIG["backend"],
+            **geo_database.get_stats(),
+        },
+    }
@@ -0,0 +1,221 @@
+"""
+Precomputed answer store for frequent chatbot questions.
+
+The head of the query distribution is predictable (experience, skills,
+projects, education, hobbies), so answers to those questions are generated
+during ingestion and stored with their source chunk IDs and the index
+version they were built from. The chat endpoint serves them instantly when
+a message matches, exactly or by embedding similarity.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from backend.api.services.embedding_cache import normalize_query
+
+# Precomputed answer configuration
+ANSWER_STORE_CONFIG = {
+    "enabled": os.getenv("PRECOMPUTED_ANSWERS_ENABLED", "true").lower() == "true",
+    "similarity_threshold": float(os.getenv("PRECOMPUTED_ANSWER_SIMILARITY", "0.93")),
+    # Newline-separated question list used instead of DEFAULT_QUESTIONS
+    "questions_file": os.getenv("PRECOMPUTED_QUESTIONS_FILE", ""),
+    # Append normalized chat messages to this file so frequent questions can be mined
+    "query_log_enabled": os.getenv("QUERY_LOG_ENABLED", "false").lower() == "true",
+    "query_log_path": os.getenv("QUERY_LOG_PATH", str(Path(__file__).parent.parent.parent / "logs" / "chat_queries.log")),
+    # Logged messages are buffered in memory and appended to the file in batches of this many
+    "query_log_flush_lines": int(os.getenv("QUERY_LOG_FLUSH_LINES", "50")),
+}
+
+DEFAULT_QUESTIONS = [
+    "What is Diego's work experience?",
+    "What are Diego's skills?",
+    "What technologies does Diego work with?",
+    "What projects has Diego built?",
+    "What is Diego's education?",
+    "What are Diego's hobbies?",
+    "Who is Diego Beuk?",
+    "What are Diego's career goals?",
+]
+
+_query_log_lock = threading.Lock()
+_query_log_file_lock = threading.Lock()
+_query_log_buffer: List[str] = []
+
+
+def load_questions(path: Optional[str] = None) -> List[str]:
+    """Load the question list from a newline-separated file, or use the defaults"""
+    path = path or ANSWER_STORE_CONFIG["questions_file"]
+    if not path:
+        return list(DEFAULT_QUESTIONS)
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def log_query(message: str):
+    """
+    Buffer a normalized chat message for the query log (if enabled). A full
+    buffer is written on the default executor, off the event loop.
+    """
+    if not ANSWER_STORE_CONFIG["query_log_enabled"]:
+        return
+    with _query_log_lock:
+        _query_log_buffer.append(normalize_query(message).replace("\n", " ") + "\n")
+        full = len(_query_log_buffer) >= ANSWER_STORE_CONFIG["query_log_flush_lines"]
+    if full:
+        try:
+            asyncio.get_running_loop().run_in_executor(None, flush_query_log)
+        except RuntimeError:
+            flush_query_log()
+
+
+def flush_query_log() -> int:
+    """Append the buffered messages to the query log file (blocking). Returns the number written."""
+    with _query_log_lock:
+        lines = list(_query_log_buffer)
+        _query_log_buffer.clear()
+    if not lines:
+        return 0
+    try:
+        path = Path(ANSWER_STORE_CONFIG["query_log_path"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with _query_log_file_lock, open(path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+    except OSError as e:
+        print(f"[Chatbot] Could not write query log: {e}", flush=True)
+        return 0
+    return len(lines)
+
+
+async def run_query_log_flusher(interval_seconds: float = 10.0):
+    """Write buffered query log messages periodically until cancelled"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await loop.run_in_executor(None, flush_query_log)
+
+
+def mine_frequent_questions(path: Optional[str] = None, top_n: int = 20, min_count: int = 2) -> List[str]:
+    """Return the most frequent normalized questions from the query log"""
+    path = Path(path or ANSWER_STORE_CONFIG["query_log_path"])
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        counts = Counter(line.strip() for line in f if line.strip())
+    return [question for question, count in counts.most_common(top_n) if count >= min_count]
+
+
+class PrecomputedAnswerStore:
+    """Answers generated ahead of time, matched by normalized text or embedding similarity"""
+
+    def __init__(self):
+        self.entries: List[Dict[str, Any]] = []
+        self.by_question: Dict[str, int] = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.index_version: Optional[str] = None
+        self.generated_at: Optional[float] = None
+        self.loaded = False
+        self.hits = 0
+        self._file_mtime: Optional[int] = None
+
+    @property
+    def size(self) -> int:
+        """Number of stored answers"""
+        return len(self.entries)
+
+    def set_entries(self, entries: List[Dict[str, Any]], index_version: Optional[str], generated_at: Optional[float] = None):
+        """Replace all stored answers"""
+        vectors = [np.asarray(entry["embedding"], dtype=np.float32) for entry in entries if entry.get("embedding")]
+        if vectors and len(vectors) == len(entries):
+            matrix = np.stack(vectors)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        self.entries = entries
+        self.by_question = {normalize_query(entry["question"]): i for i, entry in enumerate(entries)}
+        self.matrix = matrix
+        self.index_version = index_version
+        self.generated_at = generated_at or time.time()
+        self.loaded = True
+
+    def save(self, path: Path):
+        """Persist the answers as JSON next to the Chroma collection"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "index_version": self.index_version,
+                "generated_at": self.generated_at,
+                "entries": self.entries,
+            }, f)
+        os.replace(tmp_path, path)
+
+    def refresh(self, path: Path) -> bool:
+        """(Re)load the answers if the file changed since the last load"""
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._file_mtime:
+            return False
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.set_entries(data.get("entries", []), data.get("index_version"), data.get("generated_at"))
+        self._file_mtime = mtime
+        print(f"[Chatbot] Loaded {self.size} precomputed answers (version {self.index_version})", flush=True)
+        return True
+
+    def match_exact(self, message: str, index_version: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Find an answer whose question matches the message after normalization"""
+        if index_version != self.index_version:
+            return None
+        idx = self.by_question.get(normalize_query(message))
+        if idx is None:
+            return None
+        self.hits += 1
+        return self.entries[idx]
+
+    def match_similar(self, embedding: Sequence[float], query_type: str, index_version: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Find an answer to a question of the same query type with a similar embedding"""
+        if index_version != self.index_version or self.matrix.shape[0] == 0:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = self.matrix @ query
+        for idx in np.argsort(-scores):
+            if scores[idx] < ANSWER_STORE_CONFIG["similarity_threshold"]:
+                break
+            if self.entries[idx]["query_type"] == query_type:
+                self.hits += 1
+                return self.entries[idx]
+        return None
+
+    def is_current(self, questions: Sequence[str], index_version: Optional[str]) -> bool:
+        """Whether the stored answers were built from this index version for exactly these questions"""
+        if not self.loaded or index_version is None or index_version != self.index_version:
+            return False
+        return set(self.by_question) == {normalize_query(question) for question in questions}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store information as dictionary"""
+        return {
+            "enabled": ANSWER_STORE_CONFIG["enabled"],
+            "answers": self.size,
+            "hits": self.hits,
+            "index_version": self.index_version,
+            "generated_at": self.generated_at,
+        }
+
+
+answer_store = PrecomputedAnswerStore()
@@ -11,30 +11,48 @@ import os
 import asyncio
 import sys
 from pathlib import Path
-from typing import Optional, List, Tuple, Any
+from typing import Optional, List, Tuple, Any, Dict
 from datetime import datetime, timedelta
-from collections import defaultdict
 import tiktoken
 from uuid import uuid4
 import threading
 import time
+import sqlite3
+import httpx
 
 from langchain_openai import ChatOpenAI
 from langchain_openai.embeddings import OpenAIEmbeddings
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
 import chromadb
-from langchain_community.document_loaders import (
-    PyPDFDirectoryLoader,
-    DirectoryLoader,
-    TextLoader
-)
 from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
 
+from backend.api.services.vector_index import vector_index, VECTOR_INDEX_CONFIG
+from backend.api.services.lexical_index import lexical_index, HYBRID_CONFIG
+from backend.api.services.shared_state import SQLiteSharedState, get_shared_state
+from backend.api.services.ingest_manifest import IngestManifest, hash_file
+from backend.api.services.embedding_cache import content_hash, with_document_embedding_cache
+from backend.api.services.document_loader import iter_files
+from backend.api.services.ingest_pipeline import (
+    embed_and_write, atoken_batches, PipelineStats, INGEST_PIPELINE_CONFIG
+)
+
 # Path configuration
 backend_dir = Path(__file__).parent.parent.parent
 project_root = backend_dir.parent.parent
 DATA_PATH = project_root / "data"
 CHROMA_PATH = backend_dir / "chroma_db"
+INDEX_VERSION_PATH = CHROMA_PATH / "index_version"
+LEXICAL_INDEX_PATH = CHROMA_PATH / "lexical_index.json"
+PRECOMPUTED_ANSWERS_PATH = CHROMA_PATH / "precomputed_answers.json"
+INGEST_MANIFEST_PATH = CHROMA_PATH / "ingest_manifest.json"
+
+# Data files picked up by ingestion: file extension -> document type
+DATA_FILE_TYPES = {
+    ".pdf": "PDF",
+    ".txt": "text",
+    ".md": "markdown",
+}
 
 # RAG Configuration - optimized for performance
 RAG_CONFIG = {
@@ -42,6 +60,7 @@ RAG_CONFIG = {
     "chunk_overlap": 175,
     "embedding_model": "text-embedding-3-small",
     "retrieval_k": 4,
+    "min_filtered_results": 4,
     "mmr_enabled": False,
     "mmr_lambda": 0.5,
     "temperature": {
@@ -51,10 +70,28 @@ RAG_CONFIG = {
     },
 }
 
+# LLM client configuration - one long-lived client per temperature profile
+LLM_CONFIG = {
+    "model": "gpt-4o-mini",
+    "top_p": 0.9,
+    "frequency_penalty": 0.3,
+    "http_max_connections": int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20")),
+    "http_max_keepalive_connections": int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "10")),
+    "http_keepalive_expiry": float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60")),
+    "http_timeout": float(os.getenv("LLM_HTTP_TIMEOUT", "60")),
+}
+
 # Global components
 llm: Optional[ChatOpenAI] = None
+llm_clients: Dict[str, ChatOpenAI] = {}
+_openai_http_client: Optional[httpx.Client] = None
+_openai_http_async_client: Optional[httpx.AsyncClient] = None
 vector_store: Optional[Chroma] = None
 retriever: Optional[Any] = None
+category_retrievers: Dict[str, "VectorRetriever"] = {}
+fallback_retriever: Optional["VectorRetriever"] = None
+_serving_index_reload: Optional[asyncio.Future] = None
+_serving_index_attempted_version: Optional[str] = None
 embeddings_model: Optional[OpenAIEmbeddings] = None
 _chroma_client: Optional[chromadb.PersistentClient] = None
 _client_lock = threading.Lock()
@@ -68,6 +105,35 @@ def get_chroma_client() -> chromadb.PersistentClient:
             _chroma_client = chromadb.PersistentClient(path=str(CHROMA_PATH))
         return _chroma_client
 
+# Index version tracking - changes every time documents are (re-)ingested
+_index_version_cache: Tuple[Optional[int], Optional[str]] = (None, None)
+
+
+def get_index_version() -> Optional[str]:
+    """
+    Get the current document index version.
+    Reads the version file only when its modification time changes, so this is
+    cheap enough to call on every request. Ingestion may run in another process.
+    """
+    global _index_version_cache
+    try:
+        mtime = INDEX_VERSION_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
+    if _index_version_cache[0] != mtime:
+        _index_version_cache = (mtime, INDEX_VERSION_PATH.read_text(encoding="utf-8").strip())
+    return _index_version_cache[1]
+
+
+def bump_index_version() -> str:
+    """Record a new document index version after ingestion"""
+    version = f"{int(time.time())}-{uuid4().hex[:8]}"
+    CHROMA_PATH.mkdir(parents=True, exist_ok=True)
+    INDEX_VERSION_PATH.write_text(version, encoding="utf-8")
+    print(f"[Chatbot] Index version is now {version}", flush=True)
+    return version
+
+
 # State tracking
 class ChatbotState:
     """Track chatbot initialization and readiness state"""
@@ -131,6 +197,7 @@ class TokenManager:
         self.max_input_tokens = 1500
         self.max_output_tokens = 500
         self.max_context_tokens = 3000
+        self.separator_tokens = self.count_tokens("\n\n")
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
@@ -138,6 +205,9 @@ class TokenManager:
     
     def validate_input(self, text: str) -> Tuple[bool, str]:
         """Validate input doesn't exceed token limits"""
+        # Every BPE token covers at least one byte, so short inputs need no encoding
+        if len(text.encode("utf-8")) <= self.max_input_tokens:
+            return True, ""
         token_count = self.count_tokens(text)
         if token_count > self.max_input_tokens:
             return False, f"Input exceeds {self.max_input_tokens} tokens ({token_count} tokens)"
@@ -150,47 +220,360 @@ class TokenManager:
             truncated_tokens = tokens[:self.max_context_tokens]
             return self.encoder.decode(truncated_tokens)
         return context
+    
+    def chunk_tokens(self, doc: Document) -> int:
+        """Token count of a chunk, stored at ingest (counted here for older chunks)"""
+        token_count = doc.metadata.get("token_count")
+        if token_count is None:
+            token_count = self.count_tokens(doc.page_content)
+        return int(token_count)
+    
+    def pack_chunks(self, docs: List[Document], max_tokens: Optional[int] = None) -> List[Document]:
+        """
+        Greedily pack whole chunks, in relevance order, into the context budget.
+        Chunks that don't fit are skipped; the top chunk is truncated only if
+        it exceeds the budget on its own.
+        """
+        budget = self.max_context_tokens if max_tokens is None else max_tokens
+        packed = []
+        used = 0
+        for doc in docs:
+            cost = self.chunk_tokens(doc) + self.separator_tokens
+            if used + cost <= budget:
+                packed.append(doc)
+                used += cost
+        if not packed and docs:
+            top = docs[0]
+            packed = [Document(
+                id=top.id,
+                page_content=self.encoder.decode(self.encoder.encode(top.page_content)[:budget]),
+                metadata=top.metadata,
+            )]
+        return packed
 
 token_manager = TokenManager()
 
 
 # Rate Limiting
+class _TokenBucket:
+    """Remaining request tokens of one client for one limit"""
+    __slots__ = ("tokens", "updated")
+    
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
 class RateLimiter:
-    """Rate limit requests per IP"""
+    """
+    Rate limit requests per IP with token buckets.
+    Each limit allows bursts of `max_requests` and refills at
+    `max_requests` per window. Exhausting a bucket blocks the IP for
+    `block_minutes`. State per key is constant size, and idle keys are
+    swept, so memory stays bounded under scanning traffic.
+    """
     
-    def __init__(self):
-        self.requests = defaultdict(list)
-        self.blocked_ips = {}
+    def __init__(self, block_minutes: int = 5, shared_state: Optional[SQLiteSharedState] = None):
+        self.block_seconds = block_minutes * 60
+        # Keeps the buckets in SQLite so all worker processes enforce the same limits
+        self.shared_state = shared_state
+        self.buckets: Dict[Tuple[str, int, int], _TokenBucket] = {}
+        self.blocked_ips: Dict[str, float] = {}
+        self.allowed = 0
+        self.rejected = 0
+        self.blocks = 0
+        self.swept = 0
     
     def check_rate_limit(self, identifier: str, max_requests: int = 20, window_minutes: int = 1) -> Tuple[bool, str]:
         """Check if request is within rate limits"""
-        now = datetime.now()
+        if self.shared_state is not None:
+            return self._check_shared(identifier, max_requests, window_minutes)
+        now = time.monotonic()
         
         # Check if IP is blocked
-        if identifier in self.blocked_ips:
-            blocked_until = self.blocked_ips[identifier]
+        blocked_until = self.blocked_ips.get(identifier)
+        if blocked_until is not None:
             if now < blocked_until:
-                return False, f"Blocked until {blocked_until.strftime('%H:%M:%S')}"
-            else:
-                del self.blocked_ips[identifier]
+                self.rejected += 1
+                until = datetime.now() + timedelta(seconds=blocked_until - now)
+                return False, f"Blocked until {until.strftime('%H:%M:%S')}"
+            del self.blocked_ips[identifier]
         
-        # Clean old requests
-        cutoff = now - timedelta(minutes=window_minutes)
-        self.requests[identifier] = [
-            req_time for req_time in self.requests[identifier]
-            if req_time > cutoff
-        ]
+        # Refill the bucket for the time since the last request
+        key = (identifier, max_requests, window_minutes)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = _TokenBucket(float(max_requests), now)
+        else:
+            rate = max_requests / (window_minutes * 60)
+            bucket.tokens = min(float(max_requests), bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
         
         # Check rate limit
-        if len(self.requests[identifier]) >= max_requests:
-            self.blocked_ips[identifier] = now + timedelta(minutes=5)
+        if bucket.tokens < 1:
+            self.blocked_ips[identifier] = now + self.block_seconds
+            del self.buckets[key]
+            self.rejected += 1
+            self.blocks += 1
             return False, f"Rate limit exceeded: {max_requests} requests per {window_minutes} minute(s)"
         
-        # Log request
-        self.requests[identifier].append(now)
+        bucket.tokens -= 1
+        self.allowed += 1
         return True, ""
+    
+    async def acheck_rate_limit(self, identifier: str, max_requests: int = 20, window_minutes: int = 1) -> Tuple[bool, str]:
+        """check_rate_limit for the request path: shared buckets are updated off the event loop"""
+        if self.shared_state is None:
+            return self.check_rate_limit(identifier, max_requests, window_minutes)
+        try:
+            status, blocked_until = await asyncio.to_thread(
+                self.shared_state.take_token, identifier, max_requests, window_minutes * 60, self.block_seconds
+            )
+        except sqlite3.OperationalError as e:
+            # Another worker held the write lock past the busy timeout; let the request through
+            print(f"[Chatbot] Shared rate limit check failed, allowing request: {e}", flush=True)
+            self.allowed += 1
+            return True, ""
+        return self._shared_result(status, blocked_until, max_requests, window_minutes)
+    
+    def _check_shared(self, identifier: str, max_requests: int, window_minutes: int) -> Tuple[bool, str]:
+        """Check the rate limit against the buckets shared between workers"""
+        status, blocked_until = self.shared_state.take_token(
+            identifier, max_requests, window_minutes * 60, self.block_seconds
+        )
+        return self._shared_result(status, blocked_until, max_requests, window_minutes)
+    
+    def _shared_result(self, status: str, blocked_until: Optional[float], max_requests: int,
+                       window_minutes: int) -> Tuple[bool, str]:
+        """Count and describe the outcome of a shared bucket check"""
+        if status == "allowed":
+            self.allowed += 1
+            return True, ""
+        self.rejected += 1
+        if status == "blocked":
+            return False, f"Blocked until {datetime.fromtimestamp(blocked_until).strftime('%H:%M:%S')}"
+        self.blocks += 1
+        return False, f"Rate limit exceeded: {max_requests} requests per {window_minutes} minute(s)"
+    
+    def sweep(self) -> int:
+        """Drop expired blocks and buckets that have refilled completely (same as no state)"""
+        if self.shared_state is not None:
+            removed = self.shared_state.sweep_rate_limits()
+            self.swept += removed
+            return removed
+        now = time.monotonic()
+        expired_blocks = [ip for ip, until in self.blocked_ips.items() if now >= until]
+        for ip in expired_blocks:
+            del self.blocked_ips[ip]
+        
+        idle_buckets = [
+            key for key, bucket in self.buckets.items()
+            if bucket.tokens + (now - bucket.updated) * key[1] / (key[2] * 60) >= key[1]
+        ]
+        for key in idle_buckets:
+            del self.buckets[key]
+        
+        removed = len(expired_blocks) + len(idle_buckets)
+        self.swept += removed
+        return removed
+    
+    async def run_sweeper(self, interval_seconds: float = 60.0):
+        """Sweep idle keys periodically until cancelled (shared buckets off the event loop)"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            if self.shared_state is None:
+                self.sweep()
+                continue
+            try:
+                await asyncio.to_thread(self.sweep)
+            except sqlite3.OperationalError as e:
+                # Another worker held the write lock; the next sweep catches up
+                print(f"[Chatbot] Shared rate limit sweep failed: {e}", flush=True)
+    
+    async def aget_stats(self) -> Dict[str, Any]:
+        """get_stats for the request path: shared counts are read off the event loop"""
+        if self.shared_state is None:
+            return self.get_stats()
+        try:
+            counts = await asyncio.to_thread(self.shared_state.rate_limit_counts)
+        except sqlite3.OperationalError as e:
+            print(f"[Chatbot] Could not read shared rate limit counts, using this worker's: {e}", flush=True)
+            counts = (len(self.buckets), len(self.blocked_ips))
+        return self.get_stats(counts)
+    
+    def get_stats(self, counts: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+        """Get rate limiter counters as dictionary (counters are per worker process)"""
+        if counts is not None:
+            tracked_keys, blocked_clients = counts
+        elif self.shared_state is not None:
+            tracked_keys, blocked_clients = self.shared_state.rate_limit_counts()
+        else:
+            tracked_keys, blocked_clients = len(self.buckets), len(self.blocked_ips)
+        return {
+            "shared": self.shared_state is not None,
+            "tracked_keys": tracked_keys,
+            "blocked_clients": blocked_clients,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "blocks": self.blocks,
+            "swept": self.swept,
+        }
+
+rate_limiter = RateLimiter(shared_state=get_shared_state())
+
+
+class VectorRetriever:
+    """
+    Search for documents by a precomputed query embedding.
+    An optional category list is applied inside the search (a Chroma `where`
+    filter, or a category mask on the in-memory index) instead of
+    over-fetching and filtering in Python.
+    """
+    
+    def __init__(self, store: Chroma, k: int, categories: Optional[List[str]] = None):
+        self.store = store
+        self.k = k
+        self.categories = categories
+        self.filter = {"category": {"$in": categories}} if categories else None
+    
+    async def asearch(self, embedding: List[float]) -> List[Any]:
+        """Return the top-k documents for a query embedding"""
+        if RAG_CONFIG["mmr_enabled"]:
+            return await self.store.amax_marginal_relevance_search_by_vector(
+                embedding, k=self.k, lambda_mult=RAG_CONFIG["mmr_lambda"], filter=self.filter
+            )
+        if VECTOR_INDEX_CONFIG["mode"] == "memory" and vector_index.loaded:
+            return vector_index.search(embedding, self.k, self.categories)
+        return await self.store.asimilarity_search_by_vector(embedding, k=self.k, filter=self.filter)
+
+
+def build_retrievers(store: Chroma) -> Tuple[Dict[str, VectorRetriever], VectorRetriever]:
+    """Build the category-filtered retriever for each query type, plus an unfiltered fallback"""
+    filtered = {
+        query_type: VectorRetriever(store, RAG_CONFIG["retrieval_k"], get_relevant_categories(query_type))
+        for query_type in RAG_CONFIG["temperature"]
+    }
+    return filtered, VectorRetriever(store, RAG_CONFIG["retrieval_k"])
+
+
+async def get_documents_by_ids(ids: List[str]) -> List[Document]:
+    """Fetch chunks by id, in the given order, from the in-memory index or Chroma"""
+    if not ids:
+        return []
+    if VECTOR_INDEX_CONFIG["mode"] == "memory" and vector_index.loaded:
+        return vector_index.get(ids)
+    if vector_store is None:
+        return []
+    docs = {doc.id: doc for doc in await vector_store.aget_by_ids(ids)}
+    return [docs[chunk_id] for chunk_id in ids if chunk_id in docs]
+
+
+def build_lexical_index(index_version: Optional[str] = None) -> bool:
+    """Build the BM25 inverted index from the Chroma collection and save it next to it (blocking)"""
+    if vector_store is None:
+        return False
+    try:
+        lexical_index.build_from_collection(vector_store._collection, index_version)
+        lexical_index.save(LEXICAL_INDEX_PATH)
+        print(f"[Chatbot] Lexical index built: {lexical_index.size} chunks, {len(lexical_index.postings)} terms", flush=True)
+        return True
+    except Exception as e:
+        error_str = str(e).encode('ascii', 'replace').decode('ascii')
+        print(f"[Chatbot] Could not build lexical index: {error_str[:200]}", flush=True)
+        return False
+
+
+def load_serving_indexes():
+    """
+    Load the in-memory vector index and the lexical index for the current
+    index version (blocking). A missing or outdated lexical index file is
+    rebuilt from the Chroma collection.
+    """
+    global _serving_index_attempted_version
+    if vector_store is None:
+        return
+    version = get_index_version()
+    _serving_index_attempted_version = version
+    
+    if VECTOR_INDEX_CONFIG["mode"] == "memory":
+        try:
+            vector_index.load(vector_store._collection, version)
+            print(f"[Chatbot] In-memory vector index loaded: {vector_index.size} chunks (version {version})", flush=True)
+        except Exception as e:
+            error_str = str(e).encode('ascii', 'replace').decode('ascii')
+            print(f"[Chatbot] Could not load in-memory vector index, using Chroma: {error_str[:200]}", flush=True)
+    
+    if HYBRID_CONFIG["enabled"]:
+        try:
+            if lexical_index.load(LEXICAL_INDEX_PATH) and lexical_index.index_version == version:
+                print(f"[Chatbot] Lexical index loaded: {lexical_index.size} chunks (version {version})", flush=True)
+            else:
+                build_lexical_index(version)
+        except Exception as e:
+            error_str = str(e).encode('ascii', 'replace').decode('ascii')
+            print(f"[Chatbot] Could not load lexical index, rebuilding: {error_str[:200]}", flush=True)
+            build_lexical_index(version)
+
+
+def refresh_serving_indexes_if_stale():
+    """Reload the serving indexes in the background when the index version changes"""
+    global _serving_index_reload
+    version = get_index_version()
+    if version == _serving_index_attempted_version:
+        return
+    if _serving_index_reload is not None and not _serving_index_reload.done():
+        return
+    print(f"[Chatbot] Index version changed to {version}, reloading serving indexes...", flush=True)
+    loop = asyncio.get_running_loop()
+    _serving_index_reload = loop.run_in_executor(None, load_serving_indexes)
+
+
+def create_openai_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """Create the keep-alive HTTP connection pools shared by all OpenAI clients"""
+    limits = httpx.Limits(
+        max_connections=LLM_CONFIG["http_max_connections"],
+        max_keepalive_connections=LLM_CONFIG["http_max_keepalive_connections"],
+        keepalive_expiry=LLM_CONFIG["http_keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(LLM_CONFIG["http_timeout"], connect=10.0)
+    return (
+        httpx.Client(limits=limits, timeout=timeout),
+        httpx.AsyncClient(limits=limits, timeout=timeout),
+    )
+
+
+def create_llm_clients(http_client: httpx.Client, http_async_client: httpx.AsyncClient) -> Dict[str, ChatOpenAI]:
+    """Create one ChatOpenAI client per temperature profile, sharing one connection pool"""
+    return {
+        query_type: ChatOpenAI(
+            temperature=temperature,
+            model=LLM_CONFIG["model"],
+            max_tokens=token_manager.max_output_tokens,
+            top_p=LLM_CONFIG["top_p"],
+            frequency_penalty=LLM_CONFIG["frequency_penalty"],
+            http_client=http_client,
+            http_async_client=http_async_client,
+            # Include token usage (and cached prompt tokens) in streamed responses
+            stream_usage=True,
+        )
+        for query_type, temperature in RAG_CONFIG["temperature"].items()
+    }
+
+
+def get_llm(query_type: str) -> ChatOpenAI:
+    """Get the warm LLM client for a query type (conversational profile by default)"""
+    return llm_clients.get(query_type, llm)
 
-rate_limiter = RateLimiter()
+
+async def close_llm_clients():
+    """Close the shared OpenAI connection pools"""
+    global _openai_http_client, _openai_http_async_client
+    if _openai_http_async_client is not None:
+        await _openai_http_async_client.aclose()
+        _openai_http_async_client = None
+    if _openai_http_client is not None:
+        _openai_http_client.close()
+        _openai_http_client = None
 
 
 def initialize_core_components() -> bool:
@@ -198,7 +581,9 @@ def initialize_core_components() -> bool:
     Initialize core chatbot components (LLM, embeddings, vector store).
     This is fast (~1-2 seconds) and should be done synchronously.
     """
-    global llm, vector_store, retriever, embeddings_model
+    global llm, llm_clients, vector_store, retriever, embeddings_model
+    global category_retrievers, fallback_retriever
+    global _openai_http_client, _openai_http_async_client
     
     try:
         print("[Chatbot] Initializing core components...", flush=True)
@@ -220,18 +605,19 @@ def initialize_core_components() -> bool:
             import warnings
             warnings.filterwarnings("ignore", message=".*LangSmith now uses UUID v7.*")
         
-        # Initialize LLM
-        llm = ChatOpenAI(
-            temperature=RAG_CONFIG["temperature"]["conversational"],
-            model='gpt-4o-mini',
-            max_tokens=500,
-            top_p=0.9,
-            frequency_penalty=0.3,
-        )
-        print("[Chatbot] LLM initialized", flush=True)
+        # Initialize shared connection pools and one LLM client per temperature profile
+        if _openai_http_client is None or _openai_http_async_client is None:
+            _openai_http_client, _openai_http_async_client = create_openai_http_clients()
+        llm_clients = create_llm_clients(_openai_http_client, _openai_http_async_client)
+        llm = llm_clients["conversational"]
+        print(f"[Chatbot] LLM clients initialized: {', '.join(llm_clients)}", flush=True)
         
         # Initialize embeddings
-        embeddings_model = OpenAIEmbeddings(model=RAG_CONFIG["embedding_model"])
+        embeddings_model = OpenAIEmbeddings(
+            model=RAG_CONFIG["embedding_model"],
+            http_client=_openai_http_client,
+            http_async_client=_openai_http_async_client,
+        )
         print("[Chatbot] Embeddings model initialized", flush=True)
         
         # Initialize vector store with explicit client
@@ -241,7 +627,8 @@ def initialize_core_components() -> bool:
             vector_store = Chroma(
                 client=client,
                 collection_name="diego_portfolio",
-                embedding_function=embeddings_model,
+                # Chunk embeddings are served from the on-disk cache when already computed
+                embedding_function=with_document_embedding_cache(embeddings_model),
                 collection_metadata={"hnsw:space": "cosine"}
             )
             print("[Chatbot] Vector store initialized with explicit client", flush=True)
@@ -250,7 +637,7 @@ def initialize_core_components() -> bool:
             # Fallback to creating a new client if singleton fails for some reason
             vector_store = Chroma(
                 collection_name="diego_portfolio",
-                embedding_function=embeddings_model,
+                embedding_function=with_document_embedding_cache(embeddings_model),
                 persist_directory=str(CHROMA_PATH),
                 collection_metadata={"hnsw:space": "cosine"}
             )
@@ -269,7 +656,11 @@ def initialize_core_components() -> bool:
             retriever = vector_store.as_retriever(
                 search_kwargs={'k': RAG_CONFIG["retrieval_k"]}
             )
-        print("[Chatbot] Retriever configured", flush=True)
+        category_retrievers, fallback_retriever = build_retrievers(vector_store)
+        print("[Chatbot] Retrievers configured", flush=True)
+        
+        # Serve similarity and keyword search from memory; Chroma stays the source of truth
+        load_serving_indexes()
         
         chatbot_state.set_core_ready()
         print("[Chatbot] Core components ready!", flush=True)
@@ -415,6 +806,8 @@ def add_metadata(chunks, source_file):
     for chunk in chunks:
         chunk.metadata['source_file'] = source_file
         chunk.metadata['category'] = category
+        # Lets the chat path pack chunks into the context budget without re-tokenizing
+        chunk.metadata['token_count'] = token_manager.count_tokens(chunk.page_content)
         
         content_lower = chunk.page_content.lower()
         topics = []
@@ -433,60 +826,90 @@ def add_metadata(chunks, source_file):
     return chunks
 
 
-def load_pdf_documents_sync() -> List:
-    """Load PDF documents (synchronous, to be called with timeout)"""
-    import pypdf
-    pdf_loader = PyPDFDirectoryLoader(str(DATA_PATH))
-    return pdf_loader.load()
+def scan_data_files() -> Dict[str, Tuple[str, Path]]:
+    """
+    List ingestible data files in one walk of the data directory, dispatching
+    by extension: relative path -> (document type, absolute path). Hidden
+    files and directories are skipped.
+    """
+    files = {}
+    for root, dirs, filenames in os.walk(DATA_PATH):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for filename in filenames:
+            doc_type = DATA_FILE_TYPES.get(os.path.splitext(filename)[1].lower())
+            if doc_type and not filename.startswith("."):
+                path = Path(root) / filename
+                files[path.relative_to(DATA_PATH).as_posix()] = (doc_type, path)
+    return dict(sorted(files.items()))
 
 
-def load_text_documents_sync() -> List:
-    """Load text documents (synchronous, to be called with timeout)"""
-    txt_loader = DirectoryLoader(
-        str(DATA_PATH),
-        glob="**/*.txt",
-        loader_cls=TextLoader
-    )
-    return txt_loader.load()
+def split_file_documents(doc_type: str, docs: List[Document]) -> List[Document]:
+    """Split the documents of one file into chunks and tag them with metadata"""
+    if doc_type == "markdown":
+        chunks = split_markdown_documents(docs)
+    else:
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=RAG_CONFIG["chunk_size"],
+            chunk_overlap=RAG_CONFIG["chunk_overlap"],
+            length_function=len,
+            separators=["\n\n", "\n", ". ", " ", ""],
+        )
+        chunks = text_splitter.split_documents(docs)
+    for chunk in chunks:
+        add_metadata([chunk], chunk.metadata.get('source', 'unknown'))
+    return chunks
 
 
-def load_markdown_documents_sync() -> List:
-    """Load markdown documents (synchronous, to be called with timeout)"""
-    md_loader = DirectoryLoader(
-        str(DATA_PATH),
-        glob="**/*.md",
-        loader_cls=lambda path: TextLoader(path, encoding="utf-8")
-    )
-    return md_loader.load()
+def data_file_name(source: str) -> str:
+    """Manifest key (path relative to the data directory) of a loader `source`"""
+    try:
+        return Path(source).relative_to(DATA_PATH).as_posix()
+    except ValueError:
+        return source
 
 
-async def load_documents_with_timeout(loader_func, doc_type: str, timeout: float = 60.0) -> List:
-    """Load documents with timeout protection"""
-    try:
-        print(f"[Chatbot] Loading {doc_type} documents...", flush=True)
-        loop = asyncio.get_running_loop()
-        docs = await asyncio.wait_for(
-            loop.run_in_executor(None, loader_func),
-            timeout=timeout
-        )
-        print(f"[Chatbot] Loaded {len(docs)} {doc_type} documents", flush=True)
-        return docs
-    except asyncio.TimeoutError:
-        print(f"[Chatbot] {doc_type} document loading timed out after {timeout}s - skipping", flush=True)
-        return []
-    except ImportError as e:
-        if "pypdf" in str(e):
-            print("[Chatbot] pypdf package not found. Install it with: pip install pypdf", flush=True)
-            print("[Chatbot] Skipping PDF documents.", flush=True)
-        return []
-    except Exception as e:
-        error_msg = str(e).encode('ascii', 'replace').decode('ascii')
-        print(f"[Chatbot] Could not load {doc_type} documents: {error_msg[:200]}", flush=True)
-        return []
+def get_chunk_id(chunk: Document) -> str:
+    """Deterministic chunk ID: content hash of the source file and chunk text"""
+    return content_hash(f"{chunk.metadata.get('source_file', '')}\n{chunk.page_content}")
+
+
+def delete_file_chunks(manifest: IngestManifest, names: List[str], keep: Optional[set] = None) -> int:
+    """
+    Delete the recorded chunks of data files from the vector store (blocking),
+    except the IDs in `keep`. Returns the number of chunks deleted.
+    """
+    chunk_ids = [chunk_id for chunk_id in manifest.chunk_ids(names) if not keep or chunk_id not in keep]
+    if chunk_ids:
+        vector_store.delete(ids=chunk_ids)
+    return len(chunk_ids)
+
+
+def delete_untracked_file_chunks(manifest: IngestManifest, names: List[str], keep: Optional[set] = None) -> int:
+    """
+    Delete chunks of data files missing from the manifest (from an ingestion
+    run without one), found by source, except the IDs in `keep` (blocking).
+    Returns the number of chunks deleted.
+    """
+    untracked = [str(DATA_PATH / name) for name in names if name not in manifest.files]
+    if not untracked:
+        return 0
+    found = vector_store._collection.get(where={"source_file": {"$in": untracked}}, include=[])
+    chunk_ids = [chunk_id for chunk_id in found["ids"] if not keep or chunk_id not in keep]
+    if chunk_ids:
+        vector_store._collection.delete(ids=chunk_ids)
+    return len(chunk_ids)
 
 
-async def ingest_documents_async() -> bool:
-    """Asynchronously ingest documents into vector store with timeout protection"""
+async def ingest_documents_async(incremental: bool = False) -> bool:
+    """
+    Asynchronously ingest documents into vector store with timeout protection.
+    With incremental=True only new or changed files (by content hash, compared
+    with the ingest manifest) are split and embedded; a full run re-embeds
+    every file. Either way the chunks of removed files and the old chunks of
+    changed files are deleted once the new ones are written, so the manifest
+    keeps tracking every chunk. A file that fails to parse keeps its previous
+    chunks and manifest entry, and is retried by the next run.
+    """
     global vector_store
     
     try:
@@ -499,114 +922,103 @@ async def ingest_documents_async() -> bool:
             print(f"[Chatbot] Data path exists but is not a directory: {DATA_PATH}", flush=True)
             return False
         
-        print(f"[Chatbot] Loading documents from {DATA_PATH}...", flush=True)
-        print("[Chatbot] This may take a moment if there are many files...", flush=True)
+        loop = asyncio.get_running_loop()
         
-        raw_documents = []
-        markdown_docs = []
+        # One hash per data file decides what has to be (re-)embedded
+        files = await loop.run_in_executor(None, scan_data_files)
+        hashes = await loop.run_in_executor(
+            None, lambda: {name: hash_file(path) for name, (_, path) in files.items()}
+        )
+        manifest = IngestManifest.load(INGEST_MANIFEST_PATH)
         
-        # Load documents with individual timeouts (60 seconds each)
-        # Each loader runs independently so one failure doesn't block others
+        changed, removed = manifest.diff(hashes)
+        if incremental:
+            print(f"[Chatbot] Incremental ingestion: {len(changed)} new or changed, {len(removed)} removed, "
+                  f"{len(hashes) - len(changed)} unchanged files", flush=True)
+            if not changed and not removed:
+                print("[Chatbot] Documents are up to date, nothing to ingest", flush=True)
+                return True
+        else:
+            # Unchanged files are re-embedded too (cheap with the embedding cache)
+            changed = list(hashes)
         
-        # Load PDF documents
-        pdf_docs = await load_documents_with_timeout(
-            load_pdf_documents_sync, 
-            "PDF", 
-            timeout=60.0
-        )
-        raw_documents.extend(pdf_docs)
+        print(f"[Chatbot] Loading, splitting and embedding documents from {DATA_PATH}...", flush=True)
+        print("[Chatbot] This may take several minutes as embeddings are generated...", flush=True)
         
-        # Load text documents
-        txt_docs = await load_documents_with_timeout(
-            load_text_documents_sync,
-            "text",
-            timeout=60.0
-        )
-        raw_documents.extend(txt_docs)
+        # Streaming pipeline: parse (process pool) -> split and tag -> embed -> write,
+        # connected by bounded queues so only a window of the corpus is in memory
+        stats = PipelineStats()
+        # Every parsed file is listed, even one that produced no chunks
+        chunk_ids_by_file: Dict[str, List[str]] = {}
+        
+        async def chunk_stream():
+            parsed = iter_files((name, files[name][0], files[name][1]) for name in changed)
+            async for name, doc_type, docs in parsed:
+                chunks = await loop.run_in_executor(None, split_file_documents, doc_type, docs)
+                # Deterministic IDs make adding a chunk again an idempotent upsert;
+                # identical chunks of one file collapse into one
+                unique_chunks = {}
+                for chunk in chunks:
+                    unique_chunks.setdefault(get_chunk_id(chunk), chunk)
+                stats.files += 1
+                stats.documents += len(docs)
+                stats.chunks += len(unique_chunks)
+                chunk_ids_by_file[name] = list(unique_chunks)
+                for chunk_id, chunk in unique_chunks.items():
+                    yield chunk, chunk_id
         
-        # Load markdown documents separately
-        markdown_docs = await load_documents_with_timeout(
-            load_markdown_documents_sync,
-            "markdown",
-            timeout=60.0
+        # Embed with bounded concurrency in token-aware batches; a single writer
+        # upserts the vectors into Chroma while later files are still being parsed
+        batches = atoken_batches(
+            chunk_stream(),
+            max_tokens=INGEST_PIPELINE_CONFIG["embed_batch_max_tokens"],
+            max_inputs=INGEST_PIPELINE_CONFIG["embed_batch_max_inputs"],
         )
+        await embed_and_write(batches, vector_store.embeddings, vector_store._collection, stats)
         
         # Check if we have any documents at all
-        total_docs = len(raw_documents) + len(markdown_docs)
-        if total_docs == 0:
+        if stats.documents == 0 and not removed:
             print("[Chatbot] No documents found in data directory", flush=True)
             return False
         
-        print(f"[Chatbot] Total documents to process: {total_docs} ({len(markdown_docs)} markdown, {len(raw_documents)} other)", flush=True)
-        
-        # Split documents with progress tracking
-        all_chunks = []
-        
-        # Process markdown documents separately (they need special handling)
-        other_docs = raw_documents  # PDF and text documents
-        
-        if markdown_docs:
-            print(f"[Chatbot] Splitting {len(markdown_docs)} markdown documents...", flush=True)
-            md_chunks = split_markdown_documents(markdown_docs)
-            print(f"[Chatbot] Processing {len(md_chunks)} markdown chunks...", flush=True)
-            for idx, chunk in enumerate(md_chunks, 1):
-                if idx % 50 == 0:
-                    print(f"[Chatbot] Processing markdown chunk {idx}/{len(md_chunks)}...", flush=True)
-                source = chunk.metadata.get('source', 'unknown')
-                chunk_with_meta = add_metadata([chunk], source)
-                all_chunks.extend(chunk_with_meta)
-            print(f"[Chatbot] Completed processing {len(md_chunks)} markdown chunks", flush=True)
-        
-        # Split other documents (PDF, text)
-        if other_docs:
-            print(f"[Chatbot] Splitting {len(other_docs)} PDF/text documents...", flush=True)
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=RAG_CONFIG["chunk_size"],
-                chunk_overlap=RAG_CONFIG["chunk_overlap"],
-                length_function=len,
-                separators=["\n\n", "\n", ". ", " ", ""],
-            )
-            other_chunks = text_splitter.split_documents(other_docs)
-            print(f"[Chatbot] Processing {len(other_chunks)} PDF/text chunks...", flush=True)
-            for idx, chunk in enumerate(other_chunks, 1):
-                if idx % 50 == 0:
-                    print(f"[Chatbot] Processing PDF/text chunk {idx}/{len(other_chunks)}...", flush=True)
-                source = chunk.metadata.get('source', 'unknown')
-                chunk_with_meta = add_metadata([chunk], source)
-                all_chunks.extend(chunk_with_meta)
-            print(f"[Chatbot] Completed processing {len(other_chunks)} PDF/text chunks", flush=True)
-        
-        print(f"[Chatbot] Adding {len(all_chunks)} document chunks to vector store...", flush=True)
-        print("[Chatbot] This may take several minutes as embeddings are generated...", flush=True)
-        
-        # Generate UUIDs
-        uuids = [str(uuid4()) for _ in range(len(all_chunks))]
-        
-        # Add documents in batches to show progress (if many chunks)
-        # Add documents in batches to show progress (if many chunks)
-        loop = asyncio.get_running_loop()
+        # Old chunks of parsed and removed files are deleted once their replacements
+        # are written (chunks that came back unchanged are kept). Files that failed
+        # to parse keep their previous chunks until a later run parses them.
+        replaced = [name for name in changed if name in chunk_ids_by_file] + removed
+        written_ids = {chunk_id for ids in chunk_ids_by_file.values() for chunk_id in ids}
+        deleted = await loop.run_in_executor(
+            None, delete_file_chunks, manifest, replaced, written_ids
+        )
+        # Files without a manifest entry may have chunks from a run without one
+        deleted += await loop.run_in_executor(
+            None, delete_untracked_file_chunks, manifest, replaced, written_ids
+        )
+        print(f"[Chatbot] Deleted {deleted} chunks of changed or removed files", flush=True)
         
-        def _add_batch(batch_docs, batch_ids):
-            vector_store.add_documents(documents=batch_docs, ids=batch_ids)
-            
-        if len(all_chunks) > 40:
-            batch_size = 40
-            for i in range(0, len(all_chunks), batch_size):
-                batch = all_chunks[i:i + batch_size]
-                batch_ids = uuids[i:i + batch_size]
-                await loop.run_in_executor(None, _add_batch, batch, batch_ids)
-                print(f"[Chatbot] Added batch {i//batch_size + 1}/{(len(all_chunks) + batch_size - 1)//batch_size} ({len(batch)} chunks)...", flush=True)
-                # Small delay to let SQLite catch up and prevent locking/corruption
-                await asyncio.sleep(0.2)
-        else:
-            await loop.run_in_executor(None, _add_batch, all_chunks, uuids)
-
         # Persist if needed (some Chroma versions auto-persist, but explicit is safer)
         # Run in executor to avoid blocking
         if hasattr(vector_store, 'persist'):
              await loop.run_in_executor(None, vector_store.persist)
         
-        print(f"[Chatbot] Successfully ingested {len(all_chunks)} document chunks", flush=True)
+        print(f"[Chatbot] Successfully ingested {stats.written} document chunks "
+              f"from {stats.files} files ({stats.documents} documents)", flush=True)
+        
+        # Record what was ingested; files that failed to parse (e.g. a loader timed
+        # out) keep their old entry, whose hash no longer matches, so the next
+        # incremental run retries them
+        for name in replaced:
+            if name in chunk_ids_by_file:
+                manifest.record(name, hashes[name], chunk_ids_by_file[name])
+            else:
+                manifest.remove(name)
+        await loop.run_in_executor(None, manifest.save, INGEST_MANIFEST_PATH)
+        
+        # Invalidates caches built from the previous index
+        version = bump_index_version()
+        
+        # Rebuild the keyword index next to the collection for hybrid retrieval
+        if HYBRID_CONFIG["enabled"]:
+            await loop.run_in_executor(None, build_lexical_index, version)
         
         return True
         
@@ -0,0 +1,137 @@
+"""
+Parallel document loading for ingestion.
+
+Parsing is fanned out per file, and per page range for large PDFs, across
+a process pool, since pypdf text extraction is CPU-bound and serialised by
+the GIL in threads. Results are collected in a stable order (file order,
+then page order) and every file has its own timeout, counted from when its
+parse actually starts: a file that fails or times out is skipped without
+holding up the others. Parsed files are streamed to the caller with a
+bounded look-ahead instead of being collected up front.
+"""
+
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Deque, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+# Document loading configuration
+DOCUMENT_LOADER_CONFIG = {
+    # Parser processes; 1 parses in a thread without starting a pool
+    "workers": int(os.getenv("INGEST_PARSE_WORKERS", "0")) or (os.cpu_count() or 1),
+    "file_timeout_seconds": float(os.getenv("INGEST_FILE_TIMEOUT_SECONDS", "60")),
+    # PDFs with more pages are split into tasks of this many pages
+    "pdf_pages_per_task": int(os.getenv("INGEST_PDF_PAGES_PER_TASK", "16")),
+    # Files parsed ahead of the rest of the pipeline (0 = twice the number of workers)
+    "max_files_in_flight": int(os.getenv("INGEST_MAX_FILES_IN_FLIGHT", "0")),
+}
+
+# A parse task: (document type, path, first page, last page + 1); pages are only used for PDFs
+ParseTask = Tuple[str, str, int, int]
+
+
+def count_pdf_pages(path: str) -> int:
+    """Number of pages of a PDF"""
+    import pypdf
+    return len(pypdf.PdfReader(path).pages)
+
+
+def parse_task(task: ParseTask) -> List[Document]:
+    """Parse one file or PDF page range (runs in a worker process)"""
+    doc_type, path, start, stop = task
+    if doc_type == "PDF":
+        import pypdf
+        reader = pypdf.PdfReader(path)
+        total_pages = len(reader.pages)
+        return [
+            Document(
+                page_content=reader.pages[page].extract_text(),
+                metadata={"source": path, "page": page, "total_pages": total_pages},
+            )
+            for page in range(start, min(stop, total_pages))
+        ]
+    encoding = "utf-8" if doc_type == "markdown" else None
+    with open(path, encoding=encoding) as f:
+        return [Document(page_content=f.read(), metadata={"source": path})]
+
+
+def plan_tasks(doc_type: str, path: str, pages_per_task: int) -> List[ParseTask]:
+    """Split a file into parse tasks (page ranges for PDFs)"""
+    if doc_type != "PDF":
+        return [(doc_type, path, 0, 0)]
+    pages = count_pdf_pages(path)
+    return [(doc_type, path, start, start + pages_per_task) for start in range(0, pages, pages_per_task)]
+
+
+def create_parse_executor(workers: Optional[int] = None) -> Optional[Executor]:
+    """Process pool for parsing, or None to parse on the default thread pool"""
+    workers = workers or DOCUMENT_LOADER_CONFIG["workers"]
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+
+async def iter_files(files: Iterable[Tuple[str, str, Path]], executor: Optional[Executor] = None,
+                     timeout: Optional[float] = None) -> AsyncIterator[Tuple[str, str, List[Document]]]:
+    """
+    Parse files given as (name, document type, path) in parallel, yielding
+    (name, document type, documents) in input order and leaving out files
+    that failed or did not finish within the per-file timeout. At most
+    `max_files_in_flight` files are parsed ahead of the consumer, so a slow
+    consumer keeps memory bounded.
+    """
+    timeout = timeout or DOCUMENT_LOADER_CONFIG["file_timeout_seconds"]
+    pages_per_task = max(1, DOCUMENT_LOADER_CONFIG["pdf_pages_per_task"])
+    workers = max(1, DOCUMENT_LOADER_CONFIG["workers"])
+    max_in_flight = max(1, DOCUMENT_LOADER_CONFIG["max_files_in_flight"] or workers * 2)
+    loop = asyncio.get_running_loop()
+    owns_executor = executor is None
+    if owns_executor:
+        executor = create_parse_executor()
+    # One task per worker at a time, so timeouts measure parsing rather than queueing
+    slots = asyncio.Semaphore(workers)
+
+    async def run(func, *args):
+        async with slots:
+            return await asyncio.wait_for(loop.run_in_executor(executor, func, *args), timeout=timeout)
+
+    async def load_file(name: str, doc_type: str, path: Path) -> Optional[List[Document]]:
+        try:
+            tasks = await run(plan_tasks, doc_type, str(path), pages_per_task)
+            parts = await asyncio.gather(*(run(parse_task, task) for task in tasks))
+            return [doc for part in parts for doc in part]
+        except asyncio.TimeoutError:
+            print(f"[Chatbot] Parsing {name} timed out after {timeout}s - skipping", flush=True)
+        except Exception as e:
+            error_msg = str(e).encode('ascii', 'replace').decode('ascii')
+            print(f"[Chatbot] Could not parse {name}: {error_msg[:200]}", flush=True)
+        return None
+
+    queued = iter(files)
+    in_flight: Deque[Tuple[str, str, asyncio.Task]] = deque()
+    try:
+        while True:
+            for name, doc_type, path in queued:
+                in_flight.append((name, doc_type, asyncio.create_task(load_file(name, doc_type, path))))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            name, doc_type, task = in_flight.popleft()
+            docs = await task
+            if docs is not None:
+                yield name, doc_type, docs
+    finally:
+        for _, _, task in in_flight:
+            task.cancel()
+        if owns_executor and executor is not None:
+            # Do not wait for parses abandoned after a timeout
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def load_files(files: Sequence[Tuple[str, str, Path]], executor: Optional[Executor] = None,
+                     timeout: Optional[float] = None) -> List[Tuple[str, str, List[Document]]]:
+    """Parse files in parallel and return all of them (see iter_files)"""
+    return [loaded async for loaded in iter_files(files, executor, timeout)]
@@ -0,0 +1,242 @@
+"""
+Embedding caches for the chatbot.
+
+Query embeddings are cached in process so a message that was embedded
+moments ago (page reloads, repeated suggestions, shared links) does not pay
+for another round trip to the embeddings API.
+
+Document (chunk) embeddings are cached on disk, in SQLite as float32 blobs
+keyed by embedding model, dimensions and the SHA-256 of the chunk text, so
+re-ingesting unchanged or duplicate chunks costs no embedding calls.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Query embedding cache configuration
+QUERY_EMBEDDING_CACHE_CONFIG = {
+    "max_entries": int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "1024")),
+}
+
+# Document embedding cache configuration
+DOCUMENT_EMBEDDING_CACHE_CONFIG = {
+    "enabled": os.getenv("DOCUMENT_EMBEDDING_CACHE_ENABLED", "true").lower() == "true",
+    "path": os.getenv("DOCUMENT_EMBEDDING_CACHE_PATH", str(Path(__file__).parent.parent.parent / "embedding_cache.db")),
+}
+
+
+def normalize_query(text: str) -> str:
+    """Normalize a query for cache lookups (case and whitespace insensitive)"""
+    return " ".join(text.split()).casefold()
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of a text, used to address chunks and their embeddings"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache of query embeddings keyed by (embedding model, normalized text)"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _model_name(embeddings: Any) -> str:
+        """Get the model name of an embeddings client"""
+        return str(getattr(embeddings, "model", type(embeddings).__name__))
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Get a cached embedding, or None"""
+        key = (model, normalize_query(text))
+        embedding = self.entries.get(key)
+        if embedding is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return embedding
+
+    def put(self, model: str, text: str, embedding: List[float]):
+        """Store an embedding, evicting the least recently used entries"""
+        key = (model, normalize_query(text))
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def aembed_query(self, embeddings: Any, text: str) -> List[float]:
+        """
+        Embed a query through the cache. The normalized text is only the
+        cache key: the model gets the original text with whitespace collapsed.
+        The returned list is shared with the cache and must not be modified.
+        """
+        model = self._model_name(embeddings)
+        embedding = self.get(model, text)
+        if embedding is None:
+            embedding = await embeddings.aembed_query(" ".join(text.split()))
+            self.put(model, text, embedding)
+        return embedding
+
+    def clear(self):
+        """Remove all entries"""
+        self.entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters as dictionary"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=QUERY_EMBEDDING_CACHE_CONFIG["max_entries"],
+)
+
+
+class DocumentEmbeddingCache:
+    """Persistent embeddings keyed by (model, dimensions, content hash), stored as float32 blobs in SQLite"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread, opened (and the table created) on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, dimensions INTEGER NOT NULL, content_hash TEXT NOT NULL, "
+                "embedding BLOB NOT NULL, PRIMARY KEY (model, dimensions, content_hash))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model: str, dimensions: int, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """Get the cached embeddings of content hashes that are present"""
+        conn = self._connection()
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        # Stay below SQLite's bound parameter limit
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            rows = conn.execute(
+                f"SELECT content_hash, embedding FROM embeddings WHERE model = ? AND dimensions = ? "
+                f"AND content_hash IN ({','.join('?' * len(batch))})",
+                (model, dimensions, *batch),
+            ).fetchall()
+            for digest, blob in rows:
+                found[digest] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, dimensions: int, entries: Dict[str, List[float]]):
+        """Store embeddings by content hash"""
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                [(model, dimensions, digest, np.asarray(embedding, dtype=np.float32).tobytes())
+                 for digest, embedding in entries.items()],
+            )
+
+    def record(self, hits: int, misses: int):
+        """Count lookups"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters as dictionary"""
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings client that serves document embeddings from a DocumentEmbeddingCache
+    and only sends unseen texts (deduplicated) to the wrapped client. Query
+    embeddings are passed through. The async path runs cache reads and writes
+    in a worker thread so they do not block the event loop.
+    """
+
+    def __init__(self, embeddings: Any, cache: DocumentEmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = QueryEmbeddingCache._model_name(embeddings)
+        self.dimensions = int(getattr(embeddings, "dimensions", None) or 0)
+
+    def _lookup(self, texts: List[str]) -> Tuple[List[str], Dict[str, List[float]], List[str]]:
+        """Hash texts and fetch cached embeddings: (hashes, found, texts still to embed)"""
+        hashes = [content_hash(text) for text in texts]
+        found = self.cache.get_many(self.model, self.dimensions, hashes)
+        missing = list(dict.fromkeys(text for text, digest in zip(texts, hashes) if digest not in found))
+        self.cache.record(hits=len(texts) - len(missing), misses=len(missing))
+        return hashes, found, missing
+
+    def _store(self, missing: List[str], embeddings: List[List[float]], found: Dict[str, List[float]]):
+        """Cache freshly computed embeddings"""
+        computed = {content_hash(text): embedding for text, embedding in zip(missing, embeddings)}
+        if computed:
+            self.cache.put_many(self.model, self.dimensions, computed)
+        found.update(computed)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = self._lookup(texts)
+        if missing:
+            self._store(missing, self.embeddings.embed_documents(missing), found)
+        return [found[digest] for digest in hashes]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            computed = await self.embeddings.aembed_documents(missing)
+            await asyncio.to_thread(self._store, missing, computed, found)
+        return [found[digest] for digest in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
+
+document_embedding_cache = DocumentEmbeddingCache(DOCUMENT_EMBEDDING_CACHE_CONFIG["path"])
+
+
+def with_document_embedding_cache(embeddings: Any) -> Any:
+    """Wrap an embeddings client with the on-disk document embedding cache (if enabled)"""
+    if not DOCUMENT_EMBEDDING_CACHE_CONFIG["enabled"]:
+        return embeddings
+    return CachedEmbeddings(embeddings, document_embedding_cache)
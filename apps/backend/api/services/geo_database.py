@@ -0,0 +1,202 @@
+"""
+Offline IP geolocation from a local IP-range database.
+
+A CSV of IP ranges (IPv4 and IPv6) is compiled once into sorted NumPy
+arrays saved as .npy files, plus a JSON table of distinct locations. The
+arrays are memory-mapped, so every worker process shares the same pages,
+and a lookup is a binary search (np.searchsorted) taking microseconds,
+with no network access.
+
+CSV columns (a header line is optional):
+    ip_start, ip_end, country_code, country_name, region_name, city, latitude, longitude
+"""
+
+import csv
+import ipaddress
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Offline geolocation configuration
+GEO_DATABASE_CONFIG = {
+    # "ipstack" queries ipstack, "local" answers from the local database with ipstack as optional fallback
+    "backend": os.getenv("GEO_BACKEND", "ipstack").lower(),
+    "path": os.getenv("GEO_DATABASE_PATH", str(Path(__file__).parent.parent.parent / "geo_db")),
+    "ipstack_fallback": os.getenv("GEO_IPSTACK_FALLBACK", "true").lower() == "true",
+}
+
+_ARRAYS = ("v4_start", "v4_end", "v4_loc", "v6_start_hi", "v6_start_lo", "v6_end_hi", "v6_end_lo", "v6_loc")
+
+
+def _split_v6(value: int) -> Tuple[int, int]:
+    """Split a 128-bit address into its high and low 64-bit halves"""
+    return value >> 64, value & 0xFFFFFFFFFFFFFFFF
+
+
+def _float_or_none(value: str) -> Optional[float]:
+    """Parse a coordinate, or None if it is empty"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compile_database(csv_path: str, output_dir: str) -> Dict[str, int]:
+    """Compile an IP-range CSV into the memory-mappable database directory"""
+    locations: List[List[Any]] = []
+    location_ids: Dict[Tuple[Any, ...], int] = {}
+    v4: List[Tuple[int, int, int]] = []
+    v6: List[Tuple[int, int, int]] = []
+
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 8 or row[0].startswith("#"):
+                continue
+            try:
+                start = ipaddress.ip_address(row[0].strip())
+                end = ipaddress.ip_address(row[1].strip())
+            except ValueError:
+                continue  # header or malformed line
+            country_code, country_name, region, city = (value.strip() or None for value in row[2:6])
+            location = (country_code, country_name, region, city, _float_or_none(row[6]), _float_or_none(row[7]))
+            loc_id = location_ids.setdefault(location, len(locations))
+            if loc_id == len(locations):
+                locations.append(list(location))
+            (v4 if start.version == 4 else v6).append((int(start), int(end), loc_id))
+
+    v4.sort()
+    v6.sort()
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    arrays = {
+        "v4_start": np.array([r[0] for r in v4], dtype=np.uint32),
+        "v4_end": np.array([r[1] for r in v4], dtype=np.uint32),
+        "v4_loc": np.array([r[2] for r in v4], dtype=np.uint32),
+        "v6_start_hi": np.array([_split_v6(r[0])[0] for r in v6], dtype=np.uint64),
+        "v6_start_lo": np.array([_split_v6(r[0])[1] for r in v6], dtype=np.uint64),
+        "v6_end_hi": np.array([_split_v6(r[1])[0] for r in v6], dtype=np.uint64),
+        "v6_end_lo": np.array([_split_v6(r[1])[1] for r in v6], dtype=np.uint64),
+        "v6_loc": np.array([r[2] for r in v6], dtype=np.uint32),
+    }
+    for name, array in arrays.items():
+        np.save(output / f"{name}.npy", array)
+    with open(output / "locations.json", "w", encoding="utf-8") as f:
+        json.dump(locations, f)
+    return {"ipv4_ranges": len(v4), "ipv6_ranges": len(v6), "locations": len(locations)}
+
+
+class GeoDatabase:
+    """Memory-mapped IP-range database with binary-search lookups"""
+
+    def __init__(self):
+        self.arrays: Dict[str, np.ndarray] = {}
+        self.locations: List[List[Any]] = []
+        self.loaded = False
+        self.lookups = 0
+        self.misses = 0
+
+    def load(self, path: str) -> bool:
+        """Memory-map a compiled database directory, returns False if it does not exist"""
+        directory = Path(path)
+        if not (directory / "locations.json").exists():
+            return False
+        self.arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+        with open(directory / "locations.json", encoding="utf-8") as f:
+            self.locations = json.load(f)
+        self.loaded = True
+        return True
+
+    def _find_v4(self, value: int) -> Optional[int]:
+        """Location id of the IPv4 range containing an address"""
+        idx = int(np.searchsorted(self.arrays["v4_start"], value, side="right")) - 1
+        if idx < 0 or value > int(self.arrays["v4_end"][idx]):
+            return None
+        return int(self.arrays["v4_loc"][idx])
+
+    def _find_v6(self, value: int) -> Optional[int]:
+        """Location id of the IPv6 range containing an address (compared as (high, low) pairs)"""
+        hi, lo = _split_v6(value)
+        start_hi, start_lo = self.arrays["v6_start_hi"], self.arrays["v6_start_lo"]
+        first = int(np.searchsorted(start_hi, np.uint64(hi), side="left"))
+        last = int(np.searchsorted(start_hi, np.uint64(hi), side="right"))
+        idx = first + int(np.searchsorted(start_lo[first:last], np.uint64(lo), side="right")) - 1
+        if idx < 0:
+            return None
+        end = (int(self.arrays["v6_end_hi"][idx]) << 64) | int(self.arrays["v6_end_lo"][idx])
+        if value > end:
+            return None
+        return int(self.arrays["v6_loc"][idx])
+
+    def lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        """Look up an IP, returning an ipstack-shaped response or None if it is not covered"""
+        if not self.loaded:
+            return None
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        self.lookups += 1
+        # IPv4-mapped IPv6 addresses are looked up as IPv4
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        loc_id = self._find_v4(int(address)) if address.version == 4 else self._find_v6(int(address))
+        if loc_id is None:
+            self.misses += 1
+            return None
+        country_code, country_name, region, city, latitude, longitude = self.locations[loc_id]
+        return {
+            "ip": ip,
+            "type": f"ipv{address.version}",
+            "country_code": country_code,
+            "country_name": country_name,
+            "region_name": region,
+            "city": city,
+            "latitude": latitude,
+            "longitude": longitude,
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get database information as dictionary"""
+        return {
+            "loaded": self.loaded,
+            "ipv4_ranges": int(len(self.arrays.get("v4_start", ()))),
+            "ipv6_ranges": int(len(self.arrays.get("v6_start_hi", ()))),
+            "locations": len(self.locations),
+            "lookups": self.lookups,
+            "misses": self.misses,
+        }
+
+
+geo_database = GeoDatabase()
+
+
+def load_geo_database() -> bool:
+    """Memory-map the offline database when the local geolocation backend is configured"""
+    if GEO_DATABASE_CONFIG["backend"] != "local":
+        return False
+    if not geo_database.load(GEO_DATABASE_CONFIG["path"]):
+        print(f"[Main] Offline geolocation database not found at {GEO_DATABASE_CONFIG['path']}", flush=True)
+        return False
+    stats = geo_database.get_stats()
+    print(f"[Main] Offline geolocation database loaded: {stats['ipv4_ranges']} IPv4 and {stats['ipv6_ranges']} IPv6 ranges", flush=True)
+    return True
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    """Compile a CSV: python -m backend.api.services.geo_database <ranges.csv> [output_dir]"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile an IP-range CSV into the offline geolocation database")
+    parser.add_argument("csv_path")
+    parser.add_argument("output_dir", nargs="?", default=GEO_DATABASE_CONFIG["path"])
+    args = parser.parse_args(argv)
+    counts = compile_database(args.csv_path, args.output_dir)
+    print(f"[Main] Compiled {counts['ipv4_ranges']} IPv4 and {counts['ipv6_ranges']} IPv6 ranges "
+          f"({counts['locations']} locations) into {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Visitor geolocation helpers.
+
+Resolves the real client IP of a request (honouring X-Forwarded-For only
+from trusted proxies) and caches ipstack lookups per IP, so repeat visitors
+and page reloads are answered from memory. Failed lookups are cached
+briefly as well, so an unreachable ipstack is not hammered on every reload.
+Successful lookups stay usable for a stale window after they expire, so
+they can be served while being refreshed in the background.
+"""
+
+import ipaddress
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+from fastapi import Request
+
+from backend.api.utils.circuit_breaker import CircuitBreaker
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_networks(value: str) -> List[IPNetwork]:
+    """Parse a comma-separated list of IPs and CIDR ranges"""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+
+# Geolocation configuration
+GEO_CONFIG = {
+    "cache_ttl_seconds": float(os.getenv("GEO_CACHE_TTL_SECONDS", "86400")),
+    "negative_ttl_seconds": float(os.getenv("GEO_NEGATIVE_CACHE_TTL_SECONDS", "60")),
+    # How long past the TTL a lookup may still be served while it is refreshed
+    "stale_ttl_seconds": float(os.getenv("GEO_STALE_TTL_SECONDS", "604800")),
+    "cache_max_entries": int(os.getenv("GEO_CACHE_MAX_ENTRIES", "10000")),
+    # Proxies (IPs or CIDR ranges) whose X-Forwarded-For header is trusted
+    "trusted_proxies": parse_networks(os.getenv("TRUSTED_PROXIES", "")),
+    # Circuit breaker for ipstack: open after this many consecutive failures, probe again after the reset time
+    "breaker_failure_threshold": int(os.getenv("GEO_BREAKER_FAILURE_THRESHOLD", "5")),
+    "breaker_reset_seconds": float(os.getenv("GEO_BREAKER_RESET_SECONDS", "30")),
+    # Batch lookups: IPs per ipstack bulk request, concurrent bulk requests, IPs per batch call
+    "bulk_chunk_size": int(os.getenv("GEO_BULK_CHUNK_SIZE", "50")),
+    "bulk_concurrency": int(os.getenv("GEO_BULK_CONCURRENCY", "4")),
+    "bulk_max_ips": int(os.getenv("GEO_BULK_MAX_IPS", "1000")),
+    # Batch lookups spend ipstack quota: callers need this key (X-API-Key), and are rate limited per IP
+    "batch_api_key": os.getenv("GEO_BATCH_API_KEY", ""),
+    "batch_rate_limit": int(os.getenv("GEO_BATCH_RATE_LIMIT", "5")),
+    "batch_rate_window_minutes": int(os.getenv("GEO_BATCH_RATE_WINDOW_MINUTES", "10")),
+}
+
+
+def _parse_ip(value: str) -> Optional[IPAddress]:
+    """Parse an IP address, or None if it is not one"""
+    try:
+        return ipaddress.ip_address(value.strip())
+    except ValueError:
+        return None
+
+
+def _is_trusted(ip: IPAddress, trusted: List[IPNetwork]) -> bool:
+    """Whether an address belongs to a trusted proxy"""
+    return any(ip in network for network in trusted)
+
+
+def get_client_ip(request: Request, trusted_proxies: Optional[List[IPNetwork]] = None) -> Optional[str]:
+    """
+    Get the IP of the client that sent a request.
+    X-Forwarded-For is only honoured when the connection comes from a trusted
+    proxy; the header is then read right to left, skipping trusted proxies,
+    so clients cannot spoof their address by sending the header themselves.
+    """
+    trusted = GEO_CONFIG["trusted_proxies"] if trusted_proxies is None else trusted_proxies
+    peer = _parse_ip(request.client.host) if request.client else None
+    if peer is None or not _is_trusted(peer, trusted):
+        return str(peer) if peer else None
+
+    forwarded = request.headers.get("x-forwarded-for", "")
+    for hop in reversed([hop for hop in forwarded.split(",") if hop.strip()]):
+        ip = _parse_ip(hop)
+        if ip is None:
+            break
+        if not _is_trusted(ip, trusted):
+            return str(ip)
+    return str(peer)
+
+
+def normalize_ip(value: str) -> Optional[str]:
+    """Canonical text form of an IP address, or None if it is not one"""
+    ip = _parse_ip(value)
+    return str(ip) if ip else None
+
+
+def is_public_ip(ip: Optional[str]) -> bool:
+    """Whether an address can be geolocated (not private, loopback or reserved)"""
+    parsed = _parse_ip(ip) if ip else None
+    return parsed is not None and parsed.is_global
+
+
+@dataclass
+class GeoCacheEntry:
+    """A cached lookup: the ipstack body, or the error returned for it"""
+    expires_at: float
+    body: Optional[Dict[str, Any]] = None
+    status_code: int = 200
+    detail: str = ""
+    stale_until: float = 0.0
+
+    @property
+    def is_stale(self) -> bool:
+        """Whether the lookup is past its TTL and should be refreshed"""
+        return self.expires_at <= time.monotonic()
+
+
+class GeoCache:
+    """Bounded LRU cache of geolocation lookups per IP, with TTL, stale window and negative caching"""
+
+    def __init__(self, ttl_seconds: float = 86400, negative_ttl_seconds: float = 60, max_entries: int = 10000,
+                 stale_ttl_seconds: float = 0.0):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.stale_ttl_seconds = stale_ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, GeoCacheEntry]" = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def get(self, ip: str) -> Optional[GeoCacheEntry]:
+        """Get a cached lookup that is fresh or within its stale window (check `is_stale`), or None"""
+        entry = self.entries.get(ip)
+        if entry is None or entry.stale_until <= time.monotonic():
+            if entry is not None:
+                del self.entries[ip]
+            self.misses += 1
+            return None
+        if entry.is_stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        self.entries.move_to_end(ip)
+        return entry
+
+    def _put(self, ip: str, entry: GeoCacheEntry):
+        """Store a lookup, evicting the least recently used entries"""
+        self.entries[ip] = entry
+        self.entries.move_to_end(ip)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, ip: str, body: Dict[str, Any]):
+        """Cache a successful lookup"""
+        expires_at = time.monotonic() + self.ttl_seconds
+        self._put(ip, GeoCacheEntry(expires_at=expires_at, body=body, stale_until=expires_at + self.stale_ttl_seconds))
+
+    def put_error(self, ip: str, status_code: int, detail: str):
+        """Cache a failed lookup for the (short) negative TTL"""
+        expires_at = time.monotonic() + self.negative_ttl_seconds
+        self._put(ip, GeoCacheEntry(
+            expires_at=expires_at, status_code=status_code, detail=detail, stale_until=expires_at
+        ))
+
+    def record_refresh(self, success: bool):
+        """Count a background refresh of a stale lookup"""
+        if success:
+            self.refreshes += 1
+        else:
+            self.refresh_failures += 1
+
+    def clear(self):
+        """Remove all entries"""
+        self.entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters as dictionary"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
+
+
+geo_cache = GeoCache(
+    ttl_seconds=GEO_CONFIG["cache_ttl_seconds"],
+    negative_ttl_seconds=GEO_CONFIG["negative_ttl_seconds"],
+    max_entries=GEO_CONFIG["cache_max_entries"],
+    stale_ttl_seconds=GEO_CONFIG["stale_ttl_seconds"],
+)
+
+ipstack_breaker = CircuitBreaker(
+    failure_threshold=GEO_CONFIG["breaker_failure_threshold"],
+    reset_timeout=GEO_CONFIG["breaker_reset_seconds"],
+)
+
+# Batch lookups get their own breaker so a failing bulk request cannot cut off visitor lookups
+ipstack_bulk_breaker = CircuitBreaker(
+    failure_threshold=GEO_CONFIG["breaker_failure_threshold"],
+    reset_timeout=GEO_CONFIG["breaker_reset_seconds"],
+)
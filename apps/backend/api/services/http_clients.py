@@ -0,0 +1,77 @@
+"""
+Shared outbound HTTP clients.
+
+Clients are created once in the application lifespan, kept on `app.state`
+and handed to routes through FastAPI dependencies, so outbound calls reuse
+warm keep-alive connections instead of paying for a new pool, DNS lookup
+and TLS handshake per request. They are closed on shutdown.
+"""
+
+import importlib.util
+import os
+from typing import AsyncIterator, Dict
+
+import httpx
+from fastapi import Request
+
+# Outbound HTTP configuration
+HTTP_CLIENT_CONFIG = {
+    "max_connections": int(os.getenv("HTTP_MAX_CONNECTIONS", "50")),
+    "max_keepalive_connections": int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10")),
+    "keepalive_expiry": float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+    # HTTP/2 needs the optional `h2` package (pip install httpx[http2])
+    "http2": os.getenv("HTTP2_ENABLED", "false").lower() == "true",
+}
+
+# Per-host timeouts
+HOST_TIMEOUTS = {
+    "ipstack": httpx.Timeout(10.0, connect=3.0),
+}
+
+
+def _http2_available() -> bool:
+    """Whether HTTP/2 was requested and the h2 package is installed"""
+    if not HTTP_CLIENT_CONFIG["http2"]:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        print("[Main] HTTP2_ENABLED is set but the h2 package is not installed, using HTTP/1.1", flush=True)
+        return False
+    return True
+
+
+def create_http_client(host: str) -> httpx.AsyncClient:
+    """Create a pooled client with the timeouts configured for a host"""
+    return httpx.AsyncClient(
+        timeout=HOST_TIMEOUTS.get(host, httpx.Timeout(10.0, connect=3.0)),
+        limits=httpx.Limits(
+            max_connections=HTTP_CLIENT_CONFIG["max_connections"],
+            max_keepalive_connections=HTTP_CLIENT_CONFIG["max_keepalive_connections"],
+            keepalive_expiry=HTTP_CLIENT_CONFIG["keepalive_expiry"],
+        ),
+        http2=_http2_available(),
+    )
+
+
+def create_http_clients() -> Dict[str, httpx.AsyncClient]:
+    """Create one client per outbound integration"""
+    return {host: create_http_client(host) for host in HOST_TIMEOUTS}
+
+
+async def close_http_clients(clients: Dict[str, httpx.AsyncClient]):
+    """Close all clients and their connection pools"""
+    for client in clients.values():
+        await client.aclose()
+
+
+async def get_ipstack_client(request: Request) -> AsyncIterator[httpx.AsyncClient]:
+    """
+    Dependency providing the shared ipstack client. Outside the lifespan
+    (for example a TestClient used without `with`) a short-lived client is
+    created for the request instead.
+    """
+    clients = getattr(request.app.state, "http_clients", None)
+    if clients is not None:
+        yield clients["ipstack"]
+        return
+    async with create_http_client("ipstack") as client:
+        yield client
@@ -0,0 +1,70 @@
+"""
+File-hash manifest for incremental document ingestion.
+
+Records, for every ingested file (relative to the data directory), the
+SHA-256 of its content and the IDs of the chunks it produced. Comparing a
+fresh scan against the manifest tells ingestion which files are new or
+changed (re-split and re-embed) and which chunks belong to changed or
+removed files (delete), so unchanged files cost one hash each.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+MANIFEST_VERSION = 1
+
+
+def hash_file(path: Path, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """Mapping of data file -> content hash -> chunk IDs, saved as JSON"""
+
+    def __init__(self, files: Optional[Dict[str, Dict]] = None):
+        self.files: Dict[str, Dict] = files or {}
+
+    @classmethod
+    def load(cls, path: Path) -> "IngestManifest":
+        """Load a manifest, or an empty one if the file is missing or unreadable"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls()
+        if data.get("version") != MANIFEST_VERSION:
+            return cls()
+        return cls(data.get("files", {}))
+
+    def save(self, path: Path):
+        """Write the manifest atomically"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f, indent=1, sort_keys=True)
+        tmp_path.replace(path)
+
+    def diff(self, hashes: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Compare a scan (file -> hash) with the manifest: (new or changed files, removed files)"""
+        changed = [name for name, digest in hashes.items() if self.files.get(name, {}).get("hash") != digest]
+        removed = [name for name in self.files if name not in hashes]
+        return sorted(changed), sorted(removed)
+
+    def chunk_ids(self, names: List[str]) -> List[str]:
+        """Chunk IDs recorded for the given files"""
+        return [chunk_id for name in names for chunk_id in self.files.get(name, {}).get("chunk_ids", [])]
+
+    def record(self, name: str, digest: str, chunk_ids: List[str]):
+        """Record the chunks ingested for a file"""
+        self.files[name] = {"hash": digest, "chunk_ids": list(chunk_ids)}
+
+    def remove(self, name: str):
+        """Forget a file"""
+        self.files.pop(name, None)
@@ -0,0 +1,216 @@
+"""
+Pipelined embedding and writing for document ingestion.
+
+Chunks are grouped into token-aware batches that stay within the embedding
+provider's per-request limits, embedded by a bounded number of concurrent
+async requests, and handed through a bounded queue to a single writer task
+that upserts the vectors into Chroma in large transactions. Network-bound
+embedding overlaps with disk-bound writes, and only one writer ever touches
+the SQLite file.
+
+Batches may come from an async stream (load -> split -> tag): every stage
+is connected by a bounded queue, so memory use stays flat however large the
+data directory grows.
+"""
+
+import asyncio
+import os
+from functools import partial
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from langchain_core.documents import Document
+
+# Ingestion pipeline configuration
+INGEST_PIPELINE_CONFIG = {
+    "embed_concurrency": int(os.getenv("INGEST_EMBED_CONCURRENCY", "4")),
+    # Per-request limits (OpenAI allows 2048 inputs and 300k tokens per embeddings request)
+    "embed_batch_max_tokens": int(os.getenv("INGEST_EMBED_BATCH_MAX_TOKENS", "100000")),
+    "embed_batch_max_inputs": int(os.getenv("INGEST_EMBED_BATCH_MAX_INPUTS", "2048")),
+    # Chunks per Chroma upsert (capped at the client's maximum batch size)
+    "write_batch_size": int(os.getenv("INGEST_WRITE_BATCH_SIZE", "1000")),
+}
+
+Batch = Tuple[List[Document], List[str]]
+
+
+def chunk_tokens(chunk: Document) -> int:
+    """Token count of a chunk (stored by add_metadata, estimated otherwise)"""
+    return chunk.metadata.get("token_count") or len(chunk.page_content) // 3 + 1
+
+
+class _BatchBuilder:
+    """Accumulates (chunk, id) pairs into batches within the token and input limits"""
+
+    def __init__(self, max_tokens: int, max_inputs: int):
+        self.max_tokens = max_tokens
+        self.max_inputs = max_inputs
+        self.docs: List[Document] = []
+        self.ids: List[str] = []
+        self.tokens = 0
+
+    def add(self, chunk: Document, chunk_id: str) -> Optional[Batch]:
+        """Add a chunk, returning the previous batch if the chunk did not fit in it"""
+        size = chunk_tokens(chunk)
+        full = None
+        if self.docs and (self.tokens + size > self.max_tokens or len(self.docs) >= self.max_inputs):
+            full = self.flush()
+        self.docs.append(chunk)
+        self.ids.append(chunk_id)
+        self.tokens += size
+        return full
+
+    def flush(self) -> Optional[Batch]:
+        """Return the pending batch, if any, and start a new one"""
+        if not self.docs:
+            return None
+        batch = (self.docs, self.ids)
+        self.docs, self.ids, self.tokens = [], [], 0
+        return batch
+
+
+def token_batches(chunks: Iterable[Tuple[Document, str]], max_tokens: int, max_inputs: int) -> Iterator[Batch]:
+    """Group (chunk, id) pairs into batches within the token and input limits"""
+    builder = _BatchBuilder(max_tokens, max_inputs)
+    for chunk, chunk_id in chunks:
+        batch = builder.add(chunk, chunk_id)
+        if batch:
+            yield batch
+    batch = builder.flush()
+    if batch:
+        yield batch
+
+
+async def atoken_batches(chunks: AsyncIterable[Tuple[Document, str]], max_tokens: int,
+                         max_inputs: int) -> AsyncIterator[Batch]:
+    """token_batches for an async stream of (chunk, id) pairs"""
+    builder = _BatchBuilder(max_tokens, max_inputs)
+    async for chunk, chunk_id in chunks:
+        batch = builder.add(chunk, chunk_id)
+        if batch:
+            yield batch
+    batch = builder.flush()
+    if batch:
+        yield batch
+
+
+class PipelineStats:
+    """Counters of one pipeline run, per stage, for progress reporting"""
+
+    def __init__(self):
+        self.files = 0
+        self.documents = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.embed_requests = 0
+        self.written = 0
+        self.write_transactions = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get counters as dictionary"""
+        return dict(vars(self))
+
+
+def max_write_batch(collection: Any) -> int:
+    """Configured write batch size, capped at what the Chroma client accepts"""
+    size = INGEST_PIPELINE_CONFIG["write_batch_size"]
+    try:
+        size = min(size, int(collection._client.get_max_batch_size()))
+    except Exception:
+        pass
+    return max(1, size)
+
+
+async def embed_and_write(batches: Union[Iterable[Batch], AsyncIterable[Batch]], embeddings: Any, collection: Any,
+                          stats: Optional[PipelineStats] = None) -> PipelineStats:
+    """
+    Embed batches (from an iterable or async stream) with bounded
+    concurrency and upsert the vectors into a Chroma collection from a
+    single writer task.
+    """
+    stats = stats or PipelineStats()
+    loop = asyncio.get_running_loop()
+    concurrency = max(1, INGEST_PIPELINE_CONFIG["embed_concurrency"])
+    write_batch_size = max_write_batch(collection)
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    embedded: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def feeder():
+        # Pulls from the source only as fast as the embedders take batches
+        if hasattr(batches, "__aiter__"):
+            async for batch in batches:
+                await pending.put(batch)
+        else:
+            for batch in batches:
+                await pending.put(batch)
+        for _ in range(concurrency):
+            await pending.put(None)
+
+    async def embedder():
+        while True:
+            batch = await pending.get()
+            if batch is None:
+                return
+            docs, ids = batch
+            vectors = await embeddings.aembed_documents([doc.page_content for doc in docs])
+            stats.embed_requests += 1
+            stats.embedded += len(docs)
+            await embedded.put((docs, ids, vectors))
+
+    def write(docs: List[Document], ids: List[str], vectors: List[List[float]]):
+        collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=[doc.page_content for doc in docs],
+            metadatas=[doc.metadata or None for doc in docs],
+        )
+
+    async def writer():
+        docs: List[Document] = []
+        ids: List[str] = []
+        vectors: List[List[float]] = []
+
+        async def flush(count: int):
+            # Writes at most `count` pending chunks, so no upsert exceeds the client's maximum
+            nonlocal docs, ids, vectors
+            if not ids:
+                return
+            await loop.run_in_executor(None, partial(write, docs[:count], ids[:count], vectors[:count]))
+            written = min(count, len(ids))
+            stats.written += written
+            stats.write_transactions += 1
+            print(f"[Chatbot] Progress: {stats.files} files loaded ({stats.documents} documents), "
+                  f"{stats.chunks} chunks split, {stats.embedded} embedded ({stats.embed_requests} requests), "
+                  f"{stats.written} written ({stats.write_transactions} writes)", flush=True)
+            docs, ids, vectors = docs[written:], ids[written:], vectors[written:]
+
+        while True:
+            item = await embedded.get()
+            if item is None:
+                break
+            docs.extend(item[0])
+            ids.extend(item[1])
+            vectors.extend(item[2])
+            while len(ids) >= write_batch_size:
+                await flush(write_batch_size)
+        await flush(write_batch_size)
+
+    embed_tasks = [asyncio.create_task(feeder())] + [asyncio.create_task(embedder()) for _ in range(concurrency)]
+    writer_task = asyncio.create_task(writer())
+    end_of_stream: Optional[asyncio.Task] = None
+    try:
+        embedding_done = asyncio.gather(*embed_tasks)
+        await asyncio.wait({embedding_done, writer_task}, return_when=asyncio.FIRST_COMPLETED)
+        if writer_task.done():
+            # The writer only stops early on an error
+            writer_task.result()
+        await embedding_done
+        # The queue may be full, so the end marker only gets in while the writer is
+        # still consuming; a writer that fails meanwhile is re-raised below
+        end_of_stream = asyncio.create_task(embedded.put(None))
+        await asyncio.wait({end_of_stream, writer_task}, return_when=asyncio.FIRST_COMPLETED)
+        await writer_task
+        return stats
+    finally:
+        for task in embed_tasks + [writer_task, end_of_stream]:
+            if task is not None and not task.done():
+                task.cancel()
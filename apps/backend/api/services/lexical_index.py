@@ -0,0 +1,226 @@
+"""
+Local BM25 inverted index for hybrid chatbot retrieval.
+
+Questions about proper nouns (company names, project names, technologies
+such as "FastAPI") often match poorly on embeddings alone. The inverted
+index is built at ingest time next to the Chroma collection, its results are
+fused with the dense results (reciprocal rank fusion by default), and very
+specific keyword queries can be answered lexically without embedding the
+query at all.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+# Hybrid retrieval configuration
+HYBRID_CONFIG = {
+    "enabled": os.getenv("HYBRID_RETRIEVAL_ENABLED", "true").lower() == "true",
+    # "rrf" (reciprocal rank fusion) or "weighted" (blend of rank-scaled dense and max-scaled BM25 scores)
+    "fusion": os.getenv("HYBRID_FUSION", "rrf").lower(),
+    "rrf_k": int(os.getenv("HYBRID_RRF_K", "60")),
+    "dense_weight": float(os.getenv("HYBRID_DENSE_WEIGHT", "0.5")),
+    "bm25_k1": 1.5,
+    "bm25_b": 0.75,
+    # Lexical fast path: skip the query embedding when the query is dominated by rare keywords
+    "lexical_fast_path": os.getenv("LEXICAL_FAST_PATH_ENABLED", "true").lower() == "true",
+    "fast_path_min_confidence": float(os.getenv("LEXICAL_FAST_PATH_MIN_CONFIDENCE", "0.5")),
+    "rare_term_max_df": float(os.getenv("LEXICAL_RARE_TERM_MAX_DF", "0.1")),
+}
+
+STOPWORDS = frozenset("""
+a about an and are as at be but by can could did do does for from had has have he her him his
+how i in into is it its me my of on or our she so tell than that the their them then there these
+they this to us was we were what when where which who whom why will with would you your diego diego's
+""".split())
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.+#'][a-z0-9+#]+)*[+#]*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms, keeping tokens such as 'node.js' and 'c++' intact"""
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class LexicalIndex:
+    """BM25 inverted index over the ingested chunks"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.avg_doc_length = 0.0
+        self.index_version: Optional[str] = None
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Number of indexed chunks"""
+        return len(self.ids)
+
+    def build(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Optional[Dict[str, Any]]], index_version: Optional[str] = None):
+        """Build the inverted index from chunk ids, texts and metadata"""
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        doc_lengths = []
+        for idx, text in enumerate(documents):
+            terms = tokenize(text or "")
+            doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings[term].append((idx, tf))
+        self._swap(list(ids), list(documents), [m or {} for m in metadatas], doc_lengths, dict(postings), index_version)
+
+    def build_from_collection(self, collection: Any, index_version: Optional[str] = None):
+        """Build the inverted index from every chunk in a Chroma collection"""
+        data = collection.get(include=["documents", "metadatas"])
+        ids = data.get("ids") or []
+        self.build(ids, data.get("documents") or [""] * len(ids), data.get("metadatas") or [{}] * len(ids), index_version)
+
+    def _swap(self, ids, documents, metadatas, doc_lengths, postings, index_version):
+        """Replace the index contents at once so concurrent searches see a consistent index"""
+        with self._lock:
+            self.ids = ids
+            self.documents = documents
+            self.metadatas = metadatas
+            self.doc_lengths = doc_lengths
+            self.postings = postings
+            self.avg_doc_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+            self.index_version = index_version
+            self.loaded = True
+
+    def save(self, path: Path):
+        """Persist the index as JSON next to the Chroma collection"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "index_version": self.index_version,
+                "ids": self.ids,
+                "documents": self.documents,
+                "metadatas": self.metadatas,
+                "doc_lengths": self.doc_lengths,
+                "postings": self.postings,
+            }, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: Path) -> bool:
+        """Load a persisted index, returns False if the file does not exist"""
+        if not path.exists():
+            return False
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        postings = {term: [tuple(p) for p in plist] for term, plist in data["postings"].items()}
+        self._swap(data["ids"], data["documents"], data["metadatas"], data["doc_lengths"], postings, data.get("index_version"))
+        return True
+
+    def _idf(self, df: int, n: int) -> float:
+        """BM25 inverse document frequency"""
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def keyword_confidence(self, query: str) -> float:
+        """
+        Share of query terms that are rare, specific keywords in the corpus.
+        A rare term occurs in at most `rare_term_max_df` of the chunks.
+        """
+        terms = set(tokenize(query))
+        n = self.size
+        if not terms or n == 0:
+            return 0.0
+        max_df = max(1, int(HYBRID_CONFIG["rare_term_max_df"] * n))
+        rare = [term for term in terms if 0 < len(self.postings.get(term, ())) <= max_df]
+        return len(rare) / len(terms)
+
+    def search(self, query: str, k: int, categories: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        """Return the top-k (document, BM25 score) pairs, optionally restricted to categories"""
+        with self._lock:
+            ids, documents, metadatas = self.ids, self.documents, self.metadatas
+            doc_lengths, postings, avg_doc_length = self.doc_lengths, self.postings, self.avg_doc_length
+
+        n = len(ids)
+        if n == 0 or k <= 0:
+            return []
+
+        k1, b = HYBRID_CONFIG["bm25_k1"], HYBRID_CONFIG["bm25_b"]
+        allowed = set(categories) if categories is not None else None
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            plist = postings.get(term)
+            if not plist:
+                continue
+            idf = self._idf(len(plist), n)
+            for idx, tf in plist:
+                if allowed is not None and metadatas[idx].get("category", "general") not in allowed:
+                    continue
+                norm = k1 * (1 - b + b * doc_lengths[idx] / (avg_doc_length or 1.0))
+                scores[idx] += idf * tf * (k1 + 1) / (tf + norm)
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            (Document(id=ids[idx], page_content=documents[idx], metadata=dict(metadatas[idx])), score)
+            for idx, score in top
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get index information as dictionary"""
+        return {
+            "enabled": HYBRID_CONFIG["enabled"],
+            "fusion": HYBRID_CONFIG["fusion"],
+            "loaded": self.loaded,
+            "chunks": self.size,
+            "terms": len(self.postings),
+            "index_version": self.index_version,
+        }
+
+
+def _doc_key(doc: Document) -> str:
+    """Identity of a chunk across retrieval methods"""
+    return doc.id or doc.page_content
+
+
+def fuse_results(dense_docs: List[Document], lexical_results: List[Tuple[Document, float]], k: int) -> List[Document]:
+    """Fuse dense and lexical rankings into one top-k list"""
+    if not lexical_results:
+        return dense_docs[:k]
+    if not dense_docs:
+        return [doc for doc, _ in lexical_results[:k]]
+
+    docs: Dict[str, Document] = {}
+    scores: Dict[str, float] = defaultdict(float)
+    dense_weight = HYBRID_CONFIG["dense_weight"]
+
+    if HYBRID_CONFIG["fusion"] == "weighted":
+        # Dense results carry rank only, so score them linearly by rank
+        for rank, doc in enumerate(dense_docs):
+            key = _doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] += dense_weight * (1 - rank / len(dense_docs))
+        top_score = lexical_results[0][1] or 1.0
+        for doc, score in lexical_results:
+            key = _doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] += (1 - dense_weight) * score / top_score
+    else:
+        rrf_k = HYBRID_CONFIG["rrf_k"]
+        for rank, doc in enumerate(dense_docs):
+            key = _doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] += 1 / (rrf_k + rank + 1)
+        for rank, (doc, _) in enumerate(lexical_results):
+            key = _doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] += 1 / (rrf_k + rank + 1)
+
+    ranked = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [docs[key] for key in ranked[:k]]
+
+
+lexical_index = LexicalIndex()
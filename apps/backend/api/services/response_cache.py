@@ -0,0 +1,283 @@
+"""
+Semantic response cache for the chatbot.
+
+Visitors ask the same handful of questions with small wording changes, so
+answers are cached by query embedding and served again when a new question
+is similar enough (cosine similarity) to one that was already answered.
+The cache is LRU with TTL expiry and an approximate memory cap, and is
+invalidated whenever the document index version changes (re-ingestion).
+With a shared state backend, answers cached by one worker process are
+picked up by the others on their next lookup; the request path uses
+aget/aput, which run the SQLite calls off the event loop.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.api.services.shared_state import SQLiteSharedState, get_shared_state
+
+# Response cache configuration
+RESPONSE_CACHE_CONFIG = {
+    "enabled": os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true",
+    "similarity_threshold": float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95")),
+    "ttl_seconds": float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+    "max_entries": int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "500")),
+    "max_bytes": int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+}
+
+
+@dataclass
+class CachedResponse:
+    """A cached answer with the normalized embedding of its question"""
+    embedding: np.ndarray
+    query_type: str
+    response: str
+    sources: List[str]
+    created_at: float
+    size_bytes: int = field(default=0)
+
+
+class SemanticResponseCache:
+    """LRU + TTL cache of chat answers looked up by embedding similarity"""
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.95,
+        ttl_seconds: float = 3600,
+        max_entries: int = 500,
+        max_bytes: int = 16 * 1024 * 1024,
+        shared_state: Optional[SQLiteSharedState] = None,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[int, CachedResponse]" = OrderedDict()
+        self.index_version: Optional[str] = None
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._next_key = 0
+        # Stacked embeddings per query type, rebuilt only after that type's entries change
+        self._matrices: Dict[str, Tuple[List[int], np.ndarray]] = {}
+        # Answers cached by other worker processes are pulled in from the shared store
+        self.shared_state = shared_state
+        self._synced_id = 0
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        """Convert an embedding to a unit-length float32 vector"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_version(self, index_version: Optional[str]):
+        """Drop all entries if the document index changed since they were stored"""
+        if index_version != self.index_version:
+            if self.entries:
+                self.invalidations += 1
+            self.clear()
+            self.index_version = index_version
+            self._synced_id = 0
+
+    def _remove(self, key: int):
+        """Remove a single entry"""
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size_bytes
+        self._matrices.pop(entry.query_type, None)
+
+    def _expire(self, now: float):
+        """Remove entries older than the TTL (oldest entries are at the front)"""
+        expired = [
+            key for key, entry in self.entries.items()
+            if now - entry.created_at > self.ttl_seconds
+        ]
+        for key in expired:
+            self._remove(key)
+            self.evictions += 1
+
+    def _add(self, key: int, entry: CachedResponse):
+        """Insert an entry, evicting least recently used entries to respect the caps"""
+        self.entries[key] = entry
+        self.total_bytes += entry.size_bytes
+        self._matrices.pop(entry.query_type, None)
+
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _matrix(self, query_type: str) -> Tuple[List[int], np.ndarray]:
+        """Keys and stacked embeddings of the entries of a query type (cached until they change)"""
+        cached = self._matrices.get(query_type)
+        if cached is None:
+            keys = [key for key, entry in self.entries.items() if entry.query_type == query_type]
+            matrix = np.stack([self.entries[key].embedding for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+            cached = self._matrices[query_type] = (keys, matrix)
+        return cached
+
+    def _sync(self):
+        """Add answers that other workers cached since the last sync"""
+        self._apply_rows(self.shared_state.responses_since(self._synced_id, self.index_version))
+
+    async def _async_sync(self):
+        """_sync with the shared store read on the default executor"""
+        synced_id, index_version = self._synced_id, self.index_version
+        try:
+            rows = await asyncio.to_thread(self.shared_state.responses_since, synced_id, index_version)
+        except sqlite3.OperationalError as e:
+            print(f"[Chatbot] Could not read shared response cache: {e}", flush=True)
+            return
+        # Rows read for a version or position that changed meanwhile are dropped
+        if (synced_id, index_version) == (self._synced_id, self.index_version):
+            self._apply_rows(rows)
+
+    def _apply_rows(self, rows: List[Any]):
+        """Add shared rows (oldest first) to the local entries"""
+        if not rows:
+            return
+        # Shared rows carry wall-clock times, local entries monotonic ones
+        offset = time.monotonic() - time.time()
+        for row_id, query_type, embedding, response, sources, created_at in rows:
+            if row_id in self.entries:
+                continue
+            vector = np.frombuffer(embedding, dtype=np.float32)
+            entry = CachedResponse(
+                embedding=vector,
+                query_type=query_type,
+                response=response,
+                sources=json.loads(sources),
+                created_at=created_at + offset,
+                size_bytes=vector.nbytes + len(response.encode("utf-8")) + len(sources),
+            )
+            if entry.size_bytes <= self.max_bytes:
+                self._add(row_id, entry)
+        self._synced_id = rows[-1][0]
+
+    def get(self, embedding: Sequence[float], query_type: str, index_version: Optional[str] = None) -> Optional[CachedResponse]:
+        """Find a cached answer for a similar question of the same query type"""
+        self._check_version(index_version)
+        if self.shared_state is not None:
+            self._sync()
+        return self._lookup(embedding, query_type)
+
+    async def aget(self, embedding: Sequence[float], query_type: str, index_version: Optional[str] = None) -> Optional[CachedResponse]:
+        """get for the request path: the shared store is read off the event loop"""
+        self._check_version(index_version)
+        if self.shared_state is not None:
+            await self._async_sync()
+        return self._lookup(embedding, query_type)
+
+    def _lookup(self, embedding: Sequence[float], query_type: str) -> Optional[CachedResponse]:
+        """Find the most similar local entry of the same query type"""
+        self._expire(time.monotonic())
+
+        best_key = None
+        best_score = self.similarity_threshold
+        if self.entries:
+            keys, matrix = self._matrix(query_type)
+            if keys:
+                scores = matrix @ self._normalize(embedding)
+                idx = int(np.argmax(scores))
+                if scores[idx] >= best_score:
+                    best_key, best_score = keys[idx], float(scores[idx])
+
+        if best_key is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(best_key)
+        return self.entries[best_key]
+
+    def put(self, embedding: Sequence[float], query_type: str, response: str, sources: List[str], index_version: Optional[str] = None):
+        """Store an answer, evicting least recently used entries to respect the caps"""
+        self._check_version(index_version)
+        entry = self._entry(embedding, query_type, response, sources)
+        if entry is None:
+            return
+        if self.shared_state is not None:
+            key = self.shared_state.add_response(*self._shared_row(entry, index_version))
+        else:
+            key = self._next_key
+            self._next_key += 1
+        self._add(key, entry)
+
+    async def aput(self, embedding: Sequence[float], query_type: str, response: str, sources: List[str],
+                   index_version: Optional[str] = None):
+        """put for the request path: the shared store is written off the event loop"""
+        if self.shared_state is None:
+            self.put(embedding, query_type, response, sources, index_version)
+            return
+        self._check_version(index_version)
+        entry = self._entry(embedding, query_type, response, sources)
+        if entry is None:
+            return
+        try:
+            key = await asyncio.to_thread(self.shared_state.add_response, *self._shared_row(entry, index_version))
+        except sqlite3.OperationalError as e:
+            print(f"[Chatbot] Could not write shared response cache: {e}", flush=True)
+            return
+        if index_version == self.index_version:
+            self._add(key, entry)
+
+    def _entry(self, embedding: Sequence[float], query_type: str, response: str, sources: List[str]) -> Optional[CachedResponse]:
+        """Build an entry for an answer, or None if it exceeds the memory cap on its own"""
+        vector = self._normalize(embedding)
+        size_bytes = vector.nbytes + len(response.encode("utf-8")) + sum(len(s) for s in sources)
+        if size_bytes > self.max_bytes:
+            return None
+        return CachedResponse(
+            embedding=vector,
+            query_type=query_type,
+            response=response,
+            sources=list(sources),
+            created_at=time.monotonic(),
+            size_bytes=size_bytes,
+        )
+
+    def _shared_row(self, entry: CachedResponse, index_version: Optional[str]) -> tuple:
+        """Arguments of SQLiteSharedState.add_response for an entry"""
+        return (
+            index_version, entry.query_type, entry.embedding.astype(np.float32).tobytes(), entry.response,
+            json.dumps(entry.sources), self.ttl_seconds, self.max_entries,
+        )
+
+    def clear(self):
+        """Remove all entries"""
+        self.entries.clear()
+        self.total_bytes = 0
+        self._matrices.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters as dictionary"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "index_version": self.index_version,
+            "shared": self.shared_state is not None,
+        }
+
+
+response_cache = SemanticResponseCache(
+    similarity_threshold=RESPONSE_CACHE_CONFIG["similarity_threshold"],
+    ttl_seconds=RESPONSE_CACHE_CONFIG["ttl_seconds"],
+    max_entries=RESPONSE_CACHE_CONFIG["max_entries"],
+    max_bytes=RESPONSE_CACHE_CONFIG["max_bytes"],
+    shared_state=get_shared_state(),
+)
@@ -0,0 +1,277 @@
+"""
+Bounded multi-turn session store for the chatbot.
+
+Each session keeps a short list of compact turns (question, answer, sources,
+retrieved chunk IDs and token count). Turns past the per-session cap are
+folded into a one-line summary of earlier questions. Sessions are evicted
+least recently used first when the session or memory caps are exceeded, and
+when they have been idle longer than the TTL. With a shared state backend,
+sessions are stored in it (as JSON) so every worker process continues the
+same conversations; the request path then uses the async methods, which run
+the SQLite calls off the event loop.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from backend.api.services.shared_state import SQLiteSharedState, get_shared_state
+
+# Session store configuration
+SESSION_CONFIG = {
+    "max_sessions": int(os.getenv("SESSION_MAX_SESSIONS", "1000")),
+    "max_bytes": int(os.getenv("SESSION_MAX_BYTES", str(8 * 1024 * 1024))),
+    "idle_ttl_seconds": float(os.getenv("SESSION_IDLE_TTL_SECONDS", "1800")),
+    "max_turns": int(os.getenv("SESSION_MAX_TURNS", "10")),
+    # Token budget for the recent turns sent to the LLM with each question
+    "history_tokens": int(os.getenv("SESSION_HISTORY_TOKENS", "800")),
+    "max_summary_chars": 600,
+}
+
+
+@dataclass
+class Turn:
+    """One question and answer, with the chunks retrieved to answer it"""
+    id: str
+    question: str
+    answer: str
+    sources: Tuple[str, ...]
+    chunk_ids: Tuple[str, ...]
+    tokens: int
+    timestamp: float
+    size_bytes: int = field(default=0)
+
+
+@dataclass
+class Session:
+    """The retained turns of a conversation and a summary of older ones"""
+    turns: List[Turn] = field(default_factory=list)
+    summary: str = ""
+    last_access: float = 0.0
+    size_bytes: int = 0
+
+
+def summarize_turns(summary: str, turns: List[Turn], max_chars: int) -> str:
+    """Extend a summary with the questions of older turns, keeping the most recent text"""
+    questions = "; ".join(turn.question for turn in turns)
+    text = f"{summary}; {questions}" if summary else questions
+    return text if len(text) <= max_chars else "..." + text[-max_chars:]
+
+
+class SessionStore:
+    """LRU session store with idle expiry, a session cap and an approximate memory cap"""
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_bytes: int = 8 * 1024 * 1024,
+        idle_ttl_seconds: float = 1800,
+        max_turns: int = 10,
+        max_summary_chars: int = 600,
+        shared_state: Optional[SQLiteSharedState] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_turns = max_turns
+        self.max_summary_chars = max_summary_chars
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.total_bytes = 0
+        self.evictions = 0
+        # Keeps the sessions in SQLite so all worker processes see the same conversations
+        self.shared_state = shared_state
+
+    @staticmethod
+    def _encode(session: Session) -> str:
+        """Serialize a session for the shared store"""
+        return json.dumps({"turns": [asdict(turn) for turn in session.turns], "summary": session.summary})
+
+    @staticmethod
+    def _decode(data: Optional[str]) -> Optional[Session]:
+        """Deserialize a session from the shared store"""
+        if data is None:
+            return None
+        raw = json.loads(data)
+        turns = [
+            Turn(**{**turn, "sources": tuple(turn["sources"]), "chunk_ids": tuple(turn["chunk_ids"])})
+            for turn in raw["turns"]
+        ]
+        return Session(turns=turns, summary=raw["summary"], size_bytes=len(data))
+
+    def _expire(self, now: float):
+        """Remove idle sessions (least recently used sessions are at the front)"""
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if now - session.last_access <= self.idle_ttl_seconds:
+                break
+            self._remove(session_id)
+            self.evictions += 1
+
+    def _remove(self, session_id: str):
+        """Remove a single session"""
+        session = self.sessions.pop(session_id)
+        self.total_bytes -= session.size_bytes
+
+    def get(self, session_id: Optional[str]) -> Optional[Session]:
+        """Get a session and mark it as recently used, or None"""
+        if not session_id:
+            return None
+        if self.shared_state is not None:
+            return self._decode(self.shared_state.get_session(session_id, self.idle_ttl_seconds))
+        now = time.monotonic()
+        self._expire(now)
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.last_access = now
+            self.sessions.move_to_end(session_id)
+        return session
+
+    def add_turn(self, session_id: str, question: str, answer: str, sources: List[str], chunk_ids: List[str], tokens: int):
+        """Append a turn, folding the oldest turns into the summary and evicting sessions to respect the caps"""
+        turn = Turn(
+            id=uuid4().hex,
+            question=question,
+            answer=answer,
+            sources=tuple(sources),
+            chunk_ids=tuple(chunk_ids),
+            tokens=tokens,
+            timestamp=time.time(),
+        )
+        turn.size_bytes = (
+            len(question.encode("utf-8")) + len(answer.encode("utf-8"))
+            + sum(len(s) for s in turn.sources) + sum(len(c) for c in turn.chunk_ids) + 200
+        )
+
+        if self.shared_state is not None:
+            def update(data: Optional[str]) -> str:
+                session = self._decode(data) or Session()
+                self._append(session, turn)
+                return self._encode(session)
+            self.evictions += self.shared_state.update_session(
+                session_id, update, self.idle_ttl_seconds, self.max_sessions, self.max_bytes
+            )
+            return
+
+        session = self.get(session_id)
+        if session is None:
+            session = Session(last_access=time.monotonic())
+            self.sessions[session_id] = session
+        old_size = session.size_bytes
+        self._append(session, turn)
+        self.total_bytes += session.size_bytes - old_size
+
+        while len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.sessions)))
+            self.evictions += 1
+
+    def _append(self, session: Session, turn: Turn):
+        """Append a turn to a session, folding the oldest turns into the summary"""
+        session.turns.append(turn)
+
+        if len(session.turns) > self.max_turns:
+            folded = session.turns[:-self.max_turns]
+            session.turns = session.turns[-self.max_turns:]
+            session.summary = summarize_turns(session.summary, folded, self.max_summary_chars)
+        session.size_bytes = sum(t.size_bytes for t in session.turns) + len(session.summary)
+
+    def history_window(self, session_id: Optional[str], max_tokens: int) -> Tuple[str, List[Turn]]:
+        """
+        Get the most recent turns that fit the token budget, oldest first, and
+        a summary covering every earlier turn.
+        """
+        session = self.get(session_id)
+        if session is None:
+            return "", []
+        window: List[Turn] = []
+        used = 0
+        for turn in reversed(session.turns):
+            if used + turn.tokens > max_tokens:
+                break
+            window.append(turn)
+            used += turn.tokens
+        window.reverse()
+        older = session.turns[:len(session.turns) - len(window)]
+        summary = summarize_turns(session.summary, older, self.max_summary_chars) if older else session.summary
+        return summary, window
+
+    def last_turn(self, session_id: Optional[str]) -> Optional[Turn]:
+        """Get the most recent turn of a session, or None"""
+        session = self.get(session_id)
+        return session.turns[-1] if session and session.turns else None
+
+    def delete(self, session_id: str) -> bool:
+        """Remove a session, returns False if it did not exist"""
+        if self.shared_state is not None:
+            return self.shared_state.delete_session(session_id)
+        if session_id not in self.sessions:
+            return False
+        self._remove(session_id)
+        return True
+
+    def clear(self):
+        """Remove all sessions"""
+        self.sessions.clear()
+        self.total_bytes = 0
+
+    async def _run_shared(self, default: Any, method, *args) -> Any:
+        """Run a method on the default executor in shared mode (directly otherwise), `default` if the database is locked"""
+        if self.shared_state is None:
+            return method(*args)
+        try:
+            return await asyncio.to_thread(method, *args)
+        except sqlite3.OperationalError as e:
+            print(f"[Chatbot] Shared session store unavailable: {e}", flush=True)
+            return default
+
+    async def aget(self, session_id: Optional[str]) -> Optional[Session]:
+        """get for the request path"""
+        return await self._run_shared(None, self.get, session_id)
+
+    async def aadd_turn(self, session_id: str, question: str, answer: str, sources: List[str], chunk_ids: List[str], tokens: int):
+        """add_turn for the request path"""
+        await self._run_shared(None, self.add_turn, session_id, question, answer, sources, chunk_ids, tokens)
+
+    async def ahistory_window(self, session_id: Optional[str], max_tokens: int) -> Tuple[str, List[Turn]]:
+        """history_window for the request path"""
+        return await self._run_shared(("", []), self.history_window, session_id, max_tokens)
+
+    async def alast_turn(self, session_id: Optional[str]) -> Optional[Turn]:
+        """last_turn for the request path"""
+        return await self._run_shared(None, self.last_turn, session_id)
+
+    async def adelete(self, session_id: str) -> bool:
+        """delete for the request path"""
+        return await self._run_shared(False, self.delete, session_id)
+
+    async def aget_stats(self) -> Dict[str, Any]:
+        """get_stats for the request path"""
+        return await self._run_shared({"shared": True, "evictions": self.evictions}, self.get_stats)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store counters as dictionary (shared mode does not count turns; evictions are per worker process)"""
+        if self.shared_state is not None:
+            sessions, size = self.shared_state.session_counts()
+            return {"shared": True, "sessions": sessions, "bytes": size, "evictions": self.evictions}
+        return {
+            "shared": False,
+            "sessions": len(self.sessions),
+            "turns": sum(len(session.turns) for session in self.sessions.values()),
+            "bytes": self.total_bytes,
+            "evictions": self.evictions,
+        }
+
+
+session_store = SessionStore(
+    max_sessions=SESSION_CONFIG["max_sessions"],
+    max_bytes=SESSION_CONFIG["max_bytes"],
+    idle_ttl_seconds=SESSION_CONFIG["idle_ttl_seconds"],
+    max_turns=SESSION_CONFIG["max_turns"],
+    max_summary_chars=SESSION_CONFIG["max_summary_chars"],
+    shared_state=get_shared_state(),
+)
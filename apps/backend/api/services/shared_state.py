@@ -0,0 +1,238 @@
+"""
+Shared state for running the API with several uvicorn workers.
+
+Rate limit buckets, cached chat answers and chat sessions live in
+per-process memory by default. With SHARED_STATE_BACKEND=sqlite they are
+kept in a local SQLite database in WAL mode instead, so every worker on the
+machine enforces the same limits, reuses answers cached by the others and
+continues the same conversations, without any outside service. The calls block on SQLite locks, so the request path runs them
+on the default executor rather than on the event loop.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Shared state configuration
+SHARED_STATE_CONFIG = {
+    # "memory" keeps state per process, "sqlite" shares it between worker processes
+    "backend": os.getenv("SHARED_STATE_BACKEND", "memory").lower(),
+    "path": os.getenv("SHARED_STATE_PATH", str(Path(__file__).parent.parent.parent / "shared_state.db")),
+    # How long a call waits for another worker's write lock before giving up
+    "busy_timeout_seconds": float(os.getenv("SHARED_STATE_BUSY_TIMEOUT_SECONDS", "0.5")),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    capacity INTEGER NOT NULL,
+    window_seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_blocks (
+    identifier TEXT PRIMARY KEY,
+    blocked_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cached_responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    index_version TEXT,
+    query_type TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    response TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    last_access REAL NOT NULL
+);
+"""
+
+
+class SQLiteSharedState:
+    """Rate limit buckets and cached answers in a SQLite database shared by worker processes"""
+
+    def __init__(self, path: str, busy_timeout: Optional[float] = None):
+        self.path = path
+        self.busy_timeout = SHARED_STATE_CONFIG["busy_timeout_seconds"] if busy_timeout is None else busy_timeout
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread, in autocommit mode so transactions are explicit"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take_token(self, identifier: str, capacity: int, window_seconds: float, block_seconds: float) -> Tuple[str, Optional[float]]:
+        """
+        Take one token from the bucket of an identifier and limit.
+        Returns ("allowed", None), ("blocked", until) for an identifier that
+        was already blocked, or ("exceeded", until) when this request emptied
+        the bucket. `until` is a Unix time.
+        """
+        key = f"{identifier}|{capacity}|{window_seconds:g}"
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT blocked_until FROM rate_blocks WHERE identifier = ?", (identifier,)).fetchone()
+            if row is not None:
+                if now < row[0]:
+                    conn.execute("COMMIT")
+                    return "blocked", row[0]
+                conn.execute("DELETE FROM rate_blocks WHERE identifier = ?", (identifier,))
+
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens = float(capacity) if row is None else min(
+                float(capacity), row[0] + (now - row[1]) * capacity / window_seconds
+            )
+            if tokens < 1:
+                blocked_until = now + block_seconds
+                conn.execute("INSERT OR REPLACE INTO rate_blocks VALUES (?, ?)", (identifier, blocked_until))
+                conn.execute("DELETE FROM rate_buckets WHERE key = ?", (key,))
+                conn.execute("COMMIT")
+                return "exceeded", blocked_until
+
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?, ?, ?)",
+                (key, tokens - 1, now, capacity, window_seconds),
+            )
+            conn.execute("COMMIT")
+            return "allowed", None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def sweep_rate_limits(self) -> int:
+        """Drop expired blocks and buckets that have refilled completely"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = conn.execute("DELETE FROM rate_blocks WHERE blocked_until <= ?", (now,)).rowcount
+            removed += conn.execute(
+                "DELETE FROM rate_buckets WHERE tokens + (? - updated) * capacity / window_seconds >= capacity",
+                (now,),
+            ).rowcount
+            conn.execute("COMMIT")
+            return removed
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def rate_limit_counts(self) -> Tuple[int, int]:
+        """Number of tracked buckets and blocked identifiers"""
+        conn = self._connection()
+        buckets = conn.execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+        blocked = conn.execute("SELECT COUNT(*) FROM rate_blocks WHERE blocked_until > ?", (time.time(),)).fetchone()[0]
+        return buckets, blocked
+
+    def add_response(self, index_version: Optional[str], query_type: str, embedding: bytes,
+                     response: str, sources: str, ttl_seconds: float, max_entries: int) -> int:
+        """Append a cached answer, pruning other index versions, expired and excess rows. Returns the row id."""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cached_responses WHERE index_version IS NOT ?", (index_version,))
+            conn.execute("DELETE FROM cached_responses WHERE created_at < ?", (now - ttl_seconds,))
+            row_id = conn.execute(
+                "INSERT INTO cached_responses (index_version, query_type, embedding, response, sources, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (index_version, query_type, embedding, response, sources, now),
+            ).lastrowid
+            conn.execute("DELETE FROM cached_responses WHERE id <= ?", (row_id - max_entries,))
+            conn.execute("COMMIT")
+            return row_id
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def responses_since(self, last_id: int, index_version: Optional[str]) -> List[Tuple[Any, ...]]:
+        """Cached answers added after a row id for an index version, oldest first"""
+        return self._connection().execute(
+            "SELECT id, query_type, embedding, response, sources, created_at FROM cached_responses "
+            "WHERE id > ? AND index_version IS ? ORDER BY id",
+            (last_id, index_version),
+        ).fetchall()
+
+    def get_session(self, session_id: str, idle_ttl_seconds: float) -> Optional[str]:
+        """The serialized session, or None if it is missing or has been idle past the TTL"""
+        row = self._connection().execute(
+            "SELECT data FROM chat_sessions WHERE session_id = ? AND last_access >= ?",
+            (session_id, time.time() - idle_ttl_seconds),
+        ).fetchone()
+        return row[0] if row else None
+
+    def update_session(self, session_id: str, update: Callable[[Optional[str]], str], idle_ttl_seconds: float,
+                       max_sessions: int, max_bytes: int) -> int:
+        """
+        Replace a serialized session with `update(current)` in one transaction,
+        so concurrent turns from different workers are not lost, then drop
+        idle sessions and the least recently used ones past the caps.
+        Returns the number of sessions dropped.
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = conn.execute(
+                "DELETE FROM chat_sessions WHERE last_access < ?", (now - idle_ttl_seconds,)
+            ).rowcount
+            row = conn.execute("SELECT data FROM chat_sessions WHERE session_id = ?", (session_id,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO chat_sessions VALUES (?, ?, ?)",
+                (session_id, update(row[0] if row else None), now),
+            )
+            removed += conn.execute(
+                "DELETE FROM chat_sessions WHERE session_id IN ("
+                "SELECT session_id FROM (SELECT session_id, ROW_NUMBER() OVER w AS n, SUM(LENGTH(data)) OVER w AS total "
+                "FROM chat_sessions WINDOW w AS (ORDER BY last_access DESC)) WHERE n > ? OR total > ?)",
+                (max_sessions, max_bytes),
+            ).rowcount
+            conn.execute("COMMIT")
+            return removed
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_session(self, session_id: str) -> bool:
+        """Remove a session, returns False if it did not exist"""
+        return self._connection().execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+
+    def session_counts(self) -> Tuple[int, int]:
+        """Number of stored sessions and their serialized size in bytes"""
+        count, size = self._connection().execute("SELECT COUNT(*), SUM(LENGTH(data)) FROM chat_sessions").fetchone()
+        return count, size or 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get backend information as dictionary"""
+        return {"backend": "sqlite", "path": self.path}
+
+
+_shared_state: Optional[SQLiteSharedState] = None
+_shared_state_lock = threading.Lock()
+
+
+def get_shared_state() -> Optional[SQLiteSharedState]:
+    """The configured shared state backend, or None when state stays in process"""
+    global _shared_state
+    if SHARED_STATE_CONFIG["backend"] != "sqlite":
+        return None
+    with _shared_state_lock:
+        if _shared_state is None:
+            _shared_state = SQLiteSharedState(SHARED_STATE_CONFIG["path"])
+            print(f"[Chatbot] Sharing rate limits and cached answers via SQLite at {SHARED_STATE_CONFIG['path']}", flush=True)
+        return _shared_state
@@ -0,0 +1,131 @@
+"""
+In-memory vector index for serving chatbot retrieval.
+
+The corpus is small (a résumé and a handful of markdown files), so all
+embeddings from the Chroma collection fit in one contiguous float32 matrix.
+Top-k cosine search is then a single matrix-vector product with a category
+mask, with no SQLite or HNSW work on the request path. Chroma remains the
+source of truth; the index is reloaded when the index version changes.
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Vector index configuration
+VECTOR_INDEX_CONFIG = {
+    # "memory" serves similarity search from the in-memory index, "chroma" queries Chroma directly
+    "mode": os.getenv("VECTOR_INDEX_MODE", "memory").lower(),
+}
+
+
+class InMemoryVectorIndex:
+    """Contiguous float32 embedding matrix with compact metadata arrays"""
+
+    def __init__(self):
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.category_codes = np.zeros(0, dtype=np.int16)
+        self.category_names: Dict[str, int] = {}
+        self.index_version: Optional[str] = None
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Number of indexed chunks"""
+        return len(self.ids)
+
+    def load(self, collection: Any, index_version: Optional[str] = None):
+        """Load all embeddings, documents and metadata from a Chroma collection"""
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        embeddings = data.get("embeddings")
+        ids = list(data.get("ids") or [])
+        if embeddings is None or len(ids) == 0:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix /= norms
+
+        metadatas = [metadata or {} for metadata in (data.get("metadatas") or [{}] * len(ids))]
+        category_names: Dict[str, int] = {}
+        category_codes = np.empty(len(ids), dtype=np.int16)
+        for i, metadata in enumerate(metadatas):
+            category = metadata.get("category", "general")
+            category_codes[i] = category_names.setdefault(category, len(category_names))
+
+        # Swap everything in at once so concurrent searches see a consistent index
+        with self._lock:
+            self.matrix = matrix
+            self.ids = ids
+            self.positions = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            self.documents = list(data.get("documents") or [""] * len(ids))
+            self.metadatas = metadatas
+            self.category_codes = category_codes
+            self.category_names = category_names
+            self.index_version = index_version
+            self.loaded = True
+
+    def search(self, embedding: Sequence[float], k: int, categories: Optional[List[str]] = None) -> List[Document]:
+        """Return the top-k documents by cosine similarity, optionally restricted to categories"""
+        with self._lock:
+            matrix, ids = self.matrix, self.ids
+            documents, metadatas = self.documents, self.metadatas
+            category_codes, category_names = self.category_codes, self.category_names
+
+        if len(ids) == 0 or k <= 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = matrix @ query
+
+        if categories is not None:
+            codes = [category_names[c] for c in categories if c in category_names]
+            mask = np.isin(category_codes, codes)
+            scores = np.where(mask, scores, -np.inf)
+            k = min(k, int(mask.sum()))
+            if k == 0:
+                return []
+
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            Document(id=ids[i], page_content=documents[i], metadata=dict(metadatas[i]))
+            for i in top
+        ]
+
+    def get(self, ids: Sequence[str]) -> List[Document]:
+        """Return the documents with the given ids, in the same order, skipping unknown ids"""
+        with self._lock:
+            positions, documents, metadatas = self.positions, self.documents, self.metadatas
+        return [
+            Document(id=chunk_id, page_content=documents[positions[chunk_id]], metadata=dict(metadatas[positions[chunk_id]]))
+            for chunk_id in ids if chunk_id in positions
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get index information as dictionary"""
+        return {
+            "mode": VECTOR_INDEX_CONFIG["mode"],
+            "loaded": self.loaded,
+            "chunks": self.size,
+            "dimensions": int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0,
+            "bytes": int(self.matrix.nbytes),
+            "categories": sorted(self.category_names),
+            "index_version": self.index_version,
+        }
+
+
+vector_index = InMemoryVectorIndex()
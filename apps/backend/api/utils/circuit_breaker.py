@@ -0,0 +1,73 @@
+"""
+Circuit breaker for calls to an unreliable upstream.
+
+After `failure_threshold` consecutive failures the circuit opens and calls
+are rejected immediately instead of waiting for the upstream to time out.
+Once `reset_timeout` seconds have passed a single probe call is let
+through (half-open): success closes the circuit, failure opens it again,
+and a probe that ends without a verdict (cancelled) lets the next call probe.
+"""
+
+import time
+from typing import Any, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go to the upstream now"""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        """Close the circuit after a successful call"""
+        self.state = CLOSED
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit at the threshold or after a failed probe"""
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """End a call without a verdict (e.g. cancelled), so a new half-open probe can go through"""
+        self.probe_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get breaker state and counters as dictionary"""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout_seconds": self.reset_timeout,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,63 @@
+"""
+Single-flight request coalescing.
+
+Concurrent callers asking for the same key wait on one in-flight
+computation and share its result (or exception) instead of each starting
+their own. The shared computation is cancelled only when every caller
+waiting on it has gone away.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """An in-flight computation and the number of callers waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce identical concurrent async computations by key"""
+
+    def __init__(self):
+        self.in_flight: Dict[Hashable, _Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Run func() for key, or join the computation already running for key"""
+        flight = self.in_flight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func()))
+            self.in_flight[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            # Shield so one caller disconnecting does not cancel the others
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, key: Hashable, flight: _Flight):
+        """Remove a finished computation so later calls start a fresh one"""
+        if self.in_flight.get(key) is flight:
+            del self.in_flight[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing counters as dictionary"""
+        return {
+            "in_flight": len(self.in_flight),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
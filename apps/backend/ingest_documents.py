@@ -9,11 +9,19 @@ Usage:
     python ingest_documents.py
     or
     python -m backend.ingest_documents
+
+Options:
+    --incremental           Only embed new or changed files and delete chunks of changed or removed ones
+    --skip-precompute       Do not precompute answers for frequent questions
+    --questions-file PATH   Newline-separated questions to precompute answers for
+    --from-query-log N      Precompute answers for the N most frequent logged questions
 """
 
+import argparse
 import os
 import sys
 from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv
 
 # Add backend directory to path
@@ -45,16 +53,57 @@ else:
 
 # Import after path setup
 import asyncio
-from api.services.chatbot_service import (
+from backend.api.services.chatbot_service import (
     DATA_PATH,
     CHROMA_PATH,
     initialize_core_components,
+    PRECOMPUTED_ANSWERS_PATH,
     ingest_documents_async,
-    check_documents_exist_sync
+    check_documents_exist_sync,
+    load_serving_indexes,
+    get_index_version
 )
+from backend.api.services.chat_pipeline import precompute_answers
+from backend.api.services.answer_store import ANSWER_STORE_CONFIG, answer_store, load_questions, mine_frequent_questions
+
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Ingest documents into ChromaDB")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only embed new or changed files (by content hash) and delete chunks of changed or removed ones")
+    parser.add_argument("--skip-precompute", action="store_true",
+                        help="do not precompute answers for frequent questions")
+    parser.add_argument("--questions-file", default=None,
+                        help="newline-separated questions to precompute answers for")
+    parser.add_argument("--from-query-log", type=int, default=0, metavar="N",
+                        help="precompute answers for the N most frequent logged questions")
+    return parser.parse_args()
 
 
-async def main():
+async def precompute_frequent_answers(args) -> Optional[int]:
+    """
+    Generate answers for the configured (or mined) frequent questions.
+    Returns None without calling the LLM when the saved answers were built
+    from the current index for the same questions.
+    """
+    questions = load_questions(args.questions_file)
+    if args.from_query_log > 0:
+        mined = mine_frequent_questions(top_n=args.from_query_log)
+        print(f"[Ingest] Mined {len(mined)} frequent questions from the query log")
+        questions += [q for q in mined if q not in questions]
+    
+    answer_store.refresh(PRECOMPUTED_ANSWERS_PATH)
+    if answer_store.is_current(questions, get_index_version()):
+        return None
+    
+    # Retrieval for the new answers must use the freshly ingested index
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, load_serving_indexes)
+    return await precompute_answers(questions)
+
+
+async def main(args):
     """Main ingestion function"""
     print("=" * 60)
     print("Diego Portfolio - Document Ingestion Script")
@@ -78,13 +127,16 @@ async def main():
     print(f"[Ingest] Checking ChromaDB at: {CHROMA_PATH}")
     documents_exist, doc_count = check_documents_exist_sync()
     
-    if documents_exist:
+    if documents_exist and args.incremental:
+        print("[Ingest] Found existing documents, updating them incrementally...")
+    elif documents_exist:
         print(f"[Ingest] Found {doc_count} existing documents in ChromaDB")
-        response = input("[Ingest] Do you want to re-ingest documents? This will add to existing documents. (y/N): ")
+        response = input("[Ingest] Do you want to re-ingest documents? Unchanged chunks are overwritten, not duplicated. (y/N): ")
         if response.lower() != 'y':
             print("[Ingest] Ingestion cancelled. Exiting.")
             sys.exit(0)
-        print("[Ingest] Proceeding with ingestion (will add to existing documents)...")
+        print("[Ingest] Proceeding with ingestion (will upsert into existing documents)...")
+        print("[Ingest] Tip: use --incremental to update only new or changed files")
     else:
         print("[Ingest] No existing documents found. Starting fresh ingestion...")
     
@@ -98,13 +150,24 @@ async def main():
     
     try:
         success = await asyncio.wait_for(
-            ingest_documents_async(),
+            ingest_documents_async(incremental=args.incremental),
             timeout=900.0  # 15 minute timeout
         )
         
         if success:
             # Verify ingestion
             documents_exist, doc_count = check_documents_exist_sync()
+            
+            # Step 4: Precompute answers for frequent questions
+            if ANSWER_STORE_CONFIG["enabled"] and not args.skip_precompute:
+                print()
+                print("[Ingest] Step 4: Precomputing answers for frequent questions...")
+                answer_count = await precompute_frequent_answers(args)
+                if answer_count is None:
+                    print("[Ingest] Documents and questions are unchanged, keeping the precomputed answers")
+                else:
+                    print(f"[Ingest] Precomputed {answer_count} answers")
+            
             print()
             print("=" * 60)
             print("[Ingest] SUCCESS: Document ingestion completed!")
@@ -139,7 +202,7 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        asyncio.run(main(parse_args()))
     except KeyboardInterrupt:
         print()
         print("[Ingest] Ingestion interrupted by user. Exiting.")
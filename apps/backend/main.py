@@ -23,7 +23,10 @@ if str(backend_dir) not in sys.path:
     sys.path.insert(0, str(backend_dir))
 
 from backend.api.routes import geo, chat
-from backend.api.services.chatbot_service import initialize_chatbot_async
+from backend.api.services.chatbot_service import initialize_chatbot_async, close_llm_clients, rate_limiter
+from backend.api.services.http_clients import create_http_clients, close_http_clients
+from backend.api.services.geo_database import load_geo_database
+from backend.api.services.answer_store import run_query_log_flusher, flush_query_log
 
 # Load environment variables
 project_root = backend_dir.parent.parent
@@ -51,10 +54,22 @@ async def lifespan(app: FastAPI):
     print(f"Environment: {os.getenv('ENVIRONMENT', 'development')}", flush=True)
     print("=" * 60, flush=True)
     
+    # Pooled outbound HTTP clients, injected into routes via dependencies
+    app.state.http_clients = create_http_clients()
+    
+    # Memory-map the offline geolocation database (GEO_BACKEND=local)
+    load_geo_database()
+    
     # Start chatbot initialization in background task
     # This allows the server to start immediately
     init_task = asyncio.create_task(initialize_chatbot_async())
     
+    # Periodically drop rate limiter state for clients that went quiet
+    sweeper_task = asyncio.create_task(rate_limiter.run_sweeper())
+    
+    # Write buffered query log messages in the background
+    query_log_task = asyncio.create_task(run_query_log_flusher())
+    
     print("[Main] Server is ready to accept connections immediately!", flush=True)
     print("[Main] Chatbot is initializing in the background...", flush=True)
     print("[Main] Note: Documents must be ingested manually using 'python ingest_documents.py'", flush=True)
@@ -76,6 +91,18 @@ async def lifespan(app: FastAPI):
         except asyncio.CancelledError:
             pass
     
+    for task in (sweeper_task, query_log_task):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    flush_query_log()
+    
+    # Close the shared OpenAI and outbound HTTP connection pools
+    await close_llm_clients()
+    await close_http_clients(app.state.http_clients)
+    
     print("Shutdown complete.", flush=True)
     print("=" * 60, flush=True)
 
@@ -142,9 +169,14 @@ async def root() -> Dict[str, Any]:
         "health": "/health",
         "endpoints": {
             "geo": "/api/geo",
+            "geo_batch": "/api/geo/batch",
+            "geo_stats": "/api/geo/stats",
             "chat": "/api/chat",
+            "chat_stream": "/api/chat/stream",
+            "chat_history": "/api/chat/history",
             "chat_status": "/api/status",
             "chat_init_status": "/api/init-status",
+            "chat_cache_stats": "/api/cache-stats",
         }
     }
 
@@ -0,0 +1,1061 @@
+"""
+Test suite for the chatbot API endpoints.
+
+This module contains tests for the /api/chat endpoints using fake
+vector store and LLM components so no OpenAI calls are made.
+"""
+
+import asyncio
+import json
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+import backend.api.services.chatbot_service as chatbot_service
+from backend.api.services.response_cache import SemanticResponseCache
+from backend.api.services.embedding_cache import QueryEmbeddingCache
+from backend.api.services.answer_store import PrecomputedAnswerStore
+from backend.api.services.session_store import SessionStore
+from main import app
+
+# Create test client
+client = TestClient(app)
+
+
+@pytest.fixture
+def fake_documents():
+    """Documents returned by the fake retriever."""
+    return [
+        Document(
+            page_content="Diego worked as a software engineer building FastAPI services.",
+            metadata={"source_file": "work_experience.md", "category": "work"},
+        ),
+        Document(
+            page_content="Diego studied computer science.",
+            metadata={"source_file": "education_awards.md", "category": "education"},
+        ),
+    ]
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiter():
+    """Give every test its own rate limiter so tests don't share request counts."""
+    with patch("backend.api.routes.chat.rate_limiter", chatbot_service.RateLimiter()):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def fresh_response_cache():
+    """Give every test an empty response cache."""
+    cache = SemanticResponseCache(similarity_threshold=0.95)
+    with patch("backend.api.services.chat_pipeline.response_cache", cache):
+        yield cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_query_embedding_cache():
+    """Give every test an empty query embedding cache."""
+    cache = QueryEmbeddingCache(max_entries=8)
+    with patch("backend.api.services.chat_pipeline.query_embedding_cache", cache):
+        yield cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_answer_store(tmp_path):
+    """Give every test an empty precomputed answer store backed by a temporary file."""
+    store = PrecomputedAnswerStore()
+    with patch("backend.api.services.chat_pipeline.answer_store", store), \
+         patch.object(chatbot_service, "PRECOMPUTED_ANSWERS_PATH", tmp_path / "precomputed_answers.json"):
+        yield store
+
+
+@pytest.fixture(autouse=True)
+def fresh_session_store():
+    """Give every test an empty session store."""
+    store = SessionStore(max_sessions=4, max_turns=3)
+    with patch("backend.api.services.chat_pipeline.session_store", store), \
+         patch("backend.api.routes.chat.session_store", store):
+        yield store
+
+
+@pytest.fixture
+def fake_vector_store(fake_documents):
+    """Vector store whose searches return the fake documents."""
+    store = MagicMock()
+    store.asimilarity_search_by_vector = AsyncMock(return_value=fake_documents * 2)
+    return store
+
+
+@pytest.fixture
+def ready_chatbot(fake_vector_store):
+    """Patch the chatbot service with ready, fake core components."""
+    fake_embeddings = MagicMock()
+    fake_embeddings.aembed_query = AsyncMock(return_value=[0.1, 0.2, 0.3])
+    category_retrievers, fallback_retriever = chatbot_service.build_retrievers(fake_vector_store)
+    
+    with patch.object(chatbot_service, "llm", MagicMock()), \
+         patch.object(chatbot_service, "retriever", MagicMock()), \
+         patch.object(chatbot_service, "category_retrievers", category_retrievers), \
+         patch.object(chatbot_service, "fallback_retriever", fallback_retriever), \
+         patch.object(chatbot_service, "embeddings_model", fake_embeddings), \
+         patch.object(chatbot_service, "vector_store", fake_vector_store), \
+         patch.object(chatbot_service.chatbot_state, "documents_ready", True):
+        yield
+
+
+def fake_llm(*args, **kwargs):
+    """Create a fake chat model that answers with a fixed message."""
+    return GenericFakeChatModel(messages=iter([AIMessage(content="Diego builds FastAPI services")]))
+
+
+def parse_sse(body: str):
+    """Parse a Server-Sent Events body into (event, data) tuples."""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@patch.object(chatbot_service, "get_llm", side_effect=fake_llm)
+def test_chat_endpoint_success(mock_llm, ready_chatbot):
+    """Test the non-streaming chat endpoint returns the answer and sources."""
+    response = client.post("/api/chat", json={"message": "What is Diego's work experience?"})
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert data["response"] == "Diego builds FastAPI services"
+    assert data["sources"] == ["work_experience.md", "education_awards.md"]
+
+
+@patch.object(chatbot_service, "get_llm", side_effect=fake_llm)
+def test_chat_stream_sends_sources_then_tokens(mock_llm, ready_chatbot):
+    """Test the streaming endpoint emits sources first, then tokens, then done."""
+    response = client.post("/api/chat/stream", json={"message": "What is Diego's work experience?"})
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    
+    events = parse_sse(response.text)
+    assert events[0] == ("sources", {"sources": ["work_experience.md", "education_awards.md"]})
+    assert events[-1] == ("done", {})
+    
+    tokens = [data["token"] for event, data in events if event == "token"]
+    assert len(tokens) > 1
+    assert "".join(tokens) == "Diego builds FastAPI services"
+
+
+def test_chat_stream_not_ready():
+    """Test the streaming endpoint returns 503 before the chatbot is initialized."""
+    with patch.object(chatbot_service, "llm", None):
+        response = client.post("/api/chat/stream", json={"message": "Hello"})
+    
+    assert response.status_code == 503
+    assert "detail" in response.json()
+
+
+@patch.object(chatbot_service, "get_llm", side_effect=fake_llm)
+def test_chat_filters_categories_in_vector_store(mock_llm, ready_chatbot, fake_vector_store):
+    """Test the category filter is pushed down into the vector store query."""
+    response = client.post("/api/chat", json={"message": "What is Diego's work experience?"})
+    
+    assert response.status_code == 200
+    fake_vector_store.asimilarity_search_by_vector.assert_awaited_once()
+    kwargs = fake_vector_store.asimilarity_search_by_vector.call_args.kwargs
+    assert kwargs["filter"] == {"category": {"$in": ["work", "education", "projects", "summary"]}}
+    assert kwargs["k"] == chatbot_service.RAG_CONFIG["retrieval_k"]
+
+
+@patch.object(chatbot_service, "get_llm", side_effect=fake_llm)
+def test_chat_falls_back_to_unfiltered_search(mock_llm, ready_chatbot, fake_vector_store, fake_documents):
+    """Test an unfiltered search runs when the relevant categories have too few hits."""
+    fake_vector_store.asimilarity_search_by_vector.side_effect = [fake_documents[:1], fake_documents]
+    
+    response = client.post("/api/chat", json={"message": "What is Diego's work experience?"})
+    
+    assert response.status_code == 200
+    assert fake_vector_store.asimilarity_search_by_vector.await_count == 2
+    assert fake_vector_store.asimilarity_search_by_vector.call_args.kwargs["filter"] is None
+    assert response.json()["sources"] == ["work_experience.md", "education_awards.md"]
+
+
+def test_in_memory_vector_index_search():
+    """Test the in-memory index ranks by cosine similarity and applies category masks."""
+    from backend.api.services.vector_index import InMemoryVectorIndex
+    
+    collection = MagicMock()
+    collection.get.return_value = {
+        "ids": ["a", "b", "c"],
+        "embeddings": [[1.0, 0.0], [0.6, 0.8], [0.0, 2.0]],
+        "documents": ["work chunk", "project chunk", "hobby chunk"],
+        "metadatas": [{"category": "work"}, {"category": "projects"}, {"category": "hobbies"}],
+    }
+    index = InMemoryVectorIndex()
+    index.load(collection, index_version="v1")
+    
+    assert index.size == 3
+    assert [doc.id for doc in index.search([1.0, 0.1], k=2)] == ["a", "b"]
+    assert [doc.id for doc in index.search([1.0, 0.1], k=5, categories=["hobbies", "creative"])] == ["c"]
+    assert index.search([1.0, 0.1], k=2, categories=["goals"]) == []
+    assert index.search([1.0, 0.1], k=1)[0].metadata == {"category": "work"}
+
+
+def test_rag_messages_share_static_prefix_and_report_cached_tokens():
+    """Test every prompt starts with the same system message and cached prompt tokens are counted."""
+    from backend.api.services.chat_pipeline import build_rag_messages, PromptTokenStats
+    
+    first = build_rag_messages("What are Diego's skills?", "factual", "Python")
+    second = build_rag_messages("Tell me about his projects", "creative", "Portfolio")
+    assert first[0] is second[0]
+    assert "SECURITY RULES" in first[0].content
+    assert first[-1].content.endswith("The question: What are Diego's skills?")
+    
+    stats = PromptTokenStats()
+    stats.record({"input_tokens": 2000, "output_tokens": 50, "total_tokens": 2050,
+                  "input_token_details": {"cache_read": 1536}})
+    stats.record(None)
+    assert stats.get_stats()["requests"] == 1
+    assert stats.get_stats()["cached_tokens"] == 1536
+    assert stats.get_stats()["uncached_tokens"] == 464
+
+
+def test_pack_chunks_uses_stored_token_counts():
+    """Test whole chunks are packed by relevance into the budget without re-tokenizing."""
+    manager = chatbot_service.TokenManager()
+    docs = [
+        Document(id=name, page_content=name, metadata={"token_count": tokens})
+        for name, tokens in [("a", 1000), ("b", 2500), ("c", 1500), ("d", 600)]
+    ]
+    
+    with patch.object(manager, "count_tokens", side_effect=AssertionError("re-tokenized")):
+        packed = manager.pack_chunks(docs, max_tokens=3000)
+    assert [doc.id for doc in packed] == ["a", "c"]
+    
+    # A chunk larger than the whole budget is cut down rather than dropped
+    oversized = [Document(page_content="word " * 50, metadata={"token_count": 50})]
+    assert manager.count_tokens(manager.pack_chunks(oversized, max_tokens=10)[0].page_content) == 10
+
+
+@pytest.fixture
+def keyword_index():
+    """Lexical index where 'FastAPI' appears in a single chunk."""
+    from backend.api.services.lexical_index import LexicalIndex
+    
+    texts = [f"Diego enjoys music, film and creative work number {i}." for i in range(10)]
+    texts.append("Diego built the portfolio backend with FastAPI and LangChain.")
+    index = LexicalIndex()
+    index.build(
+        [str(i) for i in range(len(texts))],
+        texts,
+        [{"category": "hobbies", "source_file": "hobbies.md"}] * 10
+        + [{"category": "projects", "source_file": "projects.md"}],
+        index_version="v1",
+    )
+    return index
+
+
+def test_lexical_index_bm25_and_fusion(keyword_index):
+    """Test BM25 ranks the keyword chunk first and RRF fuses it with dense results."""
+    from backend.api.services.lexical_index import fuse_results
+    
+    results = keyword_index.search("FastAPI backend", k=3)
+    assert results[0][0].id == "10"
+    assert keyword_index.search("FastAPI", k=3, categories=["hobbies"]) == []
+    assert keyword_index.keyword_confidence("FastAPI") == 1.0
+    assert keyword_index.keyword_confidence("music film") == 0.0
+    
+    dense = [Document(id="3", page_content="x"), Document(id="10", page_content="y")]
+    fused = fuse_results(dense, results, k=2)
+    assert [doc.id for doc in fused] == ["10", "3"]
+
+
+@patch.object(chatbot_service, "get_llm", side_effect=fake_llm)
+def test_chat_keyword_fast_path_skips_embedding(mock_llm, ready_chatbot, keyword_index):
+    """Test a rare-keyword question is retrieved lexically without embedding the query."""
+    with patch("backend.api.services.chat_pipeline.lexical_index", keyword_index):
+        response = client.post("/api/chat", json={"message": "FastAPI?"})
+    
+    assert response.status_code == 200
+    assert response.json()["sources"] == ["projects.md"]
+    chatbot_service.embeddings_model.aembed_query.assert_not_awaited()
+
+
+def test_chat_similar_question_served_from_cache(ready_chatbot, fresh_response_cache):
+    """Test a repeated question is answered from the cache without calling the LLM."""
+    with patch.object(chatbot_service, "get_llm", side_effect=fake_llm) as mock_get_llm:
+        first = client.post("/api/chat", json={"message": "What is Diego's work experience?"})
+        second = client.post("/api/chat", json={"message": "What is Diego's work experience"})
+    
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert mock_get_llm.call_count == 1
+    assert fresh_response_cache.get_stats()["hits"] == 1
+
+
+def test_precomputed_answer_served_without_embedding_or_llm(ready_chatbot, fake_vector_store, fake_documents):
+    """Test answers precomputed at ingest are saved with chunk IDs and served for matching messages."""
+    from backend.api.services.chat_pipeline import precompute_answers
+    
+    fake_vector_store.asimilarity_search_by_vector.return_value = [
+        Document(id=f"chunk-{i}", page_content=doc.page_content, metadata=doc.metadata)
+        for i, doc in enumerate(fake_documents * 2)
+    ]
+    with patch.object(chatbot_service, "get_llm", side_effect=fake_llm) as mock_get_llm:
+        assert asyncio.run(precompute_answers(["What is Diego's work experience?"])) == 1
+        chatbot_service.embeddings_model.aembed_query.reset_mock()
+        response = client.post("/api/chat", json={"message": "  what is diego's WORK experience? "})
+    
+    assert response.status_code == 200
+    assert response.json() == {
+        "response": "Diego builds FastAPI services",
+        "sources": ["work_experience.md", "education_awards.md"],
+    }
+    assert mock_get_llm.call_count == 1
+    chatbot_service.embeddings_model.aembed_query.assert_not_awaited()
+    
+    saved = json.loads(chatbot_service.PRECOMPUTED_ANSWERS_PATH.read_text())
+    assert saved["entries"][0]["chunk_ids"] == ["chunk-0", "chunk-1", "chunk-2", "chunk-3"]
+
+
+def test_precomputed_answer_similarity_and_query_log(tmp_path):
+    """Test similar matches honour the threshold, query type and index version, and log mining."""
+    from backend.api.services.answer_store import mine_frequent_questions
+    
+    store = PrecomputedAnswerStore()
+    store.set_entries([{
+        "question": "What are Diego's skills?", "query_type": "factual", "embedding": [1.0, 0.0],
+        "answer": "Python", "sources": ["skills.md"], "chunk_ids": ["1"], "index_version": "v1",
+    }], index_version="v1")
+    
+    assert store.match_similar([0.99, 0.05], "factual", "v1")["answer"] == "Python"
+    assert store.match_similar([0.5, 0.5], "factual", "v1") is None
+    assert store.match_similar([1.0, 0.0], "creative", "v1") is None
+    assert store.match_exact("what are diego's skills?", "v2") is None
+    
+    assert store.is_current(["What are  Diego's skills?"], "v1")
+    assert not store.is_current(["What are Diego's skills?"], "v2")
+    assert not store.is_current(["What are Diego's skills?", "Who is Diego Beuk?"], "v1")
+    
+    log = tmp_path / "queries.log"
+    log.write_text("what are diego's skills?\nhello\nwhat are diego's skills?\n")
+    assert mine_frequent_questions(str(log), top_n=5) == ["what are diego's skills?"]
+
+
+def test_query_log_is_buffered(tmp_path):
+    """Test logged messages are written in batches rather than one file append per message."""
+    from backend.api.services import answer_store as answer_store_module
+    
+    log = tmp_path / "queries.log"
+    config = {"query_log_enabled": True, "query_log_path": str(log), "query_log_flush_lines": 2}
+    with patch.dict(answer_store_module.ANSWER_STORE_CONFIG, config):
+        answer_store_module.log_query("What are Diego's skills?")
+        assert not log.exists()
+        answer_store_module.log_query("Hello")
+        assert log.read_text() == "what are diego's skills?\nhello\n"
+        answer_store_module.log_query("Who is  Diego?")
+        assert answer_store_module.flush_query_log() == 1
+        assert answer_store_module.flush_query_log() == 0
+    assert log.read_text().splitlines() == ["what are diego's skills?", "hello", "who is diego?"]
+
+
+def test_chat_session_follow_up_reuses_retrieval_and_history(ready_chatbot, fake_vector_store, fake_documents):
+    """Test a follow-up reuses the previous turn's chunks, sends the history and shows up in /chat/history."""
+    docs = [
+        Document(id=f"chunk-{i}", page_content=doc.page_content, metadata=doc.metadata)
+        for i, doc in enumerate(fake_documents)
+    ]
+    fake_vector_store.asimilarity_search_by_vector.return_value = docs * 2
+    fake_vector_store.aget_by_ids = AsyncMock(return_value=list(reversed(docs)))
+    llm = MagicMock()
+    llm.ainvoke = AsyncMock(side_effect=[AIMessage(content="FastAPI services"), AIMessage(content="Mostly Python")])
+    
+    with patch.object(chatbot_service, "get_llm", return_value=llm):
+        first = client.post("/api/chat", json={"message": "What is Diego's work experience?", "sessionId": "s1"})
+        second = client.post("/api/chat", json={"message": "Tell me more", "session_id": "s1"})
+    
+    assert first.status_code == second.status_code == 200
+    assert second.json()["response"] == "Mostly Python"
+    assert fake_vector_store.asimilarity_search_by_vector.await_count == 1
+    chatbot_service.embeddings_model.aembed_query.assert_awaited_once()
+    fake_vector_store.aget_by_ids.assert_awaited_once_with(["chunk-0", "chunk-1", "chunk-0", "chunk-1"])
+    
+    follow_up_messages = llm.ainvoke.await_args.args[0]
+    assert [m.content for m in follow_up_messages[1:3]] == ["What is Diego's work experience?", "FastAPI services"]
+    assert follow_up_messages[-1].content.endswith("The question: Tell me more")
+    
+    history = client.get("/api/chat/history", params={"sessionId": "s1"}).json()
+    assert [(m["sender"], m["content"]) for m in history] == [
+        ("user", "What is Diego's work experience?"), ("ai", "FastAPI services"),
+        ("user", "Tell me more"), ("ai", "Mostly Python"),
+    ]
+    assert client.delete("/api/chat/history", params={"sessionId": "s1"}).json() == {"cleared": True}
+    assert client.get("/api/chat/history", params={"sessionId": "s1"}).json() == []
+    assert client.post("/api/chat", json={"message": "Hi", "session_id": "bad id!"}).status_code == 422
+
+
+def test_session_store_windows_summarizes_and_evicts():
+    """Test old turns fold into the summary, history is windowed by tokens and sessions are evicted LRU."""
+    store = SessionStore(max_sessions=2, max_turns=3)
+    for i in range(5):
+        store.add_turn("a", f"question {i}", f"answer {i}", [], [], tokens=100)
+    
+    summary, turns = store.history_window("a", max_tokens=250)
+    assert [turn.question for turn in turns] == ["question 3", "question 4"]
+    assert summary == "question 0; question 1; question 2"
+    
+    store.add_turn("b", "q", "a", [], [], tokens=1)
+    store.get("a")
+    store.add_turn("c", "q", "a", [], [], tokens=1)
+    assert set(store.sessions) == {"a", "c"}
+    assert store.get_stats()["evictions"] == 1
+
+
+def test_sessions_shared_between_workers(tmp_path):
+    """Test turns added by one worker are seen, folded, evicted and deleted consistently by another."""
+    from backend.api.services.shared_state import SQLiteSharedState
+    
+    path = str(tmp_path / "shared_state.db")
+    worker_a = SessionStore(max_sessions=2, max_turns=3, shared_state=SQLiteSharedState(path))
+    worker_b = SessionStore(max_sessions=2, max_turns=3, shared_state=SQLiteSharedState(path))
+    for i in range(5):
+        (worker_a if i % 2 else worker_b).add_turn("a", f"question {i}", f"answer {i}", ["skills.md"], [f"c{i}"], tokens=100)
+    
+    summary, turns = worker_b.history_window("a", max_tokens=250)
+    assert [turn.question for turn in turns] == ["question 3", "question 4"]
+    assert summary == "question 0; question 1; question 2"
+    assert worker_a.last_turn("a").chunk_ids == ("c4",)
+    
+    async def scenario():
+        await worker_a.aadd_turn("b", "q", "a", [], [], tokens=1)
+        await worker_b.aadd_turn("c", "q", "a", [], [], tokens=1)
+        assert await worker_a.aget("a") is None
+        assert (await worker_b.aget_stats())["sessions"] == 2
+        assert await worker_b.adelete("b")
+        assert (await worker_a.ahistory_window("b", max_tokens=100)) == ("", [])
+    
+    asyncio.run(scenario())
+    assert worker_b.get_stats()["evictions"] == 1
+
+def test_chat_session_new_questions_are_not_treated_as_follow_ups(ready_chatbot, fake_vector_store, fake_documents):
+    """Test questions with terms of their own are retrieved afresh, adding previous chunks only after "Why ..."."""
+    from backend.api.services.chat_pipeline import is_follow_up
+    from backend.api.services.response_cache import RESPONSE_CACHE_CONFIG
+    
+    assert is_follow_up("Tell me more") and is_follow_up("Why?") and is_follow_up("What else?")
+    assert not is_follow_up("Why did Diego study CS?")
+    assert not is_follow_up("Who is Diego?")
+    
+    docs = [
+        Document(id=f"chunk-{i}", page_content=doc.page_content, metadata=doc.metadata)
+        for i, doc in enumerate(fake_documents)
+    ]
+    previous = Document(id="chunk-previous", page_content="Earlier context", metadata=docs[0].metadata)
+    # The first turn retrieves the earlier context, later questions the fake documents
+    fake_vector_store.asimilarity_search_by_vector = AsyncMock(side_effect=[[previous, docs[0]] * 2] + [docs * 2] * 2)
+    fake_vector_store.aget_by_ids = AsyncMock(return_value=[previous, docs[0]])
+    llm = MagicMock()
+    llm.ainvoke = AsyncMock(return_value=AIMessage(content="Answer"))
+    
+    with patch.object(chatbot_service, "get_llm", return_value=llm), \
+            patch.dict(RESPONSE_CACHE_CONFIG, {"enabled": False}):
+        client.post("/api/chat", json={"message": "What is Diego's work experience?", "sessionId": "s1"})
+        
+        response = client.post("/api/chat", json={"message": "Why did Diego study CS?", "sessionId": "s1"})
+        assert response.status_code == 200
+        assert fake_vector_store.asimilarity_search_by_vector.await_count == 2
+        fake_vector_store.aget_by_ids.assert_awaited_once()
+        knowledge = llm.ainvoke.await_args.args[0][-2].content
+        assert knowledge.index(docs[0].page_content) < knowledge.index("Earlier context")
+        
+        response = client.post("/api/chat", json={"message": "Who is Diego?", "sessionId": "s1"})
+        assert response.status_code == 200
+        assert fake_vector_store.asimilarity_search_by_vector.await_count == 3
+        fake_vector_store.aget_by_ids.assert_awaited_once()
+        assert "Earlier context" not in llm.ainvoke.await_args.args[0][-2].content
+
+def test_rate_limiter_token_bucket_blocks_and_sweeps():
+    """Test the bucket allows a burst, blocks for five minutes when empty and sweeps idle keys."""
+    limiter = chatbot_service.RateLimiter()
+    clock = [1000.0]
+    with patch.object(chatbot_service.time, "monotonic", side_effect=lambda: clock[0]):
+        assert all(limiter.check_rate_limit("1.2.3.4", max_requests=3)[0] for _ in range(3))
+        allowed, message = limiter.check_rate_limit("1.2.3.4", max_requests=3)
+        assert not allowed and message.startswith("Rate limit exceeded")
+        
+        clock[0] += 299
+        assert limiter.check_rate_limit("1.2.3.4", max_requests=3)[1].startswith("Blocked until")
+        clock[0] += 2
+        assert limiter.check_rate_limit("1.2.3.4", max_requests=3)[0]
+        assert limiter.check_rate_limit("5.6.7.8", max_requests=3)[0]
+        
+        clock[0] += 60
+        assert limiter.sweep() == 2
+    
+    stats = limiter.get_stats()
+    assert stats["tracked_keys"] == 0
+    assert stats["blocks"] == 1
+    assert stats["rejected"] == 2
+    assert stats["allowed"] == 5
+
+
+def test_rate_limits_and_cached_answers_shared_between_workers(tmp_path):
+    """Test limiters and caches backed by the same SQLite file behave like one across workers."""
+    from backend.api.services.shared_state import SQLiteSharedState
+    
+    path = str(tmp_path / "shared_state.db")
+    worker_a = chatbot_service.RateLimiter(shared_state=SQLiteSharedState(path))
+    worker_b = chatbot_service.RateLimiter(shared_state=SQLiteSharedState(path))
+    assert worker_a.check_rate_limit("1.2.3.4", max_requests=2)[0]
+    assert worker_b.check_rate_limit("1.2.3.4", max_requests=2)[0]
+    assert worker_a.check_rate_limit("1.2.3.4", max_requests=2)[1].startswith("Rate limit exceeded")
+    assert worker_b.check_rate_limit("1.2.3.4", max_requests=2)[1].startswith("Blocked until")
+    assert worker_b.get_stats()["blocked_clients"] == 1
+    
+    cache_a = SemanticResponseCache(similarity_threshold=0.9, shared_state=SQLiteSharedState(path))
+    cache_b = SemanticResponseCache(similarity_threshold=0.9, shared_state=SQLiteSharedState(path))
+    cache_a.put([1.0, 0.0, 0.0], "factual", "answer", ["work_experience.md"], index_version="v1")
+    cached = cache_b.get([0.99, 0.05, 0.0], "factual", index_version="v1")
+    assert cached.response == "answer"
+    assert cached.sources == ["work_experience.md"]
+    assert cache_b.get([1.0, 0.0, 0.0], "factual", index_version="v2") is None
+
+
+
+def test_shared_state_calls_run_off_the_event_loop(tmp_path):
+    """Test the request path reaches SQLite from executor threads and does not wait out a held write lock."""
+    import sqlite3
+    import threading
+    from backend.api.services.shared_state import SQLiteSharedState
+    
+    path = str(tmp_path / "shared_state.db")
+    shared = SQLiteSharedState(path, busy_timeout=0.05)
+    limiter = chatbot_service.RateLimiter(shared_state=shared)
+    cache_a = SemanticResponseCache(similarity_threshold=0.9, shared_state=shared)
+    cache_b = SemanticResponseCache(similarity_threshold=0.9, shared_state=SQLiteSharedState(path))
+    callers = []
+    for name in ("take_token", "add_response", "responses_since"):
+        method = getattr(SQLiteSharedState, name)
+        def record(self, *args, _method=method):
+            callers.append(threading.get_ident())
+            return _method(self, *args)
+        patch.object(SQLiteSharedState, name, record).start()
+    
+    async def scenario():
+        assert (await limiter.acheck_rate_limit("1.2.3.4", max_requests=2))[0]
+        await cache_a.aput([1.0, 0.0, 0.0], "factual", "answer", ["skills.md"], index_version="v1")
+        cached = await cache_b.aget([0.99, 0.05, 0.0], "factual", index_version="v1")
+        assert cached.response == "answer"
+        
+        # Another worker holds the write lock: the check fails open after the short busy timeout
+        blocker = sqlite3.connect(path, isolation_level=None)
+        blocker.execute("BEGIN IMMEDIATE")
+        try:
+            assert await limiter.acheck_rate_limit("1.2.3.4", max_requests=2) == (True, "")
+        finally:
+            blocker.execute("ROLLBACK")
+            blocker.close()
+    
+    try:
+        asyncio.run(scenario())
+    finally:
+        patch.stopall()
+    assert len(callers) == 4
+    assert threading.get_ident() not in callers
+
+
+def test_shared_rate_limiter_sweeper_and_stats_survive_a_locked_database(tmp_path):
+    """Test a locked shared database neither kills the sweeper nor fails the stats endpoint."""
+    import sqlite3
+    from backend.api.services.shared_state import SQLiteSharedState
+    
+    path = str(tmp_path / "shared_state.db")
+    shared = SQLiteSharedState(path, busy_timeout=0.05)
+    limiter = chatbot_service.RateLimiter(shared_state=shared)
+    
+    async def scenario():
+        with patch.object(shared, "rate_limit_counts", side_effect=sqlite3.OperationalError("database is locked")):
+            stats = await limiter.aget_stats()
+        assert stats["shared"] and stats["tracked_keys"] == 0
+        
+        blocker = sqlite3.connect(path, isolation_level=None)
+        blocker.execute("BEGIN IMMEDIATE")
+        try:
+            with patch.object(shared, "sweep_rate_limits", wraps=shared.sweep_rate_limits) as sweep:
+                sweeper = asyncio.create_task(limiter.run_sweeper(interval_seconds=0.01))
+                while sweep.call_count < 3:
+                    await asyncio.sleep(0.01)
+                assert not sweeper.done()
+                sweeper.cancel()
+        finally:
+            blocker.execute("ROLLBACK")
+            blocker.close()
+    
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def ingestion_dirs(tmp_path, monkeypatch):
+    """Point ingestion at a temporary data directory and a fake vector store."""
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+    chroma_path = tmp_path / "chroma_db"
+    store = MagicMock()
+    store.embeddings.aembed_documents = AsyncMock(side_effect=lambda texts: [[0.1, 0.2, 0.3] for _ in texts])
+    store._collection._client.get_max_batch_size.return_value = 5461
+    store._collection.get.return_value = {"ids": []}
+    monkeypatch.setattr(chatbot_service, "DATA_PATH", data_path)
+    monkeypatch.setattr(chatbot_service, "CHROMA_PATH", chroma_path)
+    monkeypatch.setattr(chatbot_service, "INDEX_VERSION_PATH", chroma_path / "index_version")
+    monkeypatch.setattr(chatbot_service, "INGEST_MANIFEST_PATH", chroma_path / "ingest_manifest.json")
+    monkeypatch.setattr(chatbot_service, "vector_store", store)
+    monkeypatch.setitem(chatbot_service.HYBRID_CONFIG, "enabled", False)
+    return data_path, store
+
+
+def test_incremental_ingestion_only_embeds_changed_files(ingestion_dirs):
+    """Test incremental runs skip unchanged files and replace chunks of changed and removed ones."""
+    data_path, store = ingestion_dirs
+    (data_path / "projects.md").write_text("# Projects\n\nDiego built a chatbot.\n", encoding="utf-8")
+    (data_path / "hobbies.md").write_text("# Hobbies\n\nDiego makes music.\n", encoding="utf-8")
+    
+    def ingest():
+        store.reset_mock()
+        assert asyncio.run(chatbot_service.ingest_documents_async(incremental=True))
+    
+    def added_sources():
+        return sorted(metadata["source_file"].rsplit("/", 1)[-1]
+                      for call in store._collection.upsert.call_args_list for metadata in call.kwargs["metadatas"])
+    
+    ingest()
+    assert added_sources() == ["hobbies.md", "projects.md"]
+    manifest = json.loads(chatbot_service.INGEST_MANIFEST_PATH.read_text(encoding="utf-8"))["files"]
+    hobbies_ids = manifest["hobbies.md"]["chunk_ids"]
+    # Chunk IDs are content hashes, so re-adding a chunk is an idempotent upsert
+    upsert = store._collection.upsert.call_args.kwargs
+    assert upsert["ids"] == [
+        chatbot_service.get_chunk_id(Document(page_content=text, metadata=metadata))
+        for text, metadata in zip(upsert["documents"], upsert["metadatas"])
+    ]
+    assert len(upsert["embeddings"]) == 2
+    
+    # Nothing changed: one hash per file, no embedding
+    ingest()
+    store._collection.upsert.assert_not_called()
+    store.delete.assert_not_called()
+    
+    (data_path / "hobbies.md").write_text("# Hobbies\n\nDiego makes music and films.\n", encoding="utf-8")
+    (data_path / "projects.md").unlink()
+    ingest()
+    assert added_sources() == ["hobbies.md"]
+    deleted = store.delete.call_args.kwargs["ids"]
+    assert sorted(deleted) == sorted(hobbies_ids + manifest["projects.md"]["chunk_ids"])
+    manifest = json.loads(chatbot_service.INGEST_MANIFEST_PATH.read_text(encoding="utf-8"))["files"]
+    assert list(manifest) == ["hobbies.md"]
+
+
+def test_full_ingestion_deletes_chunks_of_removed_and_edited_files(ingestion_dirs):
+    """Test a full run clears untracked chunks, deletes stale ones and keeps the manifest tracking everything."""
+    data_path, store = ingestion_dirs
+    (data_path / "projects.md").write_text("# Projects\n\nDiego built a chatbot.\n", encoding="utf-8")
+    (data_path / "hobbies.md").write_text("# Hobbies\n\nDiego makes music.\n", encoding="utf-8")
+    
+    def ingest():
+        store.reset_mock()
+        assert asyncio.run(chatbot_service.ingest_documents_async())
+    
+    # Without a manifest, chunks from an earlier run are found by source and deleted after writing
+    store._collection.get.return_value = {"ids": ["chunk-from-earlier-run"]}
+    ingest()
+    untracked = store._collection.get.call_args.kwargs["where"]["source_file"]["$in"]
+    assert sorted(untracked) == sorted(str(data_path / name) for name in ["hobbies.md", "projects.md"])
+    assert store._collection.delete.call_args.kwargs["ids"] == ["chunk-from-earlier-run"]
+    calls = [name for name, _, _ in store._collection.mock_calls]
+    assert calls.index("upsert") < calls.index("delete")
+    store._collection.get.return_value = {"ids": []}
+    manifest = json.loads(chatbot_service.INGEST_MANIFEST_PATH.read_text(encoding="utf-8"))["files"]
+    
+    (data_path / "hobbies.md").write_text("# Hobbies\n\nDiego makes music and films.\n", encoding="utf-8")
+    (data_path / "projects.md").unlink()
+    ingest()
+    store._collection.delete.assert_not_called()
+    deleted = store.delete.call_args.kwargs["ids"]
+    assert sorted(deleted) == sorted(manifest["hobbies.md"]["chunk_ids"] + manifest["projects.md"]["chunk_ids"])
+    manifest = json.loads(chatbot_service.INGEST_MANIFEST_PATH.read_text(encoding="utf-8"))["files"]
+    assert list(manifest) == ["hobbies.md"]
+    
+    # Unchanged chunks are rewritten in place and not deleted
+    ingest()
+    store.delete.assert_not_called()
+
+
+def test_incremental_ingestion_keeps_chunks_of_files_that_fail_to_parse(ingestion_dirs, monkeypatch):
+    """Test a changed file that fails to parse keeps its old chunks and manifest entry and is retried."""
+    data_path, store = ingestion_dirs
+    (data_path / "projects.md").write_text("# Projects\n\nDiego built a chatbot.\n", encoding="utf-8")
+    (data_path / "hobbies.md").write_text("# Hobbies\n\nDiego makes music.\n", encoding="utf-8")
+    
+    def ingest():
+        store.reset_mock()
+        assert asyncio.run(chatbot_service.ingest_documents_async(incremental=True))
+    
+    ingest()
+    manifest = json.loads(chatbot_service.INGEST_MANIFEST_PATH.read_text(encoding="utf-8"))["files"]
+    
+    # Parsing hobbies.md fails (like a loader timeout), so iter_files leaves it out
+    iter_files = chatbot_service.iter_files
+    
+    async def failing_iter_files(files, *args, **kwargs):
+        async for name, doc_type, docs in iter_files(files, *args, **kwargs):
+            if name != "hobbies.md":
+                yield name, doc_type, docs
+    
+    (data_path / "hobbies.md").write_text("# Hobbies\n\nDiego makes music and films.\n", encoding="utf-8")
+    (data_path / "projects.md").write_text("# Projects\n\nDiego built a chatbot and a game.\n", encoding="utf-8")
+    monkeypatch.setattr(chatbot_service, "iter_files", failing_iter_files)
+    ingest()
+    assert sorted(store.delete.call_args.kwargs["ids"]) == sorted(manifest["projects.md"]["chunk_ids"])
+    kept = json.loads(chatbot_service.INGEST_MANIFEST_PATH.read_text(encoding="utf-8"))["files"]
+    assert kept["hobbies.md"] == manifest["hobbies.md"]
+    
+    # The next run retries the file and only then replaces its chunks
+    monkeypatch.setattr(chatbot_service, "iter_files", iter_files)
+    ingest()
+    assert sorted(store.delete.call_args.kwargs["ids"]) == sorted(manifest["hobbies.md"]["chunk_ids"])
+
+def test_parallel_loading_keeps_order_and_skips_failed_files(tmp_path, monkeypatch):
+    """Test files and PDF page ranges are parsed in a process pool and returned in input order."""
+    import pypdf
+    from backend.api.services import document_loader
+    
+    writer = pypdf.PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(width=72, height=72)
+    with open(tmp_path / "resume.pdf", "wb") as f:
+        writer.write(f)
+    (tmp_path / "notes.txt").write_text("Plain notes", encoding="utf-8")
+    (tmp_path / "about.md").write_text("# About", encoding="utf-8")
+    monkeypatch.setitem(document_loader.DOCUMENT_LOADER_CONFIG, "workers", 2)
+    monkeypatch.setitem(document_loader.DOCUMENT_LOADER_CONFIG, "pdf_pages_per_task", 1)
+    
+    files = [
+        ("about.md", "markdown", tmp_path / "about.md"),
+        ("missing.md", "markdown", tmp_path / "missing.md"),
+        ("notes.txt", "text", tmp_path / "notes.txt"),
+        ("resume.pdf", "PDF", tmp_path / "resume.pdf"),
+    ]
+    loaded = asyncio.run(document_loader.load_files(files))
+    
+    assert [name for name, _, _ in loaded] == ["about.md", "notes.txt", "resume.pdf"]
+    assert loaded[0][2][0].page_content == "# About"
+    assert [doc.metadata["page"] for doc in loaded[2][2]] == [0, 1, 2]
+    assert loaded[2][2][0].metadata["source"] == str(tmp_path / "resume.pdf")
+
+
+def test_data_scan_dispatches_by_extension_and_streams_with_bounded_look_ahead(ingestion_dirs, monkeypatch):
+    """Test one walk finds ingestible files and parsing runs at most a window of files ahead of the consumer."""
+    from backend.api.services import document_loader
+    
+    data_path, _ = ingestion_dirs
+    (data_path / "notes").mkdir()
+    (data_path / ".drafts").mkdir()
+    for name in ["a.md", "notes/b.txt", "notes/c.MD", "d.json", ".hidden.md", ".drafts/e.md"]:
+        (data_path / name).write_text("text", encoding="utf-8")
+    files = chatbot_service.scan_data_files()
+    assert {name: doc_type for name, (doc_type, _) in files.items()} == {
+        "a.md": "markdown", "notes/b.txt": "text", "notes/c.MD": "markdown"
+    }
+    
+    monkeypatch.setitem(document_loader.DOCUMENT_LOADER_CONFIG, "workers", 1)
+    monkeypatch.setitem(document_loader.DOCUMENT_LOADER_CONFIG, "max_files_in_flight", 1)
+    started = []
+    real_parse_task = document_loader.parse_task
+    monkeypatch.setattr(document_loader, "parse_task", lambda task: started.append(task[1]) or real_parse_task(task))
+    
+    async def consume():
+        seen = []
+        async for name, _, _ in document_loader.iter_files((name, t, p) for name, (t, p) in files.items()):
+            seen.append((name, len(started)))
+        return seen
+    
+    assert asyncio.run(consume()) == [("a.md", 1), ("notes/b.txt", 2), ("notes/c.MD", 3)]
+
+
+def test_ingest_pipeline_batches_by_tokens_and_writes_from_one_writer(monkeypatch):
+    """Test chunks are embedded in token-limited batches and upserted in larger write transactions."""
+    from backend.api.services import ingest_pipeline
+    
+    monkeypatch.setitem(ingest_pipeline.INGEST_PIPELINE_CONFIG, "embed_concurrency", 3)
+    monkeypatch.setitem(ingest_pipeline.INGEST_PIPELINE_CONFIG, "write_batch_size", 4)
+    chunks = [Document(page_content=f"chunk {i}", metadata={"token_count": 40}) for i in range(10)]
+    batches = list(ingest_pipeline.token_batches(
+        zip(chunks, [f"id-{i}" for i in range(10)]), max_tokens=100, max_inputs=2048
+    ))
+    assert [len(ids) for _, ids in batches] == [2, 2, 2, 2, 2]
+    
+    embeddings = MagicMock()
+    embeddings.aembed_documents = AsyncMock(side_effect=lambda texts: [[float(t.split()[1])] for t in texts])
+    collection = MagicMock()
+    collection._client.get_max_batch_size.return_value = 5461
+    stats = asyncio.run(ingest_pipeline.embed_and_write(batches, embeddings, collection))
+    
+    assert stats.embed_requests == 5
+    assert stats.written == 10
+    assert stats.write_transactions == 3
+    written = {}
+    for call in collection.upsert.call_args_list:
+        written.update(zip(call.kwargs["ids"], call.kwargs["embeddings"]))
+    assert written == {f"id-{i}": [float(i)] for i in range(10)}
+
+
+def test_ingest_pipeline_writes_never_exceed_client_max_batch_size(monkeypatch):
+    """Test embed batches larger than the client's maximum are written in slices of exactly that size."""
+    from backend.api.services import ingest_pipeline
+    
+    monkeypatch.setitem(ingest_pipeline.INGEST_PIPELINE_CONFIG, "write_batch_size", 1000)
+    chunks = [Document(page_content=f"chunk {i}", metadata={"token_count": 1}) for i in range(11)]
+    batches = list(ingest_pipeline.token_batches(
+        zip(chunks, [f"id-{i}" for i in range(11)]), max_tokens=100, max_inputs=5
+    ))
+    embeddings = MagicMock()
+    embeddings.aembed_documents = AsyncMock(side_effect=lambda texts: [[float(t.split()[1])] for t in texts])
+    collection = MagicMock()
+    collection._client.get_max_batch_size.return_value = 3
+    stats = asyncio.run(ingest_pipeline.embed_and_write(batches, embeddings, collection))
+    
+    sizes = [len(call.kwargs["ids"]) for call in collection.upsert.call_args_list]
+    assert sizes == [3, 3, 3, 2]
+    assert stats.written == 11
+    written = [chunk_id for call in collection.upsert.call_args_list for chunk_id in call.kwargs["ids"]]
+    assert sorted(written) == sorted(f"id-{i}" for i in range(11))
+
+
+def test_ingest_pipeline_surfaces_writer_failure_while_queue_is_full(monkeypatch):
+    """Test a write failing after embedding finished, with the embedded queue full, raises instead of hanging."""
+    import time
+    from backend.api.services import ingest_pipeline
+    
+    monkeypatch.setitem(ingest_pipeline.INGEST_PIPELINE_CONFIG, "embed_concurrency", 1)
+    batches = [([Document(page_content=f"chunk {i}")], [f"id-{i}"]) for i in range(3)]
+    embeddings = MagicMock()
+    embeddings.aembed_documents = AsyncMock(side_effect=lambda texts: [[0.1] for _ in texts])
+    collection = MagicMock()
+    collection._client.get_max_batch_size.return_value = 1
+    
+    def failing_upsert(**kwargs):
+        # The first write outlasts embedding, so the remaining batches fill the queue
+        time.sleep(0.2)
+        raise RuntimeError("disk full")
+    collection.upsert.side_effect = failing_upsert
+    
+    async def run():
+        await asyncio.wait_for(ingest_pipeline.embed_and_write(batches, embeddings, collection), timeout=5)
+    
+    with pytest.raises(RuntimeError, match="disk full"):
+        asyncio.run(run())
+
+def test_document_embedding_cache_embeds_each_text_once(tmp_path):
+    """Test chunk embeddings are persisted by content hash and duplicates are embedded once."""
+    from backend.api.services.embedding_cache import CachedEmbeddings, DocumentEmbeddingCache
+    
+    client = MagicMock(model="text-embedding-3-small", dimensions=None)
+    client.embed_documents.side_effect = lambda texts: [[float(len(text)), 0.5] for text in texts]
+    path = str(tmp_path / "embedding_cache.db")
+    
+    embeddings = CachedEmbeddings(client, DocumentEmbeddingCache(path))
+    assert embeddings.embed_documents(["alpha", "beta", "alpha"]) == [[5.0, 0.5], [4.0, 0.5], [5.0, 0.5]]
+    client.embed_documents.assert_called_once_with(["alpha", "beta"])
+    
+    # A later run (new process) only embeds unseen text
+    embeddings = CachedEmbeddings(client, DocumentEmbeddingCache(path))
+    assert embeddings.embed_documents(["beta", "gamma"]) == [[4.0, 0.5], [5.0, 0.5]]
+    assert client.embed_documents.call_args.args == (["gamma"],)
+    assert embeddings.cache.get_stats()["hits"] == 1
+
+
+def test_document_embedding_cache_async_path_stays_off_the_event_loop(tmp_path):
+    """Test async embedding reads and writes the SQLite cache from a worker thread."""
+    import threading
+    from backend.api.services.embedding_cache import CachedEmbeddings, DocumentEmbeddingCache
+    
+    client = MagicMock(model="text-embedding-3-small", dimensions=None)
+    client.aembed_documents = AsyncMock(side_effect=lambda texts: [[float(len(text)), 0.5] for text in texts])
+    cache = DocumentEmbeddingCache(str(tmp_path / "embedding_cache.db"))
+    threads = []
+    for method in ("get_many", "put_many"):
+        original = getattr(cache, method)
+        
+        def tracked(*args, original=original):
+            threads.append(threading.get_ident())
+            return original(*args)
+        setattr(cache, method, tracked)
+    embeddings = CachedEmbeddings(client, cache)
+    
+    async def run():
+        first = await embeddings.aembed_documents(["alpha", "beta"])
+        second = await embeddings.aembed_documents(["alpha"])
+        return first, second, threading.get_ident()
+    
+    first, second, loop_thread = asyncio.run(run())
+    assert first == [[5.0, 0.5], [4.0, 0.5]] and second == [[5.0, 0.5]]
+    client.aembed_documents.assert_awaited_once_with(["alpha", "beta"])
+    assert len(threads) == 3 and loop_thread not in threads
+
+
+def test_response_cache_similarity_and_invalidation():
+    """Test cache lookups honour the similarity threshold, query type and index version."""
+    cache = SemanticResponseCache(similarity_threshold=0.9)
+    cache.put([1.0, 0.0, 0.0], "factual", "answer", ["work_experience.md"], index_version="v1")
+    
+    assert cache.get([0.99, 0.05, 0.0], "factual", index_version="v1").response == "answer"
+    assert cache.get([0.0, 1.0, 0.0], "factual", index_version="v1") is None
+    assert cache.get([1.0, 0.0, 0.0], "creative", index_version="v1") is None
+    
+    # Re-ingestion changes the index version and drops every entry
+    assert cache.get([1.0, 0.0, 0.0], "factual", index_version="v2") is None
+    assert cache.get_stats()["entries"] == 0
+    assert cache.get_stats()["invalidations"] == 1
+
+
+def test_response_cache_reuses_stacked_matrix_until_entries_change():
+    """Test lookups reuse the stacked embeddings of a query type, rebuilt only after a put or eviction."""
+    from backend.api.services import response_cache as response_cache_module
+    
+    cache = SemanticResponseCache(similarity_threshold=0.9, max_entries=2)
+    cache.put([1.0, 0.0, 0.0], "factual", "a", [])
+    with patch.object(response_cache_module.np, "stack", wraps=response_cache_module.np.stack) as stack:
+        assert cache.get([1.0, 0.0, 0.0], "factual").response == "a"
+        assert cache.get([0.0, 1.0, 0.0], "factual") is None
+        assert stack.call_count == 1
+        
+        cache.put([0.0, 1.0, 0.0], "factual", "b", [])
+        assert cache.get([0.0, 1.0, 0.0], "factual").response == "b"
+        assert stack.call_count == 2
+        
+        # Evicting "a" invalidates the matrix too
+        cache.put([0.0, 0.0, 1.0], "factual", "c", [])
+        assert cache.get([1.0, 0.0, 0.0], "factual") is None
+        assert stack.call_count == 3
+
+def test_response_cache_evicts_least_recently_used():
+    """Test the entry cap evicts the least recently used answer."""
+    cache = SemanticResponseCache(similarity_threshold=0.9, max_entries=2)
+    cache.put([1.0, 0.0, 0.0], "factual", "a", [])
+    cache.put([0.0, 1.0, 0.0], "factual", "b", [])
+    cache.get([1.0, 0.0, 0.0], "factual")
+    cache.put([0.0, 0.0, 1.0], "factual", "c", [])
+    
+    assert cache.get([1.0, 0.0, 0.0], "factual").response == "a"
+    assert cache.get([0.0, 1.0, 0.0], "factual") is None
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_query_embedding_cache_skips_repeated_embedding():
+    """Test repeated queries are embedded once, ignoring case and whitespace, with the original casing."""
+    cache = QueryEmbeddingCache(max_entries=2)
+    embeddings = MagicMock()
+    embeddings.model = "text-embedding-3-small"
+    embeddings.aembed_query = AsyncMock(return_value=[0.1, 0.2])
+    
+    async def scenario():
+        first = await cache.aembed_query(embeddings, "What are  Diego's FastAPI skills?")
+        second = await cache.aembed_query(embeddings, "  what are  diego's fastapi SKILLS? ")
+        return first, second
+    
+    first, second = asyncio.run(scenario())
+    assert first == second == [0.1, 0.2]
+    embeddings.aembed_query.assert_awaited_once_with("What are Diego's FastAPI skills?")
+    assert cache.get_stats()["hits"] == 1
+    assert cache.get_stats()["hit_rate"] == 0.5
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    """Test concurrent callers with the same key share one computation."""
+    from backend.api.utils.single_flight import SingleFlight
+    
+    flights = SingleFlight()
+    calls = []
+    
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+    
+    async def scenario():
+        return await asyncio.gather(*[flights.do("key", compute) for _ in range(5)])
+    
+    assert asyncio.run(scenario()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert flights.get_stats() == {"in_flight": 0, "started": 1, "coalesced": 4}
+
+
+def test_single_flight_keeps_running_while_callers_remain():
+    """Test one caller cancelling does not cancel the computation for the others."""
+    from backend.api.utils.single_flight import SingleFlight
+    
+    flights = SingleFlight()
+    
+    async def compute():
+        await asyncio.sleep(0.01)
+        return "answer"
+    
+    async def scenario():
+        first = asyncio.ensure_future(flights.do("key", compute))
+        second = asyncio.ensure_future(flights.do("key", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+    
+    assert asyncio.run(scenario()) == "answer"
+
+
+def test_llm_clients_share_connection_pool(monkeypatch):
+    """Test one LLM client is created per temperature profile on a shared pool."""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    http_client, http_async_client = chatbot_service.create_openai_http_clients()
+    try:
+        clients = chatbot_service.create_llm_clients(http_client, http_async_client)
+        
+        assert set(clients) == set(chatbot_service.RAG_CONFIG["temperature"])
+        for query_type, llm in clients.items():
+            assert llm.temperature == chatbot_service.RAG_CONFIG["temperature"][query_type]
+            assert llm.http_async_client is http_async_client
+            assert llm.http_client is http_client
+    finally:
+        http_client.close()
+        asyncio.run(http_async_client.aclose())
+
+
+def test_run_until_disconnected_cancels_work():
+    """Test in-flight work is cancelled when the client disconnects."""
+    from fastapi import HTTPException
+    from backend.api.routes.chat import run_until_disconnected
+    
+    async def scenario():
+        cancelled = asyncio.Event()
+        
+        async def slow_work():
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        
+        fake_request = MagicMock()
+        fake_request.receive = AsyncMock(return_value={"type": "http.disconnect"})
+        
+        with pytest.raises(HTTPException) as exc_info:
+            await run_until_disconnected(slow_work(), fake_request)
+        await asyncio.sleep(0)
+        return exc_info.value.status_code, cancelled.is_set()
+    
+    status_code, cancelled = asyncio.run(scenario())
+    assert status_code == 499
+    assert cancelled
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -9,11 +9,32 @@ import pytest
 from unittest.mock import patch, AsyncMock, MagicMock
 from fastapi.testclient import TestClient
 from main import app
+from backend.api.services.geo_service import GeoCache
+from backend.api.utils.circuit_breaker import CircuitBreaker
+from backend.api.services.http_clients import get_ipstack_client
 
 # Create test client
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def fresh_geo_cache():
+    """Give every test an empty geolocation cache and closed circuit breakers."""
+    with patch("backend.api.routes.geo.geo_cache", GeoCache()), \
+            patch("backend.api.routes.geo.ipstack_breaker", CircuitBreaker()), \
+            patch("backend.api.routes.geo.ipstack_bulk_breaker", CircuitBreaker()):
+        yield
+
+
+@pytest.fixture
+def mock_client_class():
+    """Inject the client set as `mock_client_class.return_value` in place of the shared ipstack client."""
+    factory = MagicMock()
+    app.dependency_overrides[get_ipstack_client] = lambda: factory.return_value
+    yield factory
+    app.dependency_overrides.pop(get_ipstack_client, None)
+
+
 @pytest.fixture
 def mock_ipstack_response():
     """Mock successful ipstack API response."""
@@ -42,7 +63,7 @@ def mock_ipstack_response_no_data():
 
 
 def create_mock_httpx_client(mock_response_data, should_fail=False, exception=None):
-    """Helper to create a mock httpx AsyncClient."""
+    """Helper to create a mock of the shared httpx AsyncClient."""
     mock_response = MagicMock()
     mock_response.is_success = not should_fail
     mock_response.json.return_value = mock_response_data
@@ -52,14 +73,10 @@ def create_mock_httpx_client(mock_response_data, should_fail=False, exception=No
         mock_client_instance.get = AsyncMock(side_effect=exception)
     else:
         mock_client_instance.get = AsyncMock(return_value=mock_response)
-    mock_client_instance.__aenter__ = AsyncMock(return_value=mock_client_instance)
-    mock_client_instance.__aexit__ = AsyncMock(return_value=None)
-    
     return mock_client_instance
 
 
-@patch("api.routes.geo.IPSTACK_KEY", "test_api_key_123")
-@patch("api.routes.geo.httpx.AsyncClient")
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
 def test_geo_endpoint_success(mock_client_class, mock_ipstack_response):
     """Test successful location retrieval."""
     mock_client_instance = create_mock_httpx_client(mock_ipstack_response)
@@ -70,13 +87,12 @@ def test_geo_endpoint_success(mock_client_class, mock_ipstack_response):
     assert response.status_code == 200
     data = response.json()
     assert "city" in data
-    assert "country" in data
+    assert "country_name" in data
     assert data["city"] == "Sydney"
-    assert data["country"] == "Australia"
+    assert data["country_name"] == "Australia"
 
 
-@patch("api.routes.geo.IPSTACK_KEY", "test_api_key_123")
-@patch("api.routes.geo.httpx.AsyncClient")
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
 def test_geo_endpoint_partial_data(mock_client_class, mock_ipstack_response_partial):
     """Test location retrieval with partial data (only city)."""
     mock_client_instance = create_mock_httpx_client(mock_ipstack_response_partial)
@@ -87,11 +103,10 @@ def test_geo_endpoint_partial_data(mock_client_class, mock_ipstack_response_part
     assert response.status_code == 200
     data = response.json()
     assert data["city"] == "Sydney"
-    assert data["country"] is None
+    assert data["country_name"] is None
 
 
-@patch("api.routes.geo.IPSTACK_KEY", "test_api_key_123")
-@patch("api.routes.geo.httpx.AsyncClient")
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
 def test_geo_endpoint_no_data(mock_client_class, mock_ipstack_response_no_data):
     """Test location retrieval with no location data."""
     mock_client_instance = create_mock_httpx_client(mock_ipstack_response_no_data)
@@ -102,10 +117,10 @@ def test_geo_endpoint_no_data(mock_client_class, mock_ipstack_response_no_data):
     assert response.status_code == 200
     data = response.json()
     assert data["city"] is None
-    assert data["country"] is None
+    assert data["country_name"] is None
 
 
-@patch("api.routes.geo.IPSTACK_KEY", None)
+@patch("backend.api.routes.geo.IPSTACK_KEY", None)
 def test_geo_endpoint_missing_api_key():
     """Test endpoint returns error when IPSTACK_KEY is not configured."""
     response = client.get("/api/geo")
@@ -116,8 +131,7 @@ def test_geo_endpoint_missing_api_key():
     assert "IPSTACK_KEY not configured" in data["detail"]
 
 
-@patch("api.routes.geo.IPSTACK_KEY", "test_api_key_123")
-@patch("api.routes.geo.httpx.AsyncClient")
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
 def test_geo_endpoint_ipstack_error(mock_client_class):
     """Test endpoint handles ipstack API error response."""
     # Create a mock response that fails
@@ -129,8 +143,6 @@ def test_geo_endpoint_ipstack_error(mock_client_class):
     
     mock_client_instance = MagicMock()
     mock_client_instance.get = AsyncMock(return_value=mock_response)
-    mock_client_instance.__aenter__ = AsyncMock(return_value=mock_client_instance)
-    mock_client_instance.__aexit__ = AsyncMock(return_value=None)
     mock_client_class.return_value = mock_client_instance
     
     response = client.get("/api/geo")
@@ -141,8 +153,7 @@ def test_geo_endpoint_ipstack_error(mock_client_class):
     assert "ipstack API returned an error" in data["detail"]
 
 
-@patch("api.routes.geo.IPSTACK_KEY", "test_api_key_123")
-@patch("api.routes.geo.httpx.AsyncClient")
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
 def test_geo_endpoint_timeout(mock_client_class):
     """Test endpoint handles timeout from ipstack API."""
     import httpx
@@ -158,8 +169,7 @@ def test_geo_endpoint_timeout(mock_client_class):
     assert "timeout" in data["detail"].lower()
 
 
-@patch("api.routes.geo.IPSTACK_KEY", "test_api_key_123")
-@patch("api.routes.geo.httpx.AsyncClient")
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
 def test_geo_endpoint_network_error(mock_client_class):
     """Test endpoint handles network errors from ipstack API."""
     import httpx
@@ -175,8 +185,7 @@ def test_geo_endpoint_network_error(mock_client_class):
     assert "Failed to reach ipstack API" in data["detail"]
 
 
-@patch("api.routes.geo.IPSTACK_KEY", "test_api_key_123")
-@patch("api.routes.geo.httpx.AsyncClient")
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
 def test_geo_endpoint_response_structure(mock_client_class, mock_ipstack_response):
     """Test that the response has the correct structure."""
     mock_client_instance = create_mock_httpx_client(mock_ipstack_response)
@@ -190,13 +199,12 @@ def test_geo_endpoint_response_structure(mock_client_class, mock_ipstack_respons
     # Verify response structure
     assert isinstance(data, dict)
     assert "city" in data
-    assert "country" in data
+    assert "country_name" in data
     assert isinstance(data["city"], (str, type(None)))
-    assert isinstance(data["country"], (str, type(None)))
+    assert isinstance(data["country_name"], (str, type(None)))
 
 
-@patch("api.routes.geo.IPSTACK_KEY", "test_api_key_123")
-@patch("api.routes.geo.httpx.AsyncClient")
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
 def test_geo_endpoint_uses_correct_url(mock_client_class, mock_ipstack_response):
     """Test that the endpoint calls ipstack with correct URL and parameters."""
     mock_client_instance = create_mock_httpx_client(mock_ipstack_response)
@@ -213,7 +221,320 @@ def test_geo_endpoint_uses_correct_url(mock_client_class, mock_ipstack_response)
     url = call_args[0][0] if call_args[0] else call_args.kwargs.get("url", "")
     assert "api.ipstack.com/check" in url
     assert "access_key=test_api_key_123" in url
-    assert "fields=city,country_name" in url
+    # The full ipstack response is returned, without field restrictions
+    assert "fields=" not in url
+
+
+@pytest.fixture
+def proxied_client():
+    """Client connecting through a trusted reverse proxy at 10.0.0.2."""
+    from backend.api.services.geo_service import parse_networks
+    
+    with patch.dict("backend.api.services.geo_service.GEO_CONFIG", {"trusted_proxies": parse_networks("10.0.0.0/8")}):
+        yield TestClient(app, client=("10.0.0.2", 50000))
+
+
+def test_get_client_ip_trusts_forwarded_for_only_from_proxies():
+    """Test X-Forwarded-For is read right to left and ignored from untrusted peers."""
+    from starlette.requests import Request
+    from backend.api.services.geo_service import get_client_ip, parse_networks
+    
+    def request(peer, forwarded):
+        return Request({"type": "http", "client": (peer, 1234), "headers": [(b"x-forwarded-for", forwarded.encode())]})
+    
+    trusted = parse_networks("10.0.0.0/8")
+    assert get_client_ip(request("10.0.0.2", "6.6.6.6, 8.8.8.8, 10.0.0.9"), trusted) == "8.8.8.8"
+    assert get_client_ip(request("1.1.1.1", "8.8.8.8"), trusted) == "1.1.1.1"
+    assert get_client_ip(request("10.0.0.2", ""), trusted) == "10.0.0.2"
+
+
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
+def test_geo_endpoint_caches_lookup_per_client_ip(mock_client_class, proxied_client, mock_ipstack_response):
+    """Test each client IP is looked up once and repeat visits are served from the cache."""
+    mock_client_instance = create_mock_httpx_client(mock_ipstack_response)
+    mock_client_class.return_value = mock_client_instance
+    
+    for ip in ["8.8.8.8", "8.8.8.8", "1.1.1.1"]:
+        response = proxied_client.get("/api/geo", headers={"X-Forwarded-For": ip})
+        assert response.status_code == 200
+        assert response.json()["city"] == "Sydney"
+    
+    urls = [call.args[0] for call in mock_client_instance.get.await_args_list]
+    assert len(urls) == 2
+    assert "api.ipstack.com/8.8.8.8?access_key=test_api_key_123" in urls[0]
+    assert "api.ipstack.com/1.1.1.1?" in urls[1]
+
+
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
+def test_geo_endpoint_caches_failures_briefly(mock_client_class, proxied_client):
+    """Test a failed lookup is negatively cached instead of retried on every reload."""
+    import httpx
+    
+    mock_client_instance = create_mock_httpx_client({}, exception=httpx.TimeoutException("Request timeout"))
+    mock_client_class.return_value = mock_client_instance
+    
+    for _ in range(3):
+        response = proxied_client.get("/api/geo", headers={"X-Forwarded-For": "8.8.8.8"})
+        assert response.status_code == 504
+    
+    assert mock_client_instance.get.await_count == 1
+
+
+@pytest.fixture
+def local_geo_database(tmp_path):
+    """Offline geolocation database compiled from a small IPv4/IPv6 range CSV."""
+    from backend.api.services.geo_database import GeoDatabase, compile_database
+    
+    csv_path = tmp_path / "ranges.csv"
+    csv_path.write_text(
+        "ip_start,ip_end,country_code,country_name,region_name,city,latitude,longitude\n"
+        "1.1.1.0,1.1.1.255,AU,Australia,New South Wales,Sydney,-33.87,151.21\n"
+        "8.8.8.0,8.8.8.255,US,United States,California,Mountain View,37.39,-122.08\n"
+        "2001:4860::,2001:4860:ffff:ffff:ffff:ffff:ffff:ffff,US,United States,California,Mountain View,37.39,-122.08\n"
+    )
+    compile_database(str(csv_path), str(tmp_path / "geo_db"))
+    database = GeoDatabase()
+    assert database.load(str(tmp_path / "geo_db"))
+    return database
+
+
+def test_geo_database_lookup(local_geo_database):
+    """Test IPv4, IPv6 and IPv4-mapped lookups, and addresses outside every range."""
+    assert local_geo_database.lookup("1.1.1.1")["city"] == "Sydney"
+    assert local_geo_database.lookup("8.8.8.255")["country_code"] == "US"
+    assert local_geo_database.lookup("2001:4860:4860::8888")["type"] == "ipv6"
+    assert local_geo_database.lookup("::ffff:1.1.1.1")["city"] == "Sydney"
+    assert local_geo_database.lookup("8.8.9.1") is None
+    assert local_geo_database.lookup("2001:4861::1") is None
+    assert local_geo_database.get_stats()["locations"] == 2
+
+
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
+def test_geo_endpoint_local_backend(mock_client_class, proxied_client, local_geo_database, mock_ipstack_response):
+    """Test the local backend answers without ipstack and falls back to it on a miss."""
+    mock_client_instance = create_mock_httpx_client(mock_ipstack_response)
+    mock_client_class.return_value = mock_client_instance
+    
+    with patch.dict("backend.api.routes.geo.GEO_DATABASE_CONFIG", {"backend": "local", "ipstack_fallback": True}), \
+            patch("backend.api.routes.geo.geo_database", local_geo_database):
+        response = proxied_client.get("/api/geo", headers={"X-Forwarded-For": "8.8.8.8"})
+        assert response.status_code == 200
+        assert response.json()["city"] == "Mountain View"
+        assert mock_client_instance.get.await_count == 0
+        
+        response = proxied_client.get("/api/geo", headers={"X-Forwarded-For": "9.9.9.9"})
+        assert response.status_code == 200
+        assert response.json()["city"] == "Sydney"
+        assert mock_client_instance.get.await_count == 1
+        
+        with patch.dict("backend.api.routes.geo.GEO_DATABASE_CONFIG", {"ipstack_fallback": False}):
+            response = proxied_client.get("/api/geo", headers={"X-Forwarded-For": "9.9.9.8"})
+            assert response.status_code == 404
+
+
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
+def test_geo_endpoint_circuit_breaker_fails_fast(mock_client_class, proxied_client):
+    """Test repeated ipstack failures open the breaker so later lookups fail without calling ipstack."""
+    import httpx
+    
+    mock_client_instance = create_mock_httpx_client({}, exception=httpx.TimeoutException("Request timeout"))
+    mock_client_class.return_value = mock_client_instance
+    
+    with patch("backend.api.routes.geo.ipstack_breaker", CircuitBreaker(failure_threshold=2)) as breaker:
+        for ip in ["8.8.8.8", "8.8.4.4"]:
+            assert proxied_client.get("/api/geo", headers={"X-Forwarded-For": ip}).status_code == 504
+        
+        response = proxied_client.get("/api/geo", headers={"X-Forwarded-For": "1.1.1.1"})
+        assert response.status_code == 503
+        assert mock_client_instance.get.await_count == 2
+        
+        stats = client.get("/api/geo/stats").json()["circuit_breaker"]
+        assert stats["state"] == "open"
+        assert stats["rejected"] == 1
+        
+        # After the reset timeout one probe is let through and closes the circuit again
+        breaker.opened_at -= breaker.reset_timeout
+        mock_client_instance.get = create_mock_httpx_client({"city": "Sydney"}).get
+        response = proxied_client.get("/api/geo", headers={"X-Forwarded-For": "1.1.1.1"})
+        assert response.status_code == 200
+        assert breaker.state == "closed"
+
+
+def test_cancelled_half_open_probe_releases_the_breaker():
+    """Test a probe cancelled mid-request (client disconnect, timeout) does not leave the breaker stuck open."""
+    import asyncio
+    from backend.api.routes.geo import fetch_location_guarded
+    
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+    hanging_client = MagicMock()
+    
+    async def hang(url):
+        await asyncio.Event().wait()
+    hanging_client.get = AsyncMock(side_effect=hang)
+    
+    async def scenario():
+        probe = asyncio.create_task(fetch_location_guarded(hanging_client, "1.1.1.1"))
+        await asyncio.sleep(0)
+        assert breaker.state == "half_open" and breaker.probe_in_flight
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+    
+    with patch("backend.api.routes.geo.ipstack_breaker", breaker):
+        asyncio.run(scenario())
+        assert not breaker.probe_in_flight
+        
+        # Any other error escaping the request counts as a failed probe
+        with patch("backend.api.routes.geo.fetch_location", AsyncMock(side_effect=ValueError("bad body"))):
+            with pytest.raises(ValueError):
+                asyncio.run(fetch_location_guarded(hanging_client, "1.1.1.1"))
+        assert breaker.state == "open" and not breaker.probe_in_flight
+
+def test_stale_lookup_served_and_refreshed_in_background(mock_ipstack_response):
+    """Test an expired lookup is returned immediately and replaced by a background refresh."""
+    import asyncio
+    from types import SimpleNamespace
+    from backend.api.routes import geo
+    
+    mock_client_instance = create_mock_httpx_client(mock_ipstack_response)
+    app_stub = SimpleNamespace(state=SimpleNamespace(http_clients={"ipstack": mock_client_instance}))
+    cache = GeoCache(ttl_seconds=0, stale_ttl_seconds=3600)
+    cache.put("8.8.8.8", {"city": "Old City"})
+    
+    async def run():
+        body = await geo.lookup_ipstack(mock_client_instance, "8.8.8.8", app_stub)
+        await asyncio.gather(*list(geo._refresh_tasks.values()))
+        return body
+    
+    with patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123"), \
+            patch("backend.api.routes.geo.geo_cache", cache):
+        assert asyncio.run(run()) == {"city": "Old City"}
+    
+    assert mock_client_instance.get.await_count == 1
+    assert cache.entries["8.8.8.8"].body == mock_ipstack_response
+    stats = cache.get_stats()
+    assert stats["stale_hits"] == 1
+    assert stats["refreshes"] == 1
+
+
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
+def test_geo_batch_deduplicates_and_fetches_misses_in_bulk(mock_client_class):
+    """Test a batch answers cache hits locally and sends the remaining IPs upstream in chunks."""
+    from backend.api.routes import geo
+    
+    ips = ["1.1.1.1", "8.8.8.8", "8.8.4.4", "9.9.9.9"]
+    mock_response = MagicMock()
+    mock_response.is_success = True
+    mock_response.json.side_effect = lambda: [{"ip": ip, "city": f"City {ip}"} for ip in ips[1:]]
+    mock_client_instance = MagicMock()
+    mock_client_instance.get = AsyncMock(return_value=mock_response)
+    mock_client_class.return_value = mock_client_instance
+    geo.geo_cache.put("1.1.1.1", {"ip": "1.1.1.1", "city": "Sydney"})
+    
+    with patch.dict("backend.api.routes.geo.GEO_CONFIG", {"bulk_chunk_size": 2, "batch_api_key": "batch-key"}):
+        response = client.post("/api/geo/batch", json={"ips": ips + ["8.8.8.8", "10.0.0.1", "not-an-ip"]},
+                               headers={"X-API-Key": "batch-key"})
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert data["unique_ips"] == 6
+    assert data["cache_hits"] == 1
+    assert data["upstream_requests"] == 2
+    assert data["results"]["1.1.1.1"]["city"] == "Sydney"
+    assert data["results"]["9.9.9.9"]["city"] == "City 9.9.9.9"
+    assert data["results"]["10.0.0.1"] == {"error": "Not a public IP address"}
+    assert data["results"]["not-an-ip"] == {"error": "Invalid IP address"}
+    
+    urls = sorted(call.args[0] for call in mock_client_instance.get.await_args_list)
+    assert "api.ipstack.com/8.8.8.8,8.8.4.4?" in urls[0]
+    assert "api.ipstack.com/9.9.9.9?" in urls[1]
+    
+    # Looked-up IPs are cached for later batches
+    assert geo.geo_cache.get("9.9.9.9").body["city"] == "City 9.9.9.9"
+
+
+
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
+def test_geo_batch_requires_api_key_and_is_rate_limited(mock_client_class):
+    """Test batch lookups are disabled without a configured key, reject wrong keys, oversized bodies and floods."""
+    from backend.api.services.chatbot_service import RateLimiter
+    from backend.api.services.geo_service import GEO_CONFIG
+    
+    mock_client_class.return_value = create_mock_httpx_client([{"ip": "8.8.8.8", "city": "Mountain View"}])
+    body = {"ips": ["8.8.8.8"]}
+    
+    assert client.post("/api/geo/batch", json=body).status_code == 503
+    
+    config = {"batch_api_key": "batch-key", "batch_rate_limit": 2}
+    with patch.dict("backend.api.routes.geo.GEO_CONFIG", config), \
+            patch("backend.api.routes.geo.rate_limiter", RateLimiter()):
+        assert client.post("/api/geo/batch", json=body).status_code == 401
+        assert client.post("/api/geo/batch", json=body, headers={"X-API-Key": "wrong"}).status_code == 401
+        
+        headers = {"X-API-Key": "batch-key"}
+        oversized = {"ips": ["8.8.8.8"] * (GEO_CONFIG["bulk_max_ips"] + 1)}
+        assert client.post("/api/geo/batch", json=oversized, headers=headers).status_code == 422
+        
+        assert client.post("/api/geo/batch", json=body, headers=headers).status_code == 200
+        assert client.post("/api/geo/batch", json=body, headers=headers).status_code == 200
+        assert client.post("/api/geo/batch", json=body, headers=headers).status_code == 429
+
+
+def test_failed_background_refresh_is_logged_and_cleared(capsys):
+    """Test a refresh failing with a non-HTTP error is counted and no longer marked in flight."""
+    import asyncio
+    from types import SimpleNamespace
+    from backend.api.routes import geo
+    
+    app_stub = SimpleNamespace(state=SimpleNamespace(http_clients={"ipstack": MagicMock()}))
+    cache = GeoCache(ttl_seconds=0, stale_ttl_seconds=3600)
+    
+    async def run():
+        geo.schedule_refresh(app_stub, "8.8.8.8")
+        assert "8.8.8.8" in geo._refresh_tasks
+        await asyncio.gather(*list(geo._refresh_tasks.values()))
+    
+    with patch("backend.api.routes.geo.geo_cache", cache), \
+            patch("backend.api.routes.geo.fetch_location_guarded", AsyncMock(side_effect=RuntimeError("boom"))):
+        asyncio.run(run())
+    
+    assert geo._refresh_tasks == {}
+    assert cache.get_stats()["refresh_failures"] == 1
+    assert "Background refresh of 8.8.8.8 failed: boom" in capsys.readouterr().out
+
+
+@patch("backend.api.routes.geo.IPSTACK_KEY", "test_api_key_123")
+def test_failing_geo_batch_leaves_visitor_lookups_working(mock_client_class, mock_ipstack_response):
+    """Test batch failures open only the bulk breaker, and ipstack plan rejections do not count as failures."""
+    import httpx
+    from backend.api.routes import geo
+    
+    rejected = create_mock_httpx_client({"success": False, "error": {"info": "Bulk requests not supported"}})
+    rejected.get.return_value.is_success = True
+    headers = {"X-API-Key": "batch-key"}
+    
+    with patch.dict("backend.api.routes.geo.GEO_CONFIG", {"batch_api_key": "batch-key"}), \
+            patch("backend.api.routes.geo.ipstack_bulk_breaker", CircuitBreaker(failure_threshold=1)) as bulk_breaker:
+        mock_client_class.return_value = rejected
+        response = client.post("/api/geo/batch", json={"ips": ["8.8.8.8"]}, headers=headers)
+        assert "error" in response.json()["results"]["8.8.8.8"]
+        assert bulk_breaker.state == "closed"
+        
+        mock_client_class.return_value = create_mock_httpx_client({}, exception=httpx.ConnectError("refused"))
+        client.post("/api/geo/batch", json={"ips": ["1.1.1.1"]}, headers=headers)
+        assert bulk_breaker.state == "open"
+        
+        mock_client_class.return_value = create_mock_httpx_client(mock_ipstack_response)
+        response = client.get("/api/geo")
+        assert response.status_code == 200
+        assert response.json() == mock_ipstack_response
+        
+        stats = client.get("/api/geo/stats").json()
+        assert stats["circuit_breaker"]["state"] == "closed"
+        assert stats["bulk_circuit_breaker"]["state"] == "open"
+    assert geo.ipstack_breaker.state == "closed"
 
 
 if __name__ == "__main__":